@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import time
+import httpx
+import numpy as np
+from typing import Iterable, Optional
+from weaviate_client import (
+    BATCH_BACKOFF,
+    BATCH_MAX_RETRIES,
+    BATCH_NUM_WORKERS,
+    BATCH_SIZE,
+    MULTI_QUERY_SIZE,
+    BaseWeaviateClient,
+    created_since,
+    make_class_config,
+    object_hash,
+)
+from hash_store import DEFAULT_HASH_STORE
+from query_cache import QueryCache
+from metadata import METADATA_FIELDS, METADATA_PROPERTIES, where_to_graphql
+
+MAX_CONNECTIONS = 20
+TIMEOUT = 30.0
+
+
+class AsyncImportBatch:
+    """
+    Async counterpart of weaviate_client.ImportBatch. Full batches are posted to
+    /v1/batch/objects as background tasks, at most `num_workers` requests are in flight.
+    """
+
+    def __init__(
+        self,
+        client,
+        batch_size: int = BATCH_SIZE,
+        num_workers: int = BATCH_NUM_WORKERS,
+        max_retries: int = BATCH_MAX_RETRIES,
+        backoff: float = BATCH_BACKOFF,
+    ) -> None:
+        self.client = client
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.report = []
+        self.num_added = 0
+        self.failed = []
+        self._buffer = []
+        self._tasks = []
+        self._workers = asyncio.Semaphore(num_workers)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.flush()
+        await asyncio.gather(*self._tasks)
+
+    async def add(
+        self,
+        data_object: dict,
+        vector: Optional[list] = None,
+        object_uuid: Optional[str] = None,
+    ) -> bool:
+        if await self.client.is_duplicate(data_object):
+            print("Object already exists, skipping addition")
+            return False
+        if object_uuid is None:
+            object_uuid = self.client.object_uuid(data_object)
+        self._buffer.append(self.client.to_rest_object(data_object, object_uuid, vector))
+        self.num_added += 1
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+        return True
+
+    async def add_image(
+        self,
+        img: np.ndarray,
+        original_file_path: str,
+        file_path: str,
+        vector: Optional[np.ndarray] = None,
+    ) -> bool:
+        data_object = self.client.make_data_object(img, original_file_path, file_path)
+        if vector is not None:
+            vector = np.asarray(vector).ravel().tolist()
+        return await self.add(data_object, vector=vector)
+
+    async def flush(self) -> None:
+        # a worker slot is taken before the batch is scheduled, so add waits while
+        # num_workers batches are in flight and the buffered objects stay bounded
+        if self._buffer:
+            objects = self._buffer
+            self._buffer = []
+            await self._workers.acquire()
+            task = asyncio.ensure_future(self._send(objects))
+            task.add_done_callback(lambda _: self._workers.release())
+            self._tasks.append(task)
+
+    async def _send(self, objects: list) -> None:
+        batch_number = len(self.report)
+        entry = {"batch": batch_number, "objects": len(objects), "failed": 0, "errors": []}
+        self.report.append(entry)
+        inserted = []
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                results = await self.client.post_batch(objects)
+            except httpx.HTTPError as e:
+                entry["errors"].append({"attempt": attempt, "errors": str(e)})
+                continue
+            retry = []
+            for obj, result in zip(objects, results):
+                result_errors = result.get("result", {}).get("errors")
+                if result_errors:
+                    entry["errors"].append({"id": obj["id"], "errors": result_errors})
+                    retry.append(obj)
+                elif object_hash(obj["properties"]) is not None:
+                    inserted.append((object_hash(obj["properties"]), obj["id"]))
+            objects = retry
+            if not objects:
+                break
+        entry["failed"] = len(objects)
+        self.failed.extend(obj["id"] for obj in objects)
+        self.client.stats.record_import(entry["objects"] - len(objects))
+        await asyncio.to_thread(
+            self.client.hash_store.add_many, self.client.hash_key, inserted
+        )
+        if inserted:
+            self.client.invalidate_cache()
+
+
+class AsyncWeaviateClient(BaseWeaviateClient):
+    """
+    asyncio version of WeaviateClient talking to the REST and GraphQL endpoints directly
+    through one pooled keep alive http client, so queries and imports can overlap.
+    Use as `async with AsyncWeaviateClient(...) as client:` or call `close()`.
+    """
+
+    def __init__(
+        self,
+        db_adr: str,
+        schema: str = "",
+        image_encoding: str = "",
+        hash_store_path: str = DEFAULT_HASH_STORE,
+        query_cache: Optional[QueryCache] = None,
+        max_connections: int = MAX_CONNECTIONS,
+        timeout: float = TIMEOUT,
+        vectorizer: str = "img2vec-neural",
+        store_image: bool = True,
+        model_id: str = "",
+        rerank: int = 0,
+        rerank_metric: str = "cosine",
+    ) -> None:
+        super().__init__(
+            schema,
+            image_encoding,
+            hash_store_path,
+            query_cache,
+            vectorizer=vectorizer,
+            store_image=store_image,
+            model_id=model_id,
+            rerank=rerank,
+            rerank_metric=rerank_metric,
+            db_adr=db_adr,
+        )
+        self.timeout = timeout
+        self.http = httpx.AsyncClient(
+            base_url=db_adr.rstrip("/") + "/v1",
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.http.aclose()
+
+    async def ensure_schema(self) -> None:
+        """
+        Async counterpart of WeaviateClient.ensure_schema, call once before the first
+        query or import.
+        """
+        response = await self.http.get(f"/schema/{self.schema}")
+        if response.status_code == 404:
+            # no collection, no objects, see WeaviateClient.ensure_schema
+            await asyncio.to_thread(self.hash_store.clear, self.hash_key)
+            if self.needs_vectors:
+                response = await self.http.post(
+                    "/schema",
+                    json=make_class_config(
+                        self.schema, self.vectorizer, self.model_id
+                    ),
+                )
+                response.raise_for_status()
+            return
+        response.raise_for_status()
+        class_config = response.json()
+        self.check_model_id(class_config)
+        existing = [prop["name"] for prop in class_config.get("properties", [])]
+        for prop in METADATA_PROPERTIES:
+            if prop["name"] not in existing:
+                response = await self.http.post(
+                    f"/schema/{self.schema}/properties", json=prop
+                )
+                response.raise_for_status()
+
+    def to_rest_object(
+        self, data_object: dict, object_uuid: str, vector: Optional[list] = None
+    ) -> dict:
+        properties = dict(data_object)
+        rest_object = {"class": self.schema, "id": object_uuid, "properties": properties}
+        if vector is not None:
+            rest_object["vector"] = vector
+        return rest_object
+
+    async def add_to_db(
+        self,
+        img: np.ndarray,
+        original_file_path: str,
+        file_path: str,
+        vector: Optional[np.ndarray] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        data = self.make_data_object(img, original_file_path, file_path)
+        if vector is not None:
+            vector = np.asarray(vector).ravel().tolist()
+        await self.create_entry(data, vector=vector, timeout=timeout)
+
+    async def is_duplicate(self, data_object: dict) -> bool:
+        """
+        Async counterpart of WeaviateClient.check_for_duplicate_entries, answered by the
+        local hash store without a request to weaviate. The sqlite calls of the hash
+        store run in a thread, here and everywhere else, so they never block the loop.
+        """
+        return await asyncio.to_thread(self.check_for_duplicate_entries, data_object)
+
+    async def create_entry(
+        self,
+        data_object: dict,
+        vector: Optional[list] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        does_exist = await self.is_duplicate(data_object)
+        if not does_exist:
+            obj_uuid = self.object_uuid(data_object)
+            rest_object = self.to_rest_object(data_object, obj_uuid, vector)
+            response = await self.http.post(
+                "/objects", json=rest_object, timeout=timeout or self.timeout
+            )
+            if response.status_code == 422 and "already exists" in response.text:
+                # known to weaviate but not to the local hash store, overwrite it
+                response = await self.http.put(
+                    f"/objects/{self.schema}/{obj_uuid}",
+                    json=rest_object,
+                    timeout=timeout or self.timeout,
+                )
+            response.raise_for_status()
+            await asyncio.to_thread(
+                self.hash_store.add, self.hash_key, object_hash(data_object), obj_uuid
+            )
+            self.stats.record_import(1)
+            self.invalidate_cache()
+        else:
+            print("Object already exists, skipping addition")
+
+    async def delete_entry(
+        self,
+        obj_uuid: str,
+        img_hash: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> bool:
+        response = await self.http.delete(
+            f"/objects/{self.schema}/{obj_uuid}", timeout=timeout or self.timeout
+        )
+        deleted = response.status_code == 204
+        if not deleted:
+            print(f"Failed to delete {obj_uuid}. Reason: {response.text}")
+        if img_hash is not None:
+            await asyncio.to_thread(self.hash_store.remove, self.hash_key, img_hash)
+        self.invalidate_cache()
+        return deleted
+
+    def batch(self, **kwargs) -> AsyncImportBatch:
+        """
+        Returns an async context manager for batched imports, e.g.
+
+            async with client.batch(batch_size=200) as batch:
+                await batch.add_image(img, original_file_path, file_path)
+            print(batch.report)
+        """
+        return AsyncImportBatch(self, **kwargs)
+
+    async def add_many(self, data_objects: Iterable[dict], **kwargs) -> list:
+        async with self.batch(**kwargs) as batch:
+            for data_object in data_objects:
+                await batch.add(data_object)
+        return batch.report
+
+    async def post_batch(self, objects: list, timeout: Optional[float] = None) -> list:
+        response = await self.http.post(
+            "/batch/objects",
+            json={"objects": objects},
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def graphql(self, query: str, timeout: Optional[float] = None) -> dict:
+        response = await self.http.post(
+            "/graphql", json={"query": query}, timeout=timeout or self.timeout
+        )
+        response.raise_for_status()
+        result = response.json()
+        if result.get("errors"):
+            raise RuntimeError(f"GraphQL error: {result['errors']}")
+        return result
+
+    async def query_image(
+        self,
+        img_data: np.ndarray,
+        num_to_retrieve=10,
+        where: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> dict:
+        if self.query_cache is not None:
+            key = self.query_cache.make_key(
+                img_data, num_to_retrieve, self.schema, where
+            )
+            response = self.query_cache.get(key)
+            if response is None:
+                response = await self._query_image(
+                    img_data, num_to_retrieve, where, timeout
+                )
+                self.query_cache.put(key, response)
+            return response
+        return await self._query_image(img_data, num_to_retrieve, where, timeout)
+
+    async def _query_image(
+        self,
+        img_data: np.ndarray,
+        num_to_retrieve=10,
+        where: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> dict:
+        rerank = self.reranking(num_to_retrieve)
+        query = self.near_vector_query(img_data, num_to_retrieve, where)
+        start = time.perf_counter()
+        result = await self.graphql(f"{{ Get {{ {query} }} }}", timeout)
+        if rerank:
+            result = self.rerank_result(result, img_data, num_to_retrieve)
+        self.stats.record_latency("search", time.perf_counter() - start)
+        return self.parse_query_result(result)
+
+    def near_vector_query(
+        self,
+        vector: np.ndarray,
+        num_to_retrieve: int,
+        where: Optional[dict] = None,
+        alias: str = "",
+    ) -> str:
+        # one near vector Get query, aliased queries can share a request
+        vector = json.dumps(np.asarray(vector, np.float32).ravel().tolist())
+        limit = self.candidate_limit(num_to_retrieve)
+        arguments = f"nearVector: {{vector: {vector}}}, limit: {int(limit)}"
+        if where is not None:
+            arguments += f", where: {where_to_graphql(where)}"
+        rerank = self.reranking(num_to_retrieve)
+        additional = "distance vector" if rerank else "distance"
+        fields = " ".join(["source"] + METADATA_FIELDS)
+        prefix = f"{alias}: " if alias else ""
+        return (
+            f"{prefix}{self.schema}({arguments}) "
+            f"{{ {fields} _additional {{ {additional} }} }}"
+        )
+
+    async def query_images(
+        self,
+        vectors: list,
+        num_to_retrieve=10,
+        where: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> list:
+        """
+        Async counterpart of WeaviateClient.query_images, one graphql request of
+        aliased near vector queries per MULTI_QUERY_SIZE vectors.
+        """
+        responses = []
+        rerank = self.reranking(num_to_retrieve)
+        for chunk_start in range(0, len(vectors), MULTI_QUERY_SIZE):
+            chunk = vectors[chunk_start : chunk_start + MULTI_QUERY_SIZE]
+            queries = " ".join(
+                self.near_vector_query(vector, num_to_retrieve, where, f"q{idx}")
+                for idx, vector in enumerate(chunk)
+            )
+            start = time.perf_counter()
+            result = await self.graphql(f"{{ Get {{ {queries} }} }}", timeout)
+            if rerank:
+                for idx, vector in enumerate(chunk):
+                    result = self.rerank_result(
+                        result, vector, num_to_retrieve, f"q{idx}"
+                    )
+            self.stats.record_latency("multi_search", time.perf_counter() - start)
+            for idx in range(len(chunk)):
+                hits = result["data"]["Get"][f"q{idx}"]
+                responses.append(
+                    self.parse_query_result({"data": {"Get": {self.schema: hits}}})
+                )
+        return responses
+
+    async def group_counts(self, field: str, timeout: Optional[float] = None) -> dict:
+        result = await self.graphql(
+            f"{{ Aggregate {{ {self.schema}(groupBy: [{json.dumps(field)}]) "
+            "{ groupedBy { value } meta { count } } } }",
+            timeout,
+        )
+        return {
+            str(group["groupedBy"]["value"]): group["meta"]["count"]
+            for group in result["data"]["Aggregate"][self.schema]
+        }
+
+    async def get_stats(
+        self, window_minutes: float = 10, timeout: Optional[float] = None
+    ) -> dict:
+        result = await self.graphql(
+            f"{{ Aggregate {{ {self.schema} {{ meta {{ count }} }} }} }}", timeout
+        )
+        count = result["data"]["Aggregate"][self.schema][0]["meta"]["count"]
+        sample = await self.graphql(
+            f"{{ Get {{ {self.schema}(limit: 1) {{ _additional {{ vector }} }} }} }}",
+            timeout,
+        )
+        sample = sample["data"]["Get"][self.schema]
+        dim = len(sample[0]["_additional"]["vector"]) if sample else 0
+        group_counts = {
+            field: await self.group_counts(field, timeout)
+            for field in ["source_stripe", "landform_class"]
+        }
+        response = await self.http.get(
+            f"/schema/{self.schema}", timeout=timeout or self.timeout
+        )
+        response.raise_for_status()
+        return self.collect_stats(
+            count,
+            group_counts,
+            dim,
+            response.json(),
+            window_minutes,
+            await self.imported_in_window(window_minutes, timeout),
+        )
+
+    async def imported_in_window(
+        self, window_minutes: float, timeout: Optional[float] = None
+    ) -> Optional[int]:
+        where = where_to_graphql(created_since(window_minutes))
+        try:
+            result = await self.graphql(
+                f"{{ Aggregate {{ {self.schema}(where: {where}) "
+                "{ meta { count } } } }",
+                timeout,
+            )
+        except RuntimeError:
+            # collections created without indexTimestamps cannot filter on creation time
+            return None
+        return result["data"]["Aggregate"][self.schema][0]["meta"]["count"]
+
+    async def check_db(
+        self, window_minutes: float = 10, timeout: Optional[float] = None
+    ) -> dict:
+        stats = await self.get_stats(window_minutes, timeout)
+        print(json.dumps(stats, indent=2))
+        return stats
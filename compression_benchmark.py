@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Compares the compressed descriptor indices of the embedded store against the
+# uncompressed baseline: resident memory per vector, recall@10 and query latency.
+
+import os
+import time
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from embedded_client import EmbeddedClient
+
+
+def make_descriptors(num_vectors: int, dim: int, num_clusters: int = 50) -> np.ndarray:
+    # clustered non negative data, similar to pooled activations of the SENet/DenseNet layers
+    rng = np.random.default_rng(0)
+    centers = rng.gamma(1.0, 1.0, (num_clusters, dim))
+    assignment = rng.integers(0, num_clusters, num_vectors)
+    noise = rng.gamma(1.0, 0.3, (num_vectors, dim))
+    return (centers[assignment] + noise).astype(np.float32)
+
+
+def build_store(directory: str, vectors: np.ndarray, compression: str, rerank: int):
+    client = EmbeddedClient(
+        "file://" + directory,
+        "Benchmark",
+        compression=compression,
+        rerank=rerank,
+        train_size=len(vectors) + 1,
+    )
+    entries = [
+        ({"source": str(i), "content_hash": str(i)}, vector, None)
+        for i, vector in enumerate(vectors)
+    ]
+    for start in range(0, len(entries), 10000):
+        client.append(entries[start : start + 10000])
+    if client.quantizer is not None:
+        client.train_quantizer(min(len(vectors), 20000))
+    return client
+
+
+def benchmark_loop(client, queries: np.ndarray, ground_truth: np.ndarray, k: int) -> dict:
+    latencies = []
+    recalls = []
+    for query, truth in zip(queries, ground_truth):
+        start = time.perf_counter()
+        idx, _ = client.search(query, k)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(set(idx[0].tolist()) & set(truth.tolist())) / k)
+    return {
+        "bytes_per_vector": client.index_bytes_per_vector(),
+        f"recall@{k}": float(np.mean(recalls)),
+        "latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+        "latency_ms_p99": float(np.percentile(latencies, 99) * 1000),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compressed descriptor indices.")
+    parser.add_argument("-n", "--num-vectors", type=int, default=50000)
+    parser.add_argument("-d", "--dim", type=int, default=2048)
+    parser.add_argument("-q", "--num-queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=100)
+    parser.add_argument("--output", type=str, default="compression_benchmark.json")
+    args = parser.parse_args()
+
+    vectors = make_descriptors(args.num_vectors + args.num_queries, args.dim)
+    queries, vectors = vectors[: args.num_queries], vectors[args.num_queries :]
+    directory = tempfile.mkdtemp()
+    try:
+        results = {}
+        ground_truth = None
+        for compression in ["none", "int8", "pq"]:
+            print(f"Building {compression} index..")
+            client = build_store(
+                os.path.join(directory, compression), vectors, compression, args.rerank
+            )
+            if ground_truth is None:
+                ground_truth = client.search(queries, args.k)[0]
+            results[compression] = benchmark_loop(client, queries, ground_truth, args.k)
+            print(f"{compression}: {results[compression]}")
+    finally:
+        shutil.rmtree(directory)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
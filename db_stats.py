@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Client side statistics recorded while a database client runs: query latency histograms
+and the import rate over a sliding window.
+"""
+import time
+import threading
+import numpy as np
+from collections import deque
+
+# upper bucket bounds of the latency histogram in milliseconds
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+# number of recent latencies kept for percentiles
+LATENCY_SAMPLES = 2048
+# hnsw default maxConnections of weaviate
+DEFAULT_MAX_CONNECTIONS = 64
+
+
+def estimate_index_memory(num_vectors: int, dim: int, max_connections: int) -> int:
+    # vector cache plus layer 0 links (2 * maxConnections uint64 per node), upper layers
+    # add little and are ignored
+    return num_vectors * dim * 4 + num_vectors * max_connections * 2 * 8
+
+
+class LatencyHistogram:
+    def __init__(self) -> None:
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.total = 0
+        self.total_ms = 0.0
+        self.recent = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, latency_ms: float) -> None:
+        for idx, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.counts[idx] += 1
+                break
+        self.total += 1
+        self.total_ms += latency_ms
+        self.recent.append(latency_ms)
+
+    def summary(self) -> dict:
+        recent = np.array(self.recent) if self.recent else np.zeros(1)
+        return {
+            "count": self.total,
+            "mean_ms": self.total_ms / self.total if self.total else 0.0,
+            "p50_ms": float(np.percentile(recent, 50)),
+            "p95_ms": float(np.percentile(recent, 95)),
+            "p99_ms": float(np.percentile(recent, 99)),
+            "buckets": [
+                {"le_ms": "inf" if bound == float("inf") else bound, "count": count}
+                for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)
+            ],
+        }
+
+
+class ClientStats:
+    """
+    Thread safe recorder shared by the client methods, one histogram per operation.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.latencies = {}
+        self.imports = deque()
+        self.num_imported = 0
+        self._lock = threading.Lock()
+
+    def record_latency(self, operation: str, seconds: float) -> None:
+        with self._lock:
+            if operation not in self.latencies:
+                self.latencies[operation] = LatencyHistogram()
+            self.latencies[operation].record(seconds * 1000)
+
+    def record_import(self, num_objects: int) -> None:
+        with self._lock:
+            self.imports.append((time.time(), num_objects))
+            self.num_imported += num_objects
+
+    def import_rate(self, window_minutes: float) -> float:
+        # objects per second over the last window_minutes
+        now = time.time()
+        window = window_minutes * 60
+        with self._lock:
+            while self.imports and now - self.imports[0][0] > 24 * 3600:
+                self.imports.popleft()
+            recent = sum(n for t, n in self.imports if now - t <= window)
+        return recent / min(window, max(now - self.started, 1e-9))
+
+    def summary(self, window_minutes: float = 10) -> dict:
+        with self._lock:
+            latencies = {op: hist.summary() for op, hist in self.latencies.items()}
+            num_imported = self.num_imported
+        return {
+            "uptime_s": time.time() - self.started,
+            "imported_objects": num_imported,
+            "import_window_minutes": window_minutes,
+            "import_rate_per_s": self.import_rate(window_minutes),
+            "latency": latencies,
+        }
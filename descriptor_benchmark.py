@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Measures descriptor throughput (images/s) of the SENet wrapper against the batch size
+# and checks that the batched vectors equal the per image ones.
+
+import os
+import time
+import json
+import argparse
+import numpy as np
+import skimage.io
+from msirs_utils.segmentation.senet_model import SENet
+from descriptors import get_descriptors
+from ingest import walk_files
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+def load_images(args) -> list:
+    if args.directory:
+        files = walk_files(args.directory, ["jpg", "png"])[: args.num_images]
+        return [skimage.io.imread(path) for path, _, _ in files]
+    rng = np.random.default_rng(0)
+    return [
+        rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+        for _ in range(args.num_images)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batched descriptor extraction.")
+    parser.add_argument("--model-path", type=str, default="")
+    parser.add_argument("--directory", type=str, help="Sample images from this directory")
+    parser.add_argument("-n", "--num-images", type=int, default=256)
+    parser.add_argument("--size", type=int, default=224, help="Size of random images")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--output", type=str, default="descriptor_benchmark.json")
+    args = parser.parse_args()
+
+    model = SENet(model_path=args.model_path)
+    images = load_images(args)
+    print(f"Loaded {len(images)} images, {os.cpu_count()} cpus")
+
+    # warm up so graph tracing is not counted
+    get_descriptors(model, images[: max(args.batch_sizes)], max(args.batch_sizes))
+    reference = [model.get_descriptor(img) for img in images[:16]]
+
+    results = {}
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        descriptors = get_descriptors(model, images, batch_size)
+        seconds = time.perf_counter() - start
+        max_diff = max(
+            float(np.max(np.abs(np.asarray(a) - np.asarray(b))))
+            for a, b in zip(reference, descriptors)
+        )
+        results[batch_size] = {
+            "images_per_s": len(images) / seconds,
+            "seconds": seconds,
+            "max_abs_diff": max_diff,
+        }
+        print(f"batch size {batch_size}: {results[batch_size]}")
+
+    with open(args.output, "w") as f:
+        json.dump({"cpus": os.cpu_count(), "results": results}, f, indent=2)
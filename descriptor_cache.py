@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+On disk cache of model descriptors keyed by (content hash, model id, preprocessing
+version). Vectors are appended to float32 segment files that are read through memmaps,
+a SQLite index maps keys to (segment, offset, dim). Once the segments exceed max_bytes
+the oldest segment is dropped, hits in it are copied forward first so hot entries stay.
+Several processes may share the directory, appends and evictions hold a file lock.
+"""
+import os
+import time
+import fcntl
+import sqlite3
+import threading
+import numpy as np
+from typing import Optional
+from pathlib import Path
+from descriptors import PREPROCESSING_VERSION, get_descriptors
+from hash_store import content_hash
+
+HOME = str(Path.home())
+DEFAULT_DESCRIPTOR_CACHE = HOME + "/.msirs/descriptors/"
+MAX_BYTES = 4 * 1024**3
+NUM_SEGMENTS = 8
+
+
+class DescriptorCache:
+    def __init__(
+        self,
+        model_id: str,
+        directory: str = DEFAULT_DESCRIPTOR_CACHE,
+        max_bytes: int = MAX_BYTES,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.model_id = model_id
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = max(max_bytes // NUM_SEGMENTS, 1)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # seconds spent on the model for misses, to estimate what the hits saved
+        self.inference_seconds = 0.0
+        self._maps = {}
+        self._lock = threading.Lock()
+        # flock is per open file, so threads additionally serialize on _lock
+        self._lock_file = open(os.path.join(directory, "lock"), "a")
+        self.conn = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"), check_same_thread=False
+        )
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS descriptors ("
+                "content_hash TEXT NOT NULL, model_id TEXT NOT NULL, "
+                "preprocessing INTEGER NOT NULL, segment INTEGER NOT NULL, "
+                "offset INTEGER NOT NULL, dim INTEGER NOT NULL, "
+                "PRIMARY KEY (content_hash, model_id, preprocessing))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS descriptors_segment ON descriptors (segment)"
+            )
+        segments = self._segments()
+        self.segment = segments[-1] if segments else 0
+
+    def _segments(self) -> list:
+        return sorted(
+            int(name.split("_")[1].split(".")[0])
+            for name in os.listdir(self.directory)
+            if name.startswith("segment_")
+        )
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment_{segment:06d}.f32")
+
+    def _read(self, segment: int, offset: int, dim: int) -> np.ndarray:
+        path = self._segment_path(segment)
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < offset + dim:
+            mapped = np.memmap(path, np.float32, "r")
+            self._maps[segment] = mapped
+        return np.array(mapped[offset : offset + dim])
+
+    def _lookup(self, img_hash: str) -> Optional[tuple]:
+        return self.conn.execute(
+            "SELECT segment, offset, dim FROM descriptors "
+            "WHERE content_hash = ? AND model_id = ? AND preprocessing = ?",
+            (img_hash, self.model_id, PREPROCESSING_VERSION),
+        ).fetchone()
+
+    def get(self, img_hash: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._lookup(img_hash)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            vector = self._read(*row)
+            segments = self._segments()
+            if len(segments) > 1 and row[0] == segments[0]:
+                self._append(img_hash, vector)
+        return vector
+
+    def put(self, img_hash: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._append(img_hash, np.asarray(vector, np.float32).ravel())
+
+    def _append(self, img_hash: str, vector: np.ndarray) -> None:
+        # callers hold _lock, the file lock keeps other processes out until the index
+        # row points at the written vector
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            segments = self._segments()
+            if segments:
+                # another process may have started a newer segment
+                self.segment = max(self.segment, segments[-1])
+            path = self._segment_path(self.segment)
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+                self.segment += 1
+                path = self._segment_path(self.segment)
+            with open(path, "ab") as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell() // 4
+                f.write(vector.astype(np.float32).tobytes())
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO descriptors "
+                    "(content_hash, model_id, preprocessing, segment, offset, dim) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        img_hash,
+                        self.model_id,
+                        PREPROCESSING_VERSION,
+                        self.segment,
+                        offset,
+                        len(vector),
+                    ),
+                )
+            self._evict()
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _evict(self) -> None:
+        segments = self._segments()
+        total = sum(os.path.getsize(self._segment_path(i)) for i in segments)
+        while total > self.max_bytes and len(segments) > 1:
+            oldest = segments.pop(0)
+            path = self._segment_path(oldest)
+            total -= os.path.getsize(path)
+            with self.conn:
+                cursor = self.conn.execute(
+                    "DELETE FROM descriptors WHERE segment = ?", (oldest,)
+                )
+            self.evictions += cursor.rowcount
+            self._maps.pop(oldest, None)
+            os.unlink(path)
+
+    def descriptors(self, model, images: list, batch_size: int) -> list:
+        """
+        Descriptors of all images, only the ones not in the cache are sent through the
+        model, in batches.
+        """
+        hashes = [content_hash(img) for img in images]
+        vectors = [self.get(img_hash) for img_hash in hashes]
+        missing = [idx for idx, vector in enumerate(vectors) if vector is None]
+        if missing:
+            start = time.perf_counter()
+            computed = get_descriptors(model, [images[idx] for idx in missing], batch_size)
+            self.inference_seconds += time.perf_counter() - start
+            for idx, vector in zip(missing, computed):
+                self.put(hashes[idx], vector)
+                vectors[idx] = vector
+        return vectors
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM descriptors").fetchone()[0]
+            size = sum(os.path.getsize(self._segment_path(i)) for i in self._segments())
+        lookups = self.hits + self.misses
+        per_image = self.inference_seconds / self.misses if self.misses else 0.0
+        return {
+            "model_id": self.model_id,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "estimated_saved_seconds": self.hits * per_image,
+        }
+
+    def close(self) -> None:
+        self.conn.close()
+        self._lock_file.close()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Helpers around the descriptor model used for ingest and query.
+"""
+import os
+import hashlib
+import numpy as np
+
+# bump when the preprocessing in front of the model changes, vectors are not comparable then
+PREPROCESSING_VERSION = 1
+# images per forward pass, the cpu nodes saturate around 32, see descriptor_benchmark.py
+DESCRIPTOR_BATCH_SIZE = 32
+
+
+class ModelMismatchError(Exception):
+    pass
+
+
+def weights_digest(model) -> str:
+    """
+    sha256 over the weights of a loaded model, for wrappers of the keras model behind
+    them.
+    """
+    for candidate in [
+        model,
+        getattr(model, "model", None),
+        getattr(model, "feature_extractor", None),
+    ]:
+        if hasattr(candidate, "get_weights"):
+            break
+    else:
+        raise ValueError(f"Cannot read the weights of {type(model).__name__}")
+    h = hashlib.sha256()
+    for weights in candidate.get_weights():
+        weights = np.ascontiguousarray(weights)
+        h.update(f"{weights.dtype.str}:{weights.shape}".encode())
+        h.update(weights.tobytes())
+    return h.hexdigest()
+
+
+def model_identifier(model_path: str, model=None) -> str:
+    """
+    Identifies the model by file name and a hash of its weights, so two deployments with
+    the same checkpoint agree and a retrained checkpoint never matches an old collection.
+
+    With a loaded model its weights are hashed, which is the only way to identify the
+    default weights SENet resolves itself when no checkpoint path is given. Otherwise
+    the checkpoint file is hashed without loading it.
+    """
+    name = os.path.basename(model_path.rstrip("/")) if model_path else "default"
+    if model is not None:
+        digest = weights_digest(model)
+        return f"senet:{name}:{digest[:16]}:v{PREPROCESSING_VERSION}"
+    if not model_path or not os.path.exists(model_path):
+        raise ValueError(
+            f"Model checkpoint {model_path!r} not found, pass the loaded model instead"
+        )
+    h = hashlib.sha256()
+    paths = [model_path]
+    if os.path.isdir(model_path):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(model_path)
+            for name in names
+        )
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return f"senet:{name}:{h.hexdigest()[:16]}:v{PREPROCESSING_VERSION}"
+
+
+def get_descriptors(model, images: list, batch_size: int = 32) -> list:
+    """
+    Descriptors of all images with one forward pass per batch of batch_size images,
+    every vector equals model.get_descriptor(img) of the same image.
+
+    Uses model.get_descriptors(batch) if the wrapper has a batched entry point, otherwise
+    stacks model.preprocess(img) of the batch and runs model.feature_extractor once.
+    Wrappers that expose neither fall back to one call per image.
+    """
+    descriptors = []
+    for start in range(0, len(images), batch_size):
+        batch = images[start : start + batch_size]
+        if hasattr(model, "get_descriptors"):
+            descriptors.extend(model.get_descriptors(batch))
+        elif hasattr(model, "preprocess") and hasattr(model, "feature_extractor"):
+            stacked = np.stack([model.preprocess(img) for img in batch])
+            features = np.asarray(model.feature_extractor.predict_on_batch(stacked))
+            descriptors.extend(feature.reshape(-1) for feature in features)
+        else:
+            descriptors.extend(model.get_descriptor(img) for img in batch)
+    return descriptors
@@ -0,0 +1,667 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from typing import Iterable, Optional
+from hash_store import content_hash
+from hash_store import object_uuid as make_object_uuid
+from metadata import METADATA_FIELDS, METADATA_PROPERTIES
+from metadata import extract_properties, load_metadata
+from quantization import make_quantizer
+from db_stats import ClientStats
+from query_cache import QueryCache
+from descriptors import ModelMismatchError
+
+# rows per chunk for the brute force search, bounds the temporary distance matrix
+SEARCH_CHUNK_SIZE = 65536
+
+# candidates re-ranked on full precision vectors when a compressed index is used
+RERANK_CANDIDATES = 100
+QUANTIZER_TRAIN_SIZE = 10000
+
+SQL_TYPES = {"string": "TEXT", "number": "REAL", "int": "INTEGER"}
+SQL_OPERATORS = {
+    "Equal": "=",
+    "NotEqual": "!=",
+    "GreaterThan": ">",
+    "GreaterThanEqual": ">=",
+    "LessThan": "<",
+    "LessThanEqual": "<=",
+    "Like": "LIKE",
+}
+
+
+def where_to_sql(where: dict) -> tuple:
+    """
+    Translates a weaviate where filter on the metadata properties into a sql condition.
+    """
+    operator = where["operator"]
+    if operator in ["And", "Or"]:
+        parts = [where_to_sql(operand) for operand in where["operands"]]
+        sql = f" {operator.upper()} ".join(f"({part[0]})" for part in parts)
+        return sql, [param for part in parts for param in part[1]]
+    field = where["path"][-1]
+    if field not in METADATA_FIELDS:
+        raise ValueError(f"Cannot filter on {field}, use one of {METADATA_FIELDS}")
+    if operator == "IsNull":
+        value = [v for k, v in where.items() if k.startswith("value")][0]
+        return f"{field} IS {'' if value else 'NOT '}NULL", []
+    if operator not in SQL_OPERATORS:
+        raise ValueError(f"Unsupported where operator {operator}")
+    value = [v for k, v in where.items() if k.startswith("value")][0]
+    if operator == "Like":
+        value = value.replace("*", "%").replace("?", "_")
+    return f"{field} {SQL_OPERATORS[operator]} ?", [value]
+
+
+class EmbeddedBatch:
+    """
+    Batch context manager with the same interface as weaviate_client.ImportBatch,
+    buffered objects are appended to the store in one write per batch.
+    """
+
+    def __init__(self, client, batch_size: int = 1000, **kwargs) -> None:
+        self.client = client
+        self.batch_size = batch_size
+        self.report = []
+        self.num_added = 0
+        self.failed = []
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+    def add(
+        self,
+        data_object: dict,
+        vector: Optional[np.ndarray] = None,
+        object_uuid: Optional[str] = None,
+    ) -> bool:
+        if vector is None:
+            raise ValueError("The embedded store needs a vector for every object")
+        if self.client.check_for_duplicate_entries(data_object):
+            print("Object already exists, skipping addition")
+            return False
+        self._buffer.append((data_object, vector, object_uuid))
+        self.num_added += 1
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+        return True
+
+    def add_image(
+        self,
+        img: np.ndarray,
+        original_file_path: str,
+        file_path: str,
+        vector: Optional[np.ndarray] = None,
+    ) -> bool:
+        data_object = self.client.make_data_object(img, original_file_path, file_path)
+        return self.add(data_object, vector=vector)
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        errors = []
+        try:
+            self.client.append(self._buffer)
+        except Exception as e:
+            errors.append({"errors": str(e)})
+            self.failed.extend(
+                obj_uuid or self.client.object_uuid(data_object)
+                for data_object, _, obj_uuid in self._buffer
+            )
+        self.report.append(
+            {
+                "batch": len(self.report),
+                "objects": len(self._buffer),
+                "failed": len(self._buffer) if errors else 0,
+                "errors": errors,
+            }
+        )
+        self._buffer = []
+
+
+class EmbeddedClient:
+    """
+    In process replacement for WeaviateClient. Descriptors are kept as float32 rows of an
+    append only file that is memory mapped for search, properties live in sqlite next to it.
+    Queries are exact: the matrix is scanned in chunks with one matrix product each and the
+    top k are selected with argpartition.
+
+    With compression "int8" or "pq" only compact codes of the normalized vectors are held in
+    memory. The quantizer is trained on a sample once `train_size` vectors are stored,
+    candidates are searched on the codes and the best `rerank` are re-ranked exactly
+    against the full precision vectors read from the memmap.
+
+    Layout of <directory>/<schema>/:
+        vectors.f32   row major float32 descriptors
+        norms.f32     l2 norm per row
+        codes.u8      compressed codes, only with compression
+        quantizer.npz trained quantizer, only with compression
+        objects.sqlite
+    """
+
+    # there is no vectorizer module, vectors have to be provided on insert
+    needs_vectors = True
+
+    def __init__(
+        self,
+        directory: str,
+        schema: str = "",
+        chunk_size: int = SEARCH_CHUNK_SIZE,
+        compression: str = "none",
+        rerank: int = RERANK_CANDIDATES,
+        train_size: int = QUANTIZER_TRAIN_SIZE,
+        num_subvectors: int = 64,
+        model_id: str = "",
+        query_cache: Optional[QueryCache] = None,
+    ) -> None:
+        if directory.startswith("file://"):
+            directory = directory[len("file://") :]
+        if schema == "":
+            self.schema = "Test"
+        else:
+            self.schema = schema
+        self.directory = os.path.join(directory, self.schema)
+        os.makedirs(self.directory, exist_ok=True)
+        self.chunk_size = chunk_size
+        self.vector_path = os.path.join(self.directory, "vectors.f32")
+        self.norm_path = os.path.join(self.directory, "norms.f32")
+        self.code_path = os.path.join(self.directory, "codes.u8")
+        self.quantizer_path = os.path.join(self.directory, "quantizer.npz")
+        self.rerank = rerank
+        self.train_size = train_size
+        self.quantizer = None
+        if compression != "none":
+            self.quantizer = make_quantizer(compression, num_subvectors)
+        self._codes = None
+        self.stats = ClientStats()
+        self.query_cache = query_cache
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(self.directory, "objects.sqlite"), check_same_thread=False
+        )
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                "row INTEGER PRIMARY KEY, uuid TEXT UNIQUE NOT NULL, "
+                "content_hash TEXT UNIQUE, source TEXT, meta_data TEXT)"
+            )
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(objects)")]
+            for prop in METADATA_PROPERTIES:
+                if prop["name"] not in columns:
+                    self.conn.execute(
+                        f"ALTER TABLE objects ADD COLUMN {prop['name']} "
+                        f"{SQL_TYPES[prop['dataType'][0]]}"
+                    )
+            # rows are positions in the vector file, deleted objects are only flagged
+            if "deleted" not in columns:
+                self.conn.execute(
+                    "ALTER TABLE objects ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0"
+                )
+            # insert time, the import rate is counted on it, NULL for older rows
+            if "created" not in columns:
+                self.conn.execute("ALTER TABLE objects ADD COLUMN created REAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)"
+            )
+        row = self.conn.execute("SELECT value FROM info WHERE key = 'dim'").fetchone()
+        self.dim = int(row[0]) if row else None
+        self.model_id = model_id
+        self.check_model_id()
+        self.count = self.conn.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+        # live rows as a mask over the vector file, so deletions cost the search nothing
+        # but a masked chunk instead of a sql scan per query
+        self._live = np.ones(self.count, bool)
+        deleted = self.conn.execute("SELECT row FROM objects WHERE deleted = 1")
+        self._live[[row[0] for row in deleted]] = False
+        self.num_deleted = int(self.count - self._live.sum())
+        self._truncate_to_count()
+        self._vectors = None
+        self._norms = None
+        if self.quantizer is not None and os.path.exists(self.quantizer_path):
+            self.quantizer.load_state(dict(np.load(self.quantizer_path)))
+            self._load_codes()
+
+    def check_model_id(self) -> None:
+        # the first client that stores a model id binds the store to that model
+        if not self.model_id:
+            return
+        row = self.conn.execute(
+            "SELECT value FROM info WHERE key = 'model_id'"
+        ).fetchone()
+        if row is None:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO info (key, value) VALUES ('model_id', ?)",
+                    (self.model_id,),
+                )
+        elif row[0] != self.model_id:
+            raise ModelMismatchError(
+                f"Store {self.directory} holds vectors of model {row[0]!r}, "
+                f"this client uses {self.model_id!r}"
+            )
+
+    def _truncate_to_count(self) -> None:
+        # rows written to the files but not committed to sqlite belong to a crashed append
+        if self.dim is None:
+            return
+        for path, width in [(self.vector_path, self.dim), (self.norm_path, 1)]:
+            expected = self.count * width * 4
+            if os.path.exists(path) and os.path.getsize(path) > expected:
+                with open(path, "r+b") as f:
+                    f.truncate(expected)
+
+    def _mapped(self) -> tuple:
+        if self._vectors is None or len(self._vectors) != self.count:
+            if self.count == 0:
+                return np.zeros((0, self.dim or 0), np.float32), np.zeros(0, np.float32)
+            self._vectors = np.memmap(
+                self.vector_path, np.float32, "r", shape=(self.count, self.dim)
+            )
+            self._norms = np.memmap(self.norm_path, np.float32, "r", shape=(self.count,))
+        return self._vectors, self._norms
+
+    def _normalized(self, start: int, end: int) -> np.ndarray:
+        vectors, norms = self._mapped()
+        return vectors[start:end] / np.maximum(norms[start:end], 1e-12)[:, None]
+
+    def _load_codes(self) -> None:
+        code_size = self.quantizer.code_size(self.dim)
+        codes = np.zeros((0, code_size), np.uint8)
+        if os.path.exists(self.code_path):
+            codes = np.fromfile(self.code_path, np.uint8).reshape(-1, code_size)
+        codes = codes[: self.count]
+        if len(codes) < self.count:
+            # codes are written after the rows, encode what a crashed append left out
+            missing = [
+                self.quantizer.encode(self._normalized(start, start + self.chunk_size))
+                for start in range(len(codes), self.count, self.chunk_size)
+            ]
+            codes = np.concatenate([codes] + missing)
+        codes.tofile(self.code_path)
+        self._codes = [codes]
+
+    def train_quantizer(self, sample_size: Optional[int] = None) -> None:
+        """
+        Trains the quantizer on a random sample of the stored vectors and encodes all rows.
+        """
+        sample_size = min(sample_size or self.train_size, self.count)
+        vectors, norms = self._mapped()
+        rng = np.random.default_rng(0)
+        rows = np.sort(rng.choice(self.count, sample_size, replace=False))
+        sample = vectors[rows] / np.maximum(norms[rows], 1e-12)[:, None]
+        self.quantizer.train(sample)
+        np.savez(self.quantizer_path, **self.quantizer.state())
+        if os.path.exists(self.code_path):
+            os.remove(self.code_path)
+        self._load_codes()
+
+    def index_bytes_per_vector(self) -> int:
+        # memory the search keeps resident per vector
+        if self.quantizer is not None and self.quantizer.trained:
+            return self.quantizer.code_size(self.dim)
+        return (self.dim or 0) * 4
+
+    def make_data_object(
+        self, img: np.ndarray, original_file_path: str, file_path: str
+    ) -> dict:
+        metadata = load_metadata(original_file_path)
+        data_object = {
+            "source": file_path,
+            "meta_data": json.dumps(metadata),
+            "content_hash": content_hash(img),
+        }
+        data_object.update(extract_properties(metadata, original_file_path))
+        return data_object
+
+    def object_uuid(self, data_object: dict) -> str:
+        return make_object_uuid(self.schema, data_object["content_hash"])
+
+    def check_for_duplicate_entries(self, object_to_check: dict) -> bool:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM objects WHERE content_hash = ?",
+                (object_to_check.get("content_hash"),),
+            ).fetchone()
+        return row is not None
+
+    def append(self, entries: list) -> None:
+        """
+        Appends (data_object, vector, uuid) tuples, vectors are written before the rows
+        are committed so a crash never leaves rows without a vector. A failed insert
+        truncates the files back to the committed rows.
+        """
+        with self._lock:
+            # skip objects already stored or repeated within the same append
+            seen = set()
+            unique = []
+            for entry in entries:
+                img_hash = entry[0].get("content_hash")
+                if img_hash is not None:
+                    if img_hash in seen or self.conn.execute(
+                        "SELECT 1 FROM objects WHERE content_hash = ?", (img_hash,)
+                    ).fetchone():
+                        continue
+                    seen.add(img_hash)
+                unique.append(entry)
+            if not unique:
+                return
+            entries = unique
+            vectors = np.stack(
+                [np.asarray(vector, np.float32).ravel() for _, vector, _ in entries]
+            )
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT INTO info (key, value) VALUES ('dim', ?)", (self.dim,)
+                    )
+            if vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Vector dimension {vectors.shape[1]} does not match store dimension {self.dim}"
+                )
+            rows = []
+            created = time.time()
+            for offset, (data_object, _, obj_uuid) in enumerate(entries):
+                meta_data = data_object.get("meta_data", {})
+                if not isinstance(meta_data, str):
+                    meta_data = json.dumps(meta_data)
+                rows.append(
+                    (
+                        self.count + offset,
+                        obj_uuid or self.object_uuid(data_object),
+                        data_object.get("content_hash"),
+                        data_object.get("source"),
+                        meta_data,
+                        created,
+                    )
+                    + tuple(data_object.get(field) for field in METADATA_FIELDS)
+                )
+            columns = ["row", "uuid", "content_hash", "source", "meta_data", "created"]
+            columns += METADATA_FIELDS
+            try:
+                with open(self.vector_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(self.norm_path, "ab") as f:
+                    f.write(
+                        np.linalg.norm(vectors, axis=1).astype(np.float32).tobytes()
+                    )
+                with self.conn:
+                    self.conn.executemany(
+                        f"INSERT INTO objects ({', '.join(columns)}) "
+                        f"VALUES ({', '.join('?' * len(columns))})",
+                        rows,
+                    )
+            except Exception:
+                # drop the vectors of the failed rows, otherwise the next append
+                # would commit rows pointing at them
+                self._truncate_to_count()
+                raise
+            self.count += len(rows)
+            self._live = np.concatenate([self._live, np.ones(len(rows), bool)])
+            self.stats.record_import(len(rows))
+            self.invalidate_cache()
+            if self.quantizer is not None:
+                if self.quantizer.trained:
+                    normalized = vectors / np.maximum(
+                        np.linalg.norm(vectors, axis=1), 1e-12
+                    )[:, None]
+                    codes = self.quantizer.encode(normalized)
+                    with open(self.code_path, "ab") as f:
+                        f.write(codes.tobytes())
+                    self._codes.append(codes)
+                elif self.count >= self.train_size:
+                    self.train_quantizer()
+
+    def add_to_db(
+        self,
+        img: np.ndarray,
+        original_file_path: str,
+        file_path: str,
+        vector: Optional[np.ndarray] = None,
+    ) -> None:
+        data = self.make_data_object(img, original_file_path, file_path)
+        self.create_entry(data, vector=vector)
+
+    def create_entry(self, data_object: dict, vector: Optional[np.ndarray] = None) -> None:
+        if vector is None:
+            raise ValueError("The embedded store needs a vector for every object")
+        if not self.check_for_duplicate_entries(data_object):
+            self.append([(data_object, vector, None)])
+        else:
+            print("Object already exists, skipping addition")
+
+    def delete_entry(self, obj_uuid: str, img_hash: Optional[str] = None) -> bool:
+        """
+        Flags the object as deleted. Its vector stays in place until the store is rebuilt,
+        uuid and content hash are released so the image can be inserted again.
+        """
+        with self._lock, self.conn:
+            found = self.conn.execute(
+                "SELECT row FROM objects WHERE uuid = ? AND deleted = 0", (obj_uuid,)
+            ).fetchone()
+            cursor = self.conn.execute(
+                "UPDATE objects SET deleted = 1, uuid = 'deleted:' || row, "
+                "content_hash = NULL WHERE uuid = ? AND deleted = 0",
+                (obj_uuid,),
+            )
+            if found is not None:
+                self._live[found[0]] = False
+            self.num_deleted += cursor.rowcount
+        if cursor.rowcount:
+            self.invalidate_cache()
+        return cursor.rowcount > 0
+
+    def invalidate_cache(self) -> None:
+        if self.query_cache is not None:
+            self.query_cache.invalidate(self.schema)
+
+    def cache_stats(self) -> dict:
+        if self.query_cache is None:
+            return {}
+        return self.query_cache.stats()
+
+    def batch(self, **kwargs) -> EmbeddedBatch:
+        return EmbeddedBatch(self, **kwargs)
+
+    def add_many(self, data_objects: Iterable[tuple], **kwargs) -> list:
+        """
+        Adds (data_object, vector) tuples, returns the per batch report.
+        """
+        with self.batch(**kwargs) as batch:
+            for data_object, vector in data_objects:
+                batch.add(data_object, vector=vector)
+        return batch.report
+
+    def search(self, queries: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> tuple:
+        """
+        Cosine search for a (num_queries, dim) matrix, returns row indices and distances
+        of shape (num_queries, k) sorted by distance. If rows is given only those rows
+        are searched, otherwise all live rows.
+        """
+        queries = np.atleast_2d(np.asarray(queries, np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        if self.quantizer is not None and self.quantizer.trained:
+            return self._compressed_search(queries, k, rows)
+        return self._exact_search(queries, k, rows)
+
+    def _compressed_search(
+        self, queries: np.ndarray, k: int, rows: Optional[np.ndarray] = None
+    ) -> tuple:
+        if len(self._codes) > 1:
+            self._codes = [np.concatenate(self._codes)]
+        codes = self._codes[0]
+        num_rows = len(codes) if rows is None else len(rows)
+        live = self._live if rows is None and self.num_deleted else None
+        num_live = num_rows if live is None else int(live[:num_rows].sum())
+        num_candidates = min(max(self.rerank, k), num_live)
+        best_idx = np.zeros((len(queries), 0), np.int64)
+        best_sim = np.zeros((len(queries), 0), np.float32)
+        for start in range(0, num_rows, self.chunk_size):
+            if rows is None:
+                chunk_rows = np.arange(start, min(start + self.chunk_size, num_rows))
+            else:
+                chunk_rows = rows[start : start + self.chunk_size]
+            sim = self.quantizer.similarities(queries, codes[chunk_rows])
+            if live is not None:
+                sim[:, ~live[chunk_rows]] = -np.inf
+            best_idx = np.concatenate(
+                [best_idx, np.broadcast_to(chunk_rows, sim.shape)], axis=1
+            )
+            best_sim = np.concatenate([best_sim, sim], axis=1)
+            if best_idx.shape[1] > num_candidates:
+                keep = np.argpartition(-best_sim, num_candidates - 1, axis=1)
+                keep = keep[:, :num_candidates]
+                best_idx = np.take_along_axis(best_idx, keep, axis=1)
+                best_sim = np.take_along_axis(best_sim, keep, axis=1)
+        # exact re-ranking of the candidates on the full precision vectors
+        results = [
+            self._exact_search(query[None, :], k, np.sort(candidates))
+            for query, candidates in zip(queries, best_idx)
+        ]
+        return (
+            np.concatenate([idx for idx, _ in results]),
+            np.concatenate([dist for _, dist in results]),
+        )
+
+    def _exact_search(
+        self, queries: np.ndarray, k: int, rows: Optional[np.ndarray] = None
+    ) -> tuple:
+        vectors, norms = self._mapped()
+        num_rows = len(vectors) if rows is None else len(rows)
+        live = self._live if rows is None and self.num_deleted else None
+        k = min(k, num_rows if live is None else int(live[:num_rows].sum()))
+        best_idx = np.zeros((len(queries), 0), np.int64)
+        best_dist = np.zeros((len(queries), 0), np.float32)
+        for start in range(0, num_rows, self.chunk_size):
+            if rows is None:
+                chunk_rows = np.arange(start, min(start + self.chunk_size, num_rows))
+                chunk = vectors[start : start + self.chunk_size]
+                chunk_norms = norms[start : start + self.chunk_size]
+            else:
+                chunk_rows = rows[start : start + self.chunk_size]
+                chunk = vectors[chunk_rows]
+                chunk_norms = norms[chunk_rows]
+            dist = 1.0 - (queries @ chunk.T) / np.maximum(chunk_norms, 1e-12)
+            if live is not None:
+                dist[:, ~live[chunk_rows]] = np.inf
+            if dist.shape[1] > k:
+                part = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            else:
+                part = np.broadcast_to(np.arange(dist.shape[1]), dist.shape)
+            best_idx = np.concatenate([best_idx, chunk_rows[part]], axis=1)
+            best_dist = np.concatenate(
+                [best_dist, np.take_along_axis(dist, part, axis=1)], axis=1
+            )
+            if best_idx.shape[1] > k:
+                keep = np.argpartition(best_dist, k - 1, axis=1)[:, :k]
+                best_idx = np.take_along_axis(best_idx, keep, axis=1)
+                best_dist = np.take_along_axis(best_dist, keep, axis=1)
+        order = np.argsort(best_dist, axis=1)
+        return (
+            np.take_along_axis(best_idx, order, axis=1),
+            np.take_along_axis(best_dist, order, axis=1),
+        )
+
+    def filter_rows(self, where: Optional[dict] = None) -> np.ndarray:
+        sql, params = where_to_sql(where) if where is not None else ("1", [])
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT row FROM objects WHERE deleted = 0 AND ({sql}) ORDER BY row",
+                params,
+            ).fetchall()
+        return np.array([row[0] for row in rows], np.int64)
+
+    def fetch_rows(self, rows: list) -> list:
+        columns = ", ".join(["row", "uuid", "source"] + METADATA_FIELDS)
+        with self._lock:
+            found = {
+                row[0]: row
+                for row in self.conn.execute(
+                    f"SELECT {columns} FROM objects WHERE row IN ({','.join('?' * len(rows))})",
+                    [int(i) for i in rows],
+                )
+            }
+        return [found[int(i)] for i in rows]
+
+    def query_image(
+        self, img_data: np.ndarray, num_to_retrieve=10, where: Optional[dict] = None
+    ) -> dict:
+        if self.query_cache is not None:
+            key = self.query_cache.make_key(
+                img_data, num_to_retrieve, self.schema, where
+            )
+            response = self.query_cache.get(key)
+            if response is None:
+                response = self.query_images([img_data], num_to_retrieve, where)[0]
+                self.query_cache.put(key, response)
+            return response
+        return self.query_images([img_data], num_to_retrieve, where)[0]
+
+    def query_images(
+        self, vectors: list, num_to_retrieve=10, where: Optional[dict] = None
+    ) -> list:
+        """
+        One response per query vector, all vectors are searched in one pass.
+        """
+        start = time.perf_counter()
+        # deleted rows are masked in the search, sql is only needed for filters
+        rows = self.filter_rows(where) if where is not None else None
+        queries = np.stack([np.asarray(vector, np.float32).ravel() for vector in vectors])
+        idx, dist = self.search(queries, num_to_retrieve, rows)
+        self.stats.record_latency("search", time.perf_counter() - start)
+        responses = []
+        for query_idx, query_dist in zip(idx, dist):
+            found = self.fetch_rows(query_idx.tolist())
+            images = [row[2] for row in found]
+            distances = [{"distance": float(d)} for d in query_dist]
+            meta_data = [dict(zip(METADATA_FIELDS, row[3:])) for row in found]
+            responses.append(
+                {"images": images, "distances": distances, "meta_data": meta_data}
+            )
+        return responses
+
+    def group_counts(self, field: str) -> dict:
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {field}, COUNT(*) FROM objects WHERE deleted = 0 GROUP BY {field}"
+            ).fetchall()
+        return {str(value): count for value, count in rows}
+
+    def imported_in_window(self, window_minutes: float) -> int:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM objects WHERE deleted = 0 AND created > ?",
+                (time.time() - window_minutes * 60,),
+            ).fetchone()[0]
+
+    def get_stats(self, window_minutes: float = 10) -> dict:
+        imported = self.imported_in_window(window_minutes)
+        return {
+            "collection": self.schema,
+            "count": self.count - self.num_deleted,
+            "deleted": self.num_deleted,
+            "counts_by_source_stripe": self.group_counts("source_stripe"),
+            "counts_by_landform_class": self.group_counts("landform_class"),
+            "vector_dim": self.dim or 0,
+            "estimated_index_memory_bytes": self.count * self.index_bytes_per_vector(),
+            "import_window_minutes": window_minutes,
+            "imported_in_window": imported,
+            "import_rate_per_s": imported / (window_minutes * 60),
+            "client": self.stats.summary(window_minutes),
+            "query_cache": self.cache_stats(),
+        }
+
+    def check_db(self, window_minutes: float = 10) -> dict:
+        stats = self.get_stats(window_minutes)
+        print(json.dumps(stats, indent=2))
+        return stats
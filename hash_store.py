@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import sqlite3
+import hashlib
+import threading
+import uuid
+import os
+import numpy as np
+from pathlib import Path
+
+HOME = str(Path.home())
+DEFAULT_HASH_STORE = HOME + "/.msirs/hashes.sqlite"
+
+# namespace for the deterministic object uuids, never change this or every id changes
+MSIRS_NAMESPACE = uuid.UUID("6f1b7a52-2d1c-5c4e-9a43-0d5b0c6a1e7f")
+
+
+def content_hash(img: np.ndarray) -> str:
+    """
+    sha256 over dtype, shape and pixel bytes, independent of the payload encoding.
+    """
+    img = np.ascontiguousarray(img)
+    h = hashlib.sha256()
+    h.update(f"{img.dtype.str}:{img.shape}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def object_uuid(schema: str, img_hash: str) -> str:
+    return str(uuid.uuid5(MSIRS_NAMESPACE, f"{schema}/{img_hash}"))
+
+
+class HashStore:
+    """
+    Persistent set of content hashes already inserted per collection, so duplicate checks
+    need no round trip to weaviate.
+    """
+
+    def __init__(self, path: str = DEFAULT_HASH_STORE) -> None:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS hashes ("
+                "schema TEXT NOT NULL, hash TEXT NOT NULL, uuid TEXT NOT NULL, "
+                "PRIMARY KEY (schema, hash))"
+            )
+
+    def contains(self, schema: str, img_hash: str) -> bool:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM hashes WHERE schema = ? AND hash = ?", (schema, img_hash)
+            ).fetchone()
+        return row is not None
+
+    def add(self, schema: str, img_hash: str, obj_uuid: str) -> None:
+        self.add_many(schema, [(img_hash, obj_uuid)])
+
+    def add_many(self, schema: str, entries: list) -> None:
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hashes (schema, hash, uuid) VALUES (?, ?, ?)",
+                [(schema, img_hash, obj_uuid) for img_hash, obj_uuid in entries],
+            )
+
+    def remove(self, schema: str, img_hash: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM hashes WHERE schema = ? AND hash = ?", (schema, img_hash)
+            )
+
+    def clear(self, schema: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM hashes WHERE schema = ?", (schema,))
+
+    def count(self, schema: str) -> int:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM hashes WHERE schema = ?", (schema,)
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
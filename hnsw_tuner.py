@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# Sweeps the hnsw parameters of weaviate on a sample of our descriptors. For every
+# efConstruction/maxConnections pair a temporary collection is built, every query time ef
+# is then measured against exact ground truth computed locally. The Pareto optimal
+# settings (recall vs. p50 latency) are written out as ready to use schema configs, each
+# with the client side rerank it was measured with.
+
+import copy
+import json
+import time
+import uuid
+import argparse
+import itertools
+import numpy as np
+import weaviate
+from weaviate_client import SCHEMA, WeaviateClient, exact_distances
+from snapshot import read_snapshot
+from db_stats import estimate_index_memory
+
+EF_CONSTRUCTION = [64, 128, 256]
+MAX_CONNECTIONS = [16, 32, 64]
+EF = [16, 32, 64, 128, 256]
+# candidates reranked by exact distance, 0 is plain hnsw
+RERANK = [0, 100]
+
+
+def load_sample(args) -> np.ndarray:
+    num_vectors = args.sample_size + args.num_queries
+    if args.vectors:
+        vectors = np.load(args.vectors, mmap_mode="r")
+    else:
+        if args.snapshot:
+            objects = read_snapshot(args.snapshot)
+        else:
+            objects = WeaviateClient(args.db_adr, args.collection).iterate_objects()
+        vectors = [vector for _, vector, _ in itertools.islice(objects, num_vectors)]
+    vectors = np.asarray(vectors, np.float32)
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.permutation(len(vectors))[:num_vectors])
+    return vectors[rows]
+
+
+def exact_neighbours(base: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    base = base / np.maximum(np.linalg.norm(base, axis=1, keepdims=True), 1e-12)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    dist = 1.0 - queries @ base.T
+    idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(idx, np.argsort(np.take_along_axis(dist, idx, 1), 1), 1)
+
+
+def index_config(ef_construction: int, max_connections: int, ef: int) -> dict:
+    return {
+        "distance": "cosine",
+        "efConstruction": ef_construction,
+        "maxConnections": max_connections,
+        "ef": ef,
+    }
+
+
+def build_collection(
+    client, class_name: str, base: np.ndarray, ef_construction: int, max_connections: int
+) -> float:
+    if client.schema.exists(class_name):
+        client.schema.delete_class(class_name)
+    client.schema.create_class(
+        {
+            "class": class_name,
+            "vectorizer": "none",
+            "vectorIndexType": "hnsw",
+            "vectorIndexConfig": index_config(ef_construction, max_connections, -1),
+            "properties": [{"name": "row", "dataType": ["int"]}],
+        }
+    )
+    start = time.perf_counter()
+    client.batch.configure(batch_size=200, num_workers=4, dynamic=False)
+    with client.batch as batch:
+        for row, vector in enumerate(base):
+            batch.add_data_object(
+                {"row": row},
+                class_name,
+                uuid=str(uuid.UUID(int=row)),
+                vector=vector.tolist(),
+            )
+    return time.perf_counter() - start
+
+
+def benchmark_loop(
+    client,
+    class_name: str,
+    queries: np.ndarray,
+    ground_truth: np.ndarray,
+    k: int,
+    rerank: int = 0,
+) -> dict:
+    latencies = []
+    recalls = []
+    for query, truth in zip(queries, ground_truth):
+        start = time.perf_counter()
+        request = (
+            client.query.get(class_name, ["row"])
+            .with_near_vector({"vector": query.tolist()})
+            .with_limit(max(k, rerank))
+        )
+        if rerank > k:
+            request = request.with_additional(["vector"])
+        candidates = request.do()["data"]["Get"][class_name]
+        if rerank > k and candidates:
+            vectors = np.array([i["_additional"]["vector"] for i in candidates])
+            order = np.argsort(exact_distances(query, vectors, "cosine"))[:k]
+            candidates = [candidates[i] for i in order]
+        latencies.append(time.perf_counter() - start)
+        found = {i["row"] for i in candidates}
+        recalls.append(len(found & set(truth.tolist())) / k)
+    return {
+        f"recall@{k}": float(np.mean(recalls)),
+        "latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+        "latency_ms_p99": float(np.percentile(latencies, 99) * 1000),
+    }
+
+
+def pareto_front(results: list, k: int) -> list:
+    # a setting is dominated if another one is at least as good in recall and p50 latency
+    # and strictly better in one of them
+    front = []
+    for res in results:
+        dominated = any(
+            other[f"recall@{k}"] >= res[f"recall@{k}"]
+            and other["latency_ms_p50"] <= res["latency_ms_p50"]
+            and (
+                other[f"recall@{k}"] > res[f"recall@{k}"]
+                or other["latency_ms_p50"] < res["latency_ms_p50"]
+            )
+            for other in results
+        )
+        if not dominated:
+            front.append(res)
+    return sorted(front, key=lambda res: res["latency_ms_p50"])
+
+
+def schema_for(res: dict, class_name: str) -> dict:
+    """
+    The schema of a measured setting, together with the rerank it was measured with.
+    rerank is a client setting (the rerank argument of PipelineV3), the recall of the
+    setting only holds when the client reranks as many candidates.
+    """
+    class_config = copy.deepcopy(SCHEMA["classes"][0])
+    class_config["class"] = class_name
+    class_config["vectorIndexConfig"] = index_config(
+        res["efConstruction"], res["maxConnections"], res["ef"]
+    )
+    return {"schema": {"classes": [class_config]}, "rerank": res["rerank"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune hnsw parameters of weaviate.")
+    parser.add_argument("--db-adr", type=str, default="http://localhost:8080")
+    parser.add_argument("--collection", type=str, default="Test")
+    parser.add_argument("--snapshot", type=str, help="Read the sample from a snapshot")
+    parser.add_argument("--vectors", type=str, help="Read the sample from a .npy file")
+    parser.add_argument("--sample-size", type=int, default=20000)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--output", type=str, default="hnsw_tuning.json")
+    args = parser.parse_args()
+
+    sample = load_sample(args)
+    queries, base = sample[: args.num_queries], sample[args.num_queries :]
+    print(f"Loaded {len(base)} vectors and {len(queries)} queries of dim {base.shape[1]}")
+    ground_truth = exact_neighbours(base, queries, args.k)
+
+    client = weaviate.Client(args.db_adr)
+    results = []
+    for ef_construction, max_connections in itertools.product(
+        EF_CONSTRUCTION, MAX_CONNECTIONS
+    ):
+        class_name = f"HnswTune{ef_construction}x{max_connections}"
+        try:
+            import_time = build_collection(
+                client, class_name, base, ef_construction, max_connections
+            )
+            for ef, rerank in itertools.product(EF, RERANK):
+                client.schema.update_config(class_name, {"vectorIndexConfig": {"ef": ef}})
+                res = {
+                    "efConstruction": ef_construction,
+                    "maxConnections": max_connections,
+                    "ef": ef,
+                    "rerank": rerank,
+                    "import_s": import_time,
+                    "estimated_memory_bytes": estimate_index_memory(
+                        len(base), base.shape[1], max_connections
+                    ),
+                }
+                res.update(
+                    benchmark_loop(
+                        client, class_name, queries, ground_truth, args.k, rerank
+                    )
+                )
+                print(res)
+                results.append(res)
+        finally:
+            client.schema.delete_class(class_name)
+
+    front = pareto_front(results, args.k)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "results": results,
+                "pareto": front,
+                "settings": [schema_for(res, args.collection) for res in front],
+            },
+            f,
+            indent=2,
+        )
+    print(f"Pareto optimal settings written to {args.output}:")
+    for res in front:
+        print(res)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Encoding of image arrays into the string payload stored in the image property.
+
+Supported encodings:
+    list: legacy python literal, str(img.tolist())
+    png:  base64 of a lossless png file, which is what img2vec expects for blob fields
+    webp: base64 of a lossless webp file
+    raw:  "raw:<dtype>:<shape>:" header followed by base64 of the raw array bytes
+
+png stores uint8 gray, rgb and rgba images and uint16 gray images as 16 bit png, webp
+only uint8 rgb and rgba. Images a format cannot hold exactly fall back to png and then
+to raw, payloads never lose precision.
+"""
+from typing import Optional
+import base64
+import io
+import ast
+import numpy as np
+from PIL import Image
+
+ENCODINGS = ["list", "png", "webp", "raw"]
+RAW_PREFIX = "raw:"
+
+
+def encode_image(img: np.ndarray, encoding: str = "list") -> str:
+    if encoding == "list":
+        return str(img.tolist())
+    elif encoding in ["png", "webp"]:
+        image_format = _lossless_format(img, encoding)
+        if image_format is None:
+            return encode_image(img, "raw")
+        byte_arr = io.BytesIO()
+        pil_img = Image.fromarray(np.ascontiguousarray(img))
+        if image_format == "png":
+            pil_img.save(byte_arr, format="PNG", compress_level=1)
+        else:
+            pil_img.save(byte_arr, format="WEBP", lossless=True, exact=True)
+        return base64.b64encode(byte_arr.getvalue()).decode("ascii")
+    elif encoding == "raw":
+        img = np.ascontiguousarray(img)
+        shape = "x".join(str(i) for i in img.shape)
+        header = f"{RAW_PREFIX}{img.dtype.str}:{shape}:"
+        return header + base64.b64encode(img.tobytes()).decode("ascii")
+    else:
+        raise ValueError(f"Unknown image encoding {encoding}, use one of {ENCODINGS}")
+
+
+def decode_image(payload: str) -> np.ndarray:
+    """
+    Inverse of encode_image, the encoding is detected from the payload itself.
+    """
+    if payload.startswith("["):
+        return np.array(ast.literal_eval(payload))
+    elif payload.startswith(RAW_PREFIX):
+        _, dtype, shape, data = payload.split(":", 3)
+        shape = tuple(int(i) for i in shape.split("x"))
+        return np.frombuffer(base64.b64decode(data), dtype=np.dtype(dtype)).reshape(
+            shape
+        )
+    else:
+        pil_img = Image.open(io.BytesIO(base64.b64decode(payload)))
+        img = np.array(pil_img)
+        # older pillow versions open 16 bit png as 32 bit integers
+        if pil_img.mode == "I":
+            img = img.astype(np.uint16)
+        return img
+
+
+def _lossless_format(img: np.ndarray, encoding: str) -> Optional[str]:
+    channels = img.shape[2] if img.ndim == 3 else None
+    if img.dtype == np.uint8 and channels in [3, 4]:
+        return encoding
+    if img.dtype == np.uint8 and img.ndim == 2:
+        # webp stores gray images as rgb
+        return "png"
+    if img.dtype == np.uint16 and img.ndim == 2:
+        return "png"
+    return None
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Bounded queue pipeline for ingesting images:
+
+    paths -> decode (thread pool) -> descriptors (batched) -> writer (database batch)
+
+Every stage runs in its own threads and the queues between them are bounded, so decoding
+overlaps inference and network I/O while memory stays limited to a few batches.
+"""
+import os
+import time
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable
+
+# marks the end of the stream in a queue
+_DONE = object()
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        decode: Callable,
+        describe: Callable,
+        write: Callable,
+        decode_workers: int = 4,
+        describe_workers: int = 1,
+        batch_size: int = 32,
+        queue_size: int = 256,
+        report_every: float = 10.0,
+    ) -> None:
+        """
+        decode(item) -> record, describe(list of records) -> list of vectors and
+        write(record, vector) are called from the stage threads. write is only ever called
+        from one thread.
+        """
+        self.decode = decode
+        self.describe = describe
+        self.write = write
+        self.decode_workers = max(1, decode_workers)
+        self.describe_workers = max(1, describe_workers)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.report_every = report_every
+        self.errors = []
+        self.num_written = 0
+        self._lock = threading.Lock()
+
+    def _error(self, item, e: Exception) -> None:
+        print(f"Skipping {item}: {e}")
+        with self._lock:
+            self.errors.append({"item": str(item), "error": str(e)})
+
+    def _decode_stage(self, items: queue.Queue, decoded: queue.Queue) -> None:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            try:
+                decoded.put((item, self.decode(item)))
+            except Exception as e:
+                self._error(item, e)
+
+    def _describe_stage(self, decoded: queue.Queue, described: queue.Queue) -> None:
+        done = False
+        while not done:
+            batch = []
+            while len(batch) < self.batch_size:
+                entry = decoded.get()
+                if entry is _DONE:
+                    done = True
+                    break
+                batch.append(entry)
+            if not batch:
+                continue
+            try:
+                vectors = self.describe([record for _, record in batch])
+                # without one vector per record there is no telling which vector
+                # belongs to which image, so the whole batch fails
+                if len(vectors) != len(batch):
+                    raise ValueError(
+                        f"describe returned {len(vectors)} vectors for "
+                        f"{len(batch)} records"
+                    )
+            except Exception as e:
+                for item, _ in batch:
+                    self._error(item, e)
+                continue
+            for (item, record), vector in zip(batch, vectors):
+                described.put((item, record, vector))
+        described.put(_DONE)
+
+    def _write_stage(self, described: queue.Queue, num_producers: int) -> None:
+        finished = 0
+        start = time.perf_counter()
+        last_report = start
+        while finished < num_producers:
+            entry = described.get()
+            if entry is _DONE:
+                finished += 1
+                continue
+            item, record, vector = entry
+            try:
+                self.write(record, vector)
+                self.num_written += 1
+            except Exception as e:
+                self._error(item, e)
+            now = time.perf_counter()
+            if now - last_report >= self.report_every:
+                print(
+                    f"Ingested {self.num_written} images, "
+                    f"{self.num_written / (now - start):.1f} images/s"
+                )
+                last_report = now
+
+    def run(self, items: Iterable) -> dict:
+        start = time.perf_counter()
+        paths = queue.Queue(self.queue_size)
+        decoded = queue.Queue(self.queue_size)
+        described = queue.Queue(self.queue_size)
+        decoders = [
+            threading.Thread(target=self._decode_stage, args=(paths, decoded), daemon=True)
+            for _ in range(self.decode_workers)
+        ]
+        describers = [
+            threading.Thread(
+                target=self._describe_stage, args=(decoded, described), daemon=True
+            )
+            for _ in range(self.describe_workers)
+        ]
+        writer = threading.Thread(
+            target=self._write_stage, args=(described, self.describe_workers), daemon=True
+        )
+        for thread in decoders + describers + [writer]:
+            thread.start()
+
+        for item in items:
+            paths.put(item)
+        for _ in decoders:
+            paths.put(_DONE)
+        for thread in decoders:
+            thread.join()
+        for _ in describers:
+            decoded.put(_DONE)
+        for thread in describers:
+            thread.join()
+        writer.join()
+
+        seconds = time.perf_counter() - start
+        result = {
+            "written": self.num_written,
+            "failed": len(self.errors),
+            "seconds": seconds,
+            "images_per_s": self.num_written / seconds if seconds else 0.0,
+            "errors": self.errors,
+        }
+        print(
+            f"Ingested {self.num_written} images in {seconds:.1f}s, "
+            f"{result['images_per_s']:.1f} images/s, {len(self.errors)} failed"
+        )
+        return result
+
+
+def walk_files(directory: str, allowed_formats: list, num_workers: int = 8) -> list:
+    """
+    Recursive listing of all files with one of the allowed extensions, as
+    (path, size, mtime) tuples. Directories are scanned in parallel with os.scandir,
+    which also provides size and mtime without an extra stat per file.
+    """
+    suffixes = tuple("." + format.lower() for format in allowed_formats)
+    files = []
+    lock = threading.Lock()
+
+    def scan(path: str) -> list:
+        subdirs = []
+        found = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(suffixes):
+                        stat = entry.stat()
+                        found.append((entry.path, stat.st_size, stat.st_mtime))
+        except OSError as e:
+            print(f"Failed to scan {path}. Reason: {e}")
+        with lock:
+            files.extend(found)
+        return subdirs
+
+    with ThreadPoolExecutor(num_workers) as executor:
+        pending = {executor.submit(scan, os.path.abspath(directory))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.update(executor.submit(scan, subdir) for subdir in future.result())
+    return sorted(files)
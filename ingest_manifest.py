@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Persistent record of every file build_database has seen, per collection:
+
+    path, size, mtime, content hash, object uuid, status
+
+A file moves pending -> queued -> done (or failed). Files whose size or mtime changed are
+marked changed and files that disappeared are marked deleting until their old objects are
+removed from the database, so an interrupted run resumes from the manifest alone.
+"""
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+HOME = str(Path.home())
+DEFAULT_MANIFEST = HOME + "/.msirs/ingest_manifest.sqlite"
+
+PENDING = "pending"
+QUEUED = "queued"
+DONE = "done"
+FAILED = "failed"
+CHANGED = "changed"
+DELETING = "deleting"
+DELETED = "deleted"
+
+
+class IngestManifest:
+    def __init__(self, schema: str, path: str = DEFAULT_MANIFEST) -> None:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.schema = schema
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "schema TEXT NOT NULL, path TEXT NOT NULL, size INTEGER, mtime REAL, "
+                "content_hash TEXT, uuid TEXT, status TEXT NOT NULL, error TEXT, "
+                "updated REAL, PRIMARY KEY (schema, path))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS files_status ON files (schema, status)"
+            )
+
+    def _rows(self, directory: str, statuses: list) -> list:
+        # all rows below directory with one of the statuses
+        prefix = os.path.join(os.path.abspath(directory), "")
+        with self._lock:
+            return self.conn.execute(
+                "SELECT path, size, mtime, content_hash, uuid, status FROM files "
+                "WHERE schema = ? AND substr(path, 1, ?) = ? "
+                f"AND status IN ({','.join('?' * len(statuses))}) ORDER BY path",
+                [self.schema, len(prefix), prefix] + statuses,
+            ).fetchall()
+
+    def sync(self, files: list, directory: str) -> dict:
+        """
+        Compares the (path, size, mtime) listing of directory with the manifest and updates
+        the status of every file. Returns the number of files per outcome.
+        """
+        known = {
+            row[0]: row
+            for row in self._rows(
+                directory, [PENDING, QUEUED, DONE, FAILED, CHANGED, DELETING, DELETED]
+            )
+        }
+        now = time.time()
+        updates = []
+        counts = {"new": 0, "unchanged": 0, "changed": 0, "resumed": 0, "deleted": 0}
+        for path, size, mtime in files:
+            row = known.pop(path, None)
+            modified = row is not None and (row[1] != size or row[2] != mtime)
+            if row is None:
+                status = PENDING
+                counts["new"] += 1
+            elif row[5] == DONE and not modified:
+                counts["unchanged"] += 1
+                continue
+            elif row[4] is not None and (
+                row[5] in [DONE, CHANGED, DELETING] or (row[5] == QUEUED and modified)
+            ):
+                # the old object is removed before the new version is ingested
+                status = CHANGED
+                counts["changed"] += 1
+            else:
+                status = QUEUED if row[5] == QUEUED else PENDING
+                counts["resumed"] += 1
+            updates.append((size, mtime, status, now, self.schema, path))
+        deletions = []
+        for path, row in known.items():
+            if row[5] == DELETED:
+                continue
+            status = DELETING if row[4] is not None else DELETED
+            deletions.append((status, now, self.schema, path))
+            counts["deleted"] += 1
+
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO files (size, mtime, status, updated, schema, path) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (schema, path) DO UPDATE SET "
+                "size = excluded.size, mtime = excluded.mtime, "
+                "status = excluded.status, "
+                "updated = excluded.updated",
+                updates,
+            )
+            self.conn.executemany(
+                "UPDATE files SET status = ?, updated = ? WHERE schema = ? AND path = ?",
+                deletions,
+            )
+        return counts
+
+    def stale(self, directory: str) -> list:
+        """
+        (path, uuid, content_hash) of changed and deleted files whose objects are still
+        in the database.
+        """
+        return [
+            (path, obj_uuid, img_hash)
+            for path, _, _, img_hash, obj_uuid, _ in self._rows(
+                directory, [CHANGED, DELETING]
+            )
+        ]
+
+    def uuid_in_use(self, obj_uuid: str, path: str) -> bool:
+        # identical images share one object, it stays as long as any file refers to it
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM files WHERE schema = ? AND uuid = ? AND path != ? "
+                "AND status IN (?, ?)",
+                (self.schema, obj_uuid, path, DONE, QUEUED),
+            ).fetchone()
+        return row is not None
+
+    def mark_removed(self, path: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE files SET status = CASE status WHEN ? THEN ? ELSE ? END, "
+                "uuid = NULL, content_hash = NULL, updated = ? "
+                "WHERE schema = ? AND path = ?",
+                (CHANGED, PENDING, DELETED, time.time(), self.schema, path),
+            )
+
+    def to_ingest(self, directory: str) -> list:
+        """
+        (path, content_hash) of every file that still needs to be written, queued files
+        of an interrupted run carry the hash that was sent to the database.
+        """
+        return [
+            (path, img_hash)
+            for path, _, _, img_hash, _, _ in self._rows(
+                directory, [PENDING, QUEUED, FAILED]
+            )
+        ]
+
+    def mark_queued(self, path: str, img_hash: str, obj_uuid: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE files SET status = ?, content_hash = ?, uuid = ?, error = NULL, "
+                "updated = ? WHERE schema = ? AND path = ?",
+                (QUEUED, img_hash, obj_uuid, time.time(), self.schema, path),
+            )
+
+    def mark_done(self, paths: list) -> None:
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "UPDATE files SET status = ?, updated = ? WHERE schema = ? AND path = ?",
+                [(DONE, now, self.schema, path) for path in paths],
+            )
+
+    def mark_failed(self, path: str, error: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE files SET status = ?, error = ?, updated = ? "
+                "WHERE schema = ? AND path = ?",
+                (FAILED, error, time.time(), self.schema, path),
+            )
+
+    def queued(self, directory: str) -> list:
+        return [
+            (path, obj_uuid)
+            for path, _, _, _, obj_uuid, _ in self._rows(directory, [QUEUED])
+        ]
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM files WHERE schema = ? GROUP BY status",
+                (self.schema,),
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        self.conn.close()
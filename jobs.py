@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Retrieval jobs that run concurrently without sharing any folder. Every job gets an id and
+a workspace below the jobs directory:
+
+    <id>/query.<ext>        copy of the query image
+    <id>/results/           output of PipelineV3.store_for_ui
+    <id>/status.json        status record, queued -> running -> done or failed
+
+The status record is the only state, so other processes can poll it as well.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+HOME = str(Path.home())
+DEFAULT_JOBS_DIRECTORY = HOME + "/.msirs/jobs/"
+NUM_WORKERS = max(1, (os.cpu_count() or 4) // 2)
+MAX_AGE = 24 * 3600
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobManager:
+    def __init__(
+        self,
+        pipe,
+        directory: str = DEFAULT_JOBS_DIRECTORY,
+        num_workers: int = NUM_WORKERS,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.pipe = pipe
+        self.directory = directory
+        self.executor = ThreadPoolExecutor(num_workers)
+
+    def workspace(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id)
+
+    def _write_status(self, job_id: str, **fields) -> dict:
+        path = os.path.join(self.workspace(job_id), "status.json")
+        status = self.status(job_id) or {"id": job_id}
+        status.update(fields, updated=time.time())
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(status, f)
+        os.replace(tmp_path, path)
+        return status
+
+    def status(self, job_id: str) -> Optional[dict]:
+        path = os.path.join(self.workspace(job_id), "status.json")
+        if os.path.basename(job_id) != job_id or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def submit(self, img_path: str, where: Optional[dict] = None) -> str:
+        """
+        Copies the query image into a new workspace and queues the retrieval, returns
+        the job id. Uploads from the query folder are moved instead of copied.
+        """
+        job_id = uuid.uuid4().hex
+        workspace = self.workspace(job_id)
+        os.makedirs(os.path.join(workspace, "results"))
+        query = os.path.join(workspace, "query" + os.path.splitext(img_path)[1].lower())
+        if os.path.dirname(os.path.abspath(img_path)) == HOME + "/query":
+            shutil.move(img_path, query)
+        else:
+            shutil.copyfile(img_path, query)
+        self._write_status(
+            job_id,
+            status=QUEUED,
+            created=time.time(),
+            query=query,
+            workspace=workspace,
+            results=os.path.join(workspace, "results", ""),
+        )
+        self.executor.submit(self._run, job_id, query, where)
+        return job_id
+
+    def _run(self, job_id: str, query: str, where: Optional[dict]) -> None:
+        import skimage.io
+
+        start = time.time()
+        self._write_status(job_id, status=RUNNING, started=start)
+        try:
+            img = skimage.io.imread(query)
+            response = self.pipe.query_image(img, where=where)
+            if "has_error" in response:
+                raise RuntimeError("Error during query")
+            folder = os.path.join(self.workspace(job_id), "results", "")
+            excep = self.pipe.store_for_ui(folder, response, query)
+            self._write_status(
+                job_id,
+                status=DONE,
+                seconds=time.time() - start,
+                distances=response["distances"],
+                incomplete=excep,
+            )
+        except Exception as e:
+            print(f"Job {job_id} failed. Reason: {e}")
+            self._write_status(job_id, status=FAILED, error=str(e))
+
+    def cleanup(self, max_age: float = MAX_AGE) -> int:
+        # removes finished jobs older than max_age seconds
+        removed = 0
+        now = time.time()
+        for job_id in os.listdir(self.directory):
+            status = self.status(job_id)
+            if status is None or status["status"] not in [DONE, FAILED]:
+                continue
+            if now - status["updated"] > max_age:
+                shutil.rmtree(self.workspace(job_id), ignore_errors=True)
+                removed += 1
+        return removed
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Places result images in the ui folder without decoding and re-encoding them:
+
+    link       hardlink, reflink or copy of the original bytes, in that order
+    thumbnail  size bounded jpeg from a persistent thumbnail cache
+    reencode   decode and save as png, the old behaviour
+
+Only hits whose region of interest is a part of the original image are decoded, to crop.
+"""
+import os
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+HOME = str(Path.home())
+DEFAULT_THUMBNAIL_CACHE = HOME + "/.msirs/thumbnails/"
+MATERIALIZE_MODES = ["link", "thumbnail", "reencode"]
+THUMBNAIL_SIZE = 512
+NUM_WORKERS = 4
+
+# ioctl to share the extents of a file on btrfs/xfs, from linux/fs.h
+FICLONE = 0x40049409
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        import fcntl
+
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return "reflink"
+    except (ImportError, OSError):
+        shutil.copyfile(src, dst)
+        return "copy"
+
+
+class ThumbnailCache:
+    def __init__(
+        self, directory: str = DEFAULT_THUMBNAIL_CACHE, max_size: int = THUMBNAIL_SIZE
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+
+    def path_for(self, src: str) -> str:
+        # keyed by path, size and mtime so a changed original gets a new thumbnail
+        stat = os.stat(src)
+        key = f"{os.path.abspath(src)}:{stat.st_size}:{stat.st_mtime}:{self.max_size}"
+        name = hashlib.sha1(key.encode()).hexdigest() + ".jpg"
+        return os.path.join(self.directory, name)
+
+    def get(self, src: str) -> str:
+        path = self.path_for(src)
+        if not os.path.exists(path):
+            with Image.open(src) as img:
+                # jpeg decoders can skip most of the work for a downscaled result
+                img.draft("RGB", (self.max_size, self.max_size))
+                img = img.convert("RGB")
+                img.thumbnail((self.max_size, self.max_size))
+                tmp_path = path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+                img.save(tmp_path, "JPEG", quality=90)
+            os.replace(tmp_path, path)
+        return path
+
+
+def roi_of(meta_data: dict) -> Optional[tuple]:
+    box = [
+        meta_data.get(f"roi_{i}") for i in ["row_min", "row_max", "col_min", "col_max"]
+    ]
+    if any(i is None for i in box):
+        return None
+    return tuple(int(i) for i in box)
+
+
+def materialize(
+    src: str,
+    dst_stem: str,
+    mode: str = "link",
+    roi: Optional[tuple] = None,
+    thumbnails: Optional[ThumbnailCache] = None,
+) -> str:
+    """
+    Writes the result for src to dst_stem plus a suitable extension, returns that path.
+    """
+    if mode not in MATERIALIZE_MODES:
+        raise ValueError(
+            f"Unknown materialization mode {mode}, use one of {MATERIALIZE_MODES}"
+        )
+    if roi is not None:
+        # the header is enough to tell whether the roi is the whole image
+        with Image.open(src) as img:
+            width, height = img.size
+        row_min, row_max, col_min, col_max = roi
+        # tiles carry the roi in stripe coordinates, those do not fit and are kept whole
+        inside = min(row_min, col_min) >= 0 and row_max <= height and col_max <= width
+        whole = (row_min, row_max, col_min, col_max) == (0, height, 0, width)
+        if inside and not whole:
+            with Image.open(src) as img:
+                cutout = np.asarray(img)[row_min:row_max, col_min:col_max]
+            dst = dst_stem + ".png"
+            Image.fromarray(cutout).save(dst)
+            return dst
+    if mode == "reencode":
+        dst = dst_stem + ".png"
+        with Image.open(src) as img:
+            img.save(dst)
+        return dst
+    if mode == "thumbnail":
+        if thumbnails is None:
+            thumbnails = ThumbnailCache()
+        src = thumbnails.get(src)
+    dst = dst_stem + os.path.splitext(src)[1].lower()
+    link_or_copy(src, dst)
+    return dst
+
+
+def materialize_all(
+    jobs: list,
+    mode: str = "link",
+    thumbnails: Optional[ThumbnailCache] = None,
+    num_workers: int = NUM_WORKERS,
+) -> list:
+    """
+    jobs are (src, dst_stem, roi) tuples, returns the written path or None per job.
+    """
+    if mode == "thumbnail" and thumbnails is None:
+        thumbnails = ThumbnailCache()
+
+    def run(job: tuple) -> Optional[str]:
+        src, dst_stem, roi = job
+        try:
+            return materialize(src, dst_stem, mode, roi, thumbnails)
+        except Exception as e:
+            print(f"Failed to materialize {src}. Reason: {e}")
+            return None
+
+    with ThreadPoolExecutor(num_workers) as executor:
+        return list(executor.map(run, jobs))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Typed metadata properties stored next to every image, and helpers to build where filters
+on them.
+"""
+import os
+import re
+import json
+from typing import Optional
+
+CATEGORIES = {
+    0: "aec",
+    1: "ael",
+    2: "cli",
+    3: "cra",
+    4: "fse",
+    5: "fsf",
+    6: "fsg",
+    7: "fss",
+    8: "mix",
+    9: "rid",
+    10: "rou",
+    11: "sfe",
+    12: "sfx",
+    13: "smo",
+    14: "tex",
+}
+
+# field tokenization keeps ids like D14_032794_1989_XN_18N282W in one piece for filtering
+METADATA_PROPERTIES = [
+    {"name": "source_stripe", "dataType": ["string"], "tokenization": "field"},
+    {"name": "instrument", "dataType": ["string"], "tokenization": "field"},
+    {"name": "landform_class", "dataType": ["string"], "tokenization": "field"},
+    {"name": "latitude", "dataType": ["number"]},
+    {"name": "longitude", "dataType": ["number"]},
+    {"name": "roi_row_min", "dataType": ["int"]},
+    {"name": "roi_row_max", "dataType": ["int"]},
+    {"name": "roi_col_min", "dataType": ["int"]},
+    {"name": "roi_col_max", "dataType": ["int"]},
+    # pyramid level of the descriptor, see pyramid.py, unset for single scale objects
+    {"name": "scale", "dataType": ["number"]},
+]
+METADATA_FIELDS = [prop["name"] for prop in METADATA_PROPERTIES]
+VALUE_TYPES = {
+    "string": "valueString",
+    "number": "valueNumber",
+    "int": "valueInt",
+}
+FIELD_VALUE_TYPES = {
+    prop["name"]: VALUE_TYPES[prop["dataType"][0]] for prop in METADATA_PROPERTIES
+}
+
+# keys the fields have been stored under in the metadata json files
+ALIASES = {
+    "source_stripe": ["source_stripe", "stripe", "stripe_id", "product_id"],
+    "instrument": ["instrument"],
+    "landform_class": ["landform_class", "class", "label", "category"],
+    "latitude": ["latitude", "lat", "center_latitude"],
+    "longitude": ["longitude", "lon", "center_longitude"],
+}
+ROI_ALIASES = ["roi", "box", "bbox"]
+
+# D14_032794_1989_XN_18N282W
+CTX_PATTERN = re.compile(
+    r"([A-Z]\d{2}_\d{6}_\d{4}_X[A-Z]_(\d{2})([NS])(\d{3})([EW]))"
+)
+# ESP_046128_2465_RED
+HIRISE_PATTERN = re.compile(r"((?:ESP|PSP)_\d{6}_\d{4})")
+# ..._row_0_col_8192_w_1024_h_1024...
+TILE_PATTERN = re.compile(r"row_(\d+)_col_(\d+)_w_(\d+)_h_(\d+)")
+
+
+def load_metadata(original_file_path: str) -> dict:
+    """
+    Reads the metadata json, either the given file or the sidecar json next to the image.
+    Returns an empty dict if there is none.
+    """
+    if original_file_path.endswith(".json"):
+        json_path = original_file_path
+    else:
+        json_path = os.path.splitext(original_file_path)[0] + ".json"
+    if not os.path.exists(json_path):
+        return {}
+    with open(json_path) as f:
+        return json.load(f)
+
+
+def extract_properties(metadata: dict, file_path: str = "") -> dict:
+    """
+    Maps a metadata dict onto the typed properties, missing fields are filled from the
+    file path where possible (stripe id, instrument, coordinates, tile box, class folder).
+    """
+    properties = {}
+    for field, aliases in ALIASES.items():
+        for alias in aliases:
+            if metadata.get(alias) is not None:
+                properties[field] = metadata[alias]
+                break
+    for alias in ROI_ALIASES:
+        if metadata.get(alias) is not None:
+            box = metadata[alias]
+            if isinstance(box, str):
+                box = json.loads(box)
+            (
+                properties["roi_row_min"],
+                properties["roi_row_max"],
+                properties["roi_col_min"],
+                properties["roi_col_max"],
+            ) = [int(i) for i in box]
+            break
+
+    name = os.path.basename(file_path)
+    ctx = CTX_PATTERN.search(name)
+    hirise = HIRISE_PATTERN.search(name)
+    if ctx:
+        properties.setdefault("source_stripe", ctx.group(1))
+        properties.setdefault("instrument", "CTX")
+        lat = int(ctx.group(2)) * (1 if ctx.group(3) == "N" else -1)
+        # stripe names mostly give west longitude, stored as east longitude in [0, 360)
+        lon = int(ctx.group(4))
+        if ctx.group(5) == "W":
+            lon = (360 - lon) % 360
+        properties.setdefault("latitude", lat)
+        properties.setdefault("longitude", lon)
+    elif hirise:
+        properties.setdefault("source_stripe", hirise.group(1))
+        properties.setdefault("instrument", "HiRISE")
+    tile = TILE_PATTERN.search(name)
+    if tile and "roi_row_min" not in properties:
+        row, col, width, height = [int(i) for i in tile.groups()]
+        properties["roi_row_min"] = row
+        properties["roi_row_max"] = row + height
+        properties["roi_col_min"] = col
+        properties["roi_col_max"] = col + width
+    if "landform_class" not in properties and file_path:
+        folder = os.path.basename(os.path.dirname(file_path))
+        if folder in CATEGORIES.values():
+            properties["landform_class"] = folder
+
+    if isinstance(properties.get("landform_class"), int):
+        properties["landform_class"] = CATEGORIES[properties["landform_class"]]
+    for field in ["latitude", "longitude"]:
+        if field in properties:
+            properties[field] = float(properties[field])
+    return properties
+
+
+def where_filter(
+    source_stripe: Optional[str] = None,
+    instrument: Optional[str] = None,
+    landform_class: Optional[str] = None,
+    min_latitude: Optional[float] = None,
+    max_latitude: Optional[float] = None,
+    min_longitude: Optional[float] = None,
+    max_longitude: Optional[float] = None,
+) -> Optional[dict]:
+    """
+    Builds a weaviate where filter from the given constraints, e.g. craters in CTX stripes
+    north of 20N: where_filter(instrument="CTX", landform_class="cra", min_latitude=20)
+    """
+    operands = []
+    for field, value in [
+        ("source_stripe", source_stripe),
+        ("instrument", instrument),
+        ("landform_class", landform_class),
+    ]:
+        if value is not None:
+            operands.append(condition(field, "Equal", value))
+    for field, operator, value in [
+        ("latitude", "GreaterThanEqual", min_latitude),
+        ("latitude", "LessThanEqual", max_latitude),
+        ("longitude", "GreaterThanEqual", min_longitude),
+        ("longitude", "LessThanEqual", max_longitude),
+    ]:
+        if value is not None:
+            operands.append(condition(field, operator, value))
+    if not operands:
+        return None
+    if len(operands) == 1:
+        return operands[0]
+    return {"operator": "And", "operands": operands}
+
+
+def condition(field: str, operator: str, value) -> dict:
+    return {"path": [field], "operator": operator, FIELD_VALUE_TYPES[field]: value}
+
+
+def where_to_graphql(where: dict) -> str:
+    """
+    Serializes a where filter into GraphQL argument syntax, for clients posting raw queries.
+    """
+    parts = []
+    for key, value in where.items():
+        if key == "operator":
+            parts.append(f"operator: {value}")
+        elif key == "operands":
+            parts.append(f"operands: [{', '.join(where_to_graphql(i) for i in value)}]")
+        else:
+            parts.append(f"{key}: {json.dumps(value)}")
+    return "{" + ", ".join(parts) + "}"
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Persistent index from image file name and stored source path to the full path of the
+original image, so results can be materialized without scanning the dataset.
+"""
+import os
+import sqlite3
+import argparse
+import threading
+from typing import Optional
+from pathlib import Path
+from ingest import walk_files
+
+HOME = str(Path.home())
+DEFAULT_PATH_INDEX = HOME + "/.msirs/paths.sqlite"
+
+
+class PathIndex:
+    def __init__(self, path: str = DEFAULT_PATH_INDEX) -> None:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS paths ("
+                "path TEXT PRIMARY KEY, name TEXT NOT NULL, source TEXT)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS paths_name ON paths (name)")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS paths_source ON paths (source)"
+            )
+
+    def add(self, path: str, source: Optional[str] = None) -> None:
+        self.add_many([(path, source)])
+
+    def add_many(self, entries: list) -> None:
+        """
+        entries are (original path, source path in the database or None).
+        """
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO paths (path, name, source) VALUES (?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET "
+                "source = COALESCE(excluded.source, paths.source)",
+                [
+                    (os.path.abspath(path), os.path.basename(path), source)
+                    for path, source in entries
+                ],
+            )
+
+    def remove(self, path: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM paths WHERE path = ?", (os.path.abspath(path),)
+            )
+
+    def lookup(self, name: str) -> Optional[str]:
+        """
+        Full path of the original image for a source path as stored in the database or
+        for a bare file name.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT path FROM paths WHERE source = ? LIMIT 1", (name,)
+            ).fetchone()
+            if row is None:
+                row = self.conn.execute(
+                    "SELECT path FROM paths WHERE name = ? LIMIT 1",
+                    (os.path.basename(name),),
+                ).fetchone()
+        return row[0] if row else None
+
+    def index_directory(self, directory: str, allowed_formats: list) -> int:
+        files = walk_files(directory, allowed_formats)
+        self.add_many([(path, None) for path, _, _ in files])
+        return len(files)
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM paths").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Add all images below a directory to the path index."
+    )
+    parser.add_argument("directory", type=str)
+    parser.add_argument("--formats", type=str, nargs="+", default=["jpg", "png"])
+    parser.add_argument("--index", type=str, default=DEFAULT_PATH_INDEX)
+    args = parser.parse_args()
+
+    index = PathIndex(args.index)
+    num_files = index.index_directory(args.directory, args.formats)
+    print(f"Indexed {num_files} images, {index.count()} in total")
+    index.close()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Compares payload size and encode time of the supported image encodings
+# against the legacy str(img.tolist()) format on synthetic tiles.
+
+import time
+import argparse
+import numpy as np
+from image_payload import ENCODINGS, encode_image, decode_image
+
+
+def make_images(num_images: int, size: int, channels: int) -> list:
+    rng = np.random.default_rng(0)
+    imgs = []
+    for _ in range(num_images):
+        # smooth noise resembles terrain better than white noise and compresses like it
+        coarse = rng.integers(0, 256, (size // 16 + 1, size // 16 + 1, channels))
+        img = np.kron(coarse, np.ones((16, 16, 1)))[:size, :size]
+        img = img + rng.integers(-8, 8, img.shape)
+        imgs.append(np.clip(img, 0, 255).astype(np.uint8).squeeze())
+    return imgs
+
+
+def benchmark_loop(imgs: list, encodings: list) -> dict:
+    res_dict = {}
+    raw_bytes = sum(img.nbytes for img in imgs) / len(imgs)
+    for encoding in encodings:
+        payload_bytes = []
+        encode_times = []
+        decode_times = []
+        for img in imgs:
+            start = time.perf_counter()
+            payload = encode_image(img, encoding)
+            encode_times.append(time.perf_counter() - start)
+            payload_bytes.append(len(payload))
+            start = time.perf_counter()
+            decoded = decode_image(payload)
+            decode_times.append(time.perf_counter() - start)
+            assert np.array_equal(decoded, img), f"{encoding} is not lossless"
+        res_dict[encoding] = {
+            "payload_bytes": float(np.mean(payload_bytes)),
+            "ratio_to_pixels": float(np.mean(payload_bytes) / raw_bytes),
+            "encode_ms": float(np.mean(encode_times) * 1000),
+            "decode_ms": float(np.mean(decode_times) * 1000),
+        }
+    return res_dict
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark image payload encodings.")
+    parser.add_argument("-n", "--num-images", type=int, default=20)
+    parser.add_argument("-s", "--size", type=int, default=224)
+    parser.add_argument("-c", "--channels", type=int, default=3)
+    args = parser.parse_args()
+
+    imgs = make_images(args.num_images, args.size, args.channels)
+    results = benchmark_loop(imgs, ENCODINGS)
+    baseline = results["list"]
+    print(f"{'encoding':<8} {'bytes/img':>12} {'x pixels':>9} {'encode ms':>10} {'decode ms':>10} {'vs list':>8}")
+    for encoding, res in results.items():
+        print(
+            f"{encoding:<8} {res['payload_bytes']:>12.0f} {res['ratio_to_pixels']:>9.2f} "
+            f"{res['encode_ms']:>10.2f} {res['decode_ms']:>10.2f} "
+            f"{baseline['payload_bytes'] / res['payload_bytes']:>7.1f}x"
+        )
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+# Per stage latency of the PipelineV3 query and ingest path on synthetic images. Every
+# iteration decodes a query image, runs query_image and store_for_ui and adds a new
+# image with add_to_db, the wall time of each stage is summed per iteration:
+#
+#   decode       reading the query image, store_image (read and copy) on add
+#   preprocess   model.preprocess, if the model wrapper exposes it
+#   inference    the forward pass, including preprocessing for wrappers without it
+#   search       the vector search of the client
+#   materialize  store_for_ui, placing the hits and writing metadata.json
+#   write        path index and database write of add_to_db
+#
+# p50/p95/p99 and throughput go to a json file, `compare old.json new.json` prints the
+# change per stage and fails on regressions. The stand-in model is a random projection
+# that keeps tensorflow out of the measurement of everything around the model.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from PIL import Image
+from pipeline_v3 import PipelineV3
+
+STAGES = ["decode", "preprocess", "inference", "search", "materialize", "write"]
+OPERATIONS = ["query", "retrieve", "add"]
+PERCENTILES = [50, 95, 99]
+# relative change of a percentile that counts as regression in compare
+THRESHOLD = 0.1
+
+
+class StandInModel:
+    """
+    Random projection of the pooled image with the preprocess/feature_extractor
+    interface of the SENet wrapper.
+    """
+
+    def __init__(self, dim: int = 1024, size: int = 224, pool: int = 8) -> None:
+        self.size = size
+        self.pool = pool
+        features = (size // pool) ** 2 * 3
+        rng = np.random.default_rng(0)
+        weights = rng.standard_normal((features, dim)).astype(np.float32)
+        self.feature_extractor = StandInExtractor(weights / np.sqrt(features), pool)
+
+    def preprocess(self, img: np.ndarray) -> np.ndarray:
+        if img.ndim == 2:
+            img = np.stack([img] * 3, axis=-1)
+        resized = Image.fromarray(img[..., :3].astype(np.uint8)).resize(
+            (self.size, self.size), Image.BILINEAR
+        )
+        return np.asarray(resized, np.float32) / 255.0
+
+    def get_descriptor(self, img: np.ndarray) -> np.ndarray:
+        batch = self.preprocess(img)[None]
+        return self.feature_extractor.predict_on_batch(batch)[0]
+
+
+class StandInExtractor:
+    def __init__(self, weights: np.ndarray, pool: int) -> None:
+        self.weights = weights
+        self.pool = pool
+
+    def get_weights(self) -> list:
+        return [self.weights]
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        num, height, width, channels = batch.shape
+        pooled = batch.reshape(
+            num, height // self.pool, self.pool, width // self.pool, self.pool, channels
+        ).mean(axis=(2, 4))
+        return np.maximum(pooled.reshape(num, -1) @ self.weights, 0)
+
+
+class StageTimer:
+    """
+    Wraps methods of objects so their wall time is added to a stage. Stage times are
+    summed per iteration, end_iteration stores them as one sample per stage. Calls
+    nested in a running call of the same stage are not timed again, e.g. query_image
+    of the embedded store calling query_images.
+    """
+
+    def __init__(self) -> None:
+        self.current = {}
+        self.samples = {}
+        self.running = set()
+
+    def wrap(self, obj, name: str, stage: str) -> None:
+        method = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            if stage in self.running:
+                return method(*args, **kwargs)
+            self.running.add(stage)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.running.discard(stage)
+                self.add(stage, time.perf_counter() - start)
+
+        setattr(obj, name, timed)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.current[stage] = self.current.get(stage, 0.0) + seconds
+
+    def end_iteration(self) -> None:
+        for stage, seconds in self.current.items():
+            self.samples.setdefault(stage, []).append(seconds)
+        self.current = {}
+
+    def reset(self) -> None:
+        self.current = {}
+        self.samples = {}
+
+
+def summarize(samples: list) -> dict:
+    samples = np.asarray(samples)
+    summary = {
+        f"p{p}_ms": float(np.percentile(samples, p) * 1000) for p in PERCENTILES
+    }
+    summary["mean_ms"] = float(samples.mean() * 1000)
+    summary["count"] = len(samples)
+    summary["per_s"] = float(len(samples) / samples.sum()) if samples.sum() else 0.0
+    return summary
+
+
+def make_images(directory: str, count: int, size: int, seed: int) -> list:
+    # smooth noise with some structure, so png decoding is not trivially cheap
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for idx in range(count):
+        coarse = rng.integers(0, 256, (size // 8, size // 8, 3), dtype=np.uint8)
+        img = np.asarray(Image.fromarray(coarse).resize((size, size), Image.BICUBIC))
+        noise = rng.integers(-16, 16, img.shape)
+        img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"synthetic_{seed}_{idx:05d}.png")
+        Image.fromarray(img).save(path)
+        paths.append(path)
+    return paths
+
+
+def fill_store(pipe: PipelineV3, images: list, num_vectors: int, dim: int) -> None:
+    """
+    Background objects so the search sees a realistically sized store. Their sources
+    point at the synthetic images, so store_for_ui finds originals for every hit.
+    """
+    rng = np.random.default_rng(1)
+    pipe.path_index.add_many([(path, None) for path in images])
+    with pipe.client.batch(batch_size=1000) as batch:
+        for idx in range(num_vectors):
+            data_object = {
+                "source": "/images/" + os.path.basename(images[idx % len(images)]),
+                "meta_data": "{}",
+                "content_hash": f"background-{idx}",
+            }
+            vector = np.maximum(rng.standard_normal(dim), 0).astype(np.float32)
+            batch.add(data_object, vector=vector)
+
+
+def instrument(pipe: PipelineV3, timer: StageTimer) -> None:
+    model = pipe.model
+    if hasattr(model, "get_descriptors"):
+        timer.wrap(model, "get_descriptors", "inference")
+    elif hasattr(model, "preprocess") and hasattr(model, "feature_extractor"):
+        timer.wrap(model, "preprocess", "preprocess")
+        timer.wrap(model.feature_extractor, "predict_on_batch", "inference")
+    else:
+        timer.wrap(model, "get_descriptor", "inference")
+    timer.wrap(pipe.client, "query_image", "search")
+    timer.wrap(pipe.client, "query_images", "search")
+    timer.wrap(pipe.client, "add_to_db", "write")
+    timer.wrap(pipe.path_index, "add", "write")
+    timer.wrap(pipe, "store_image", "decode")
+    timer.wrap(pipe, "store_for_ui", "materialize")
+
+
+def decode(path: str) -> np.ndarray:
+    import skimage.io
+
+    return skimage.io.imread(path)
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="msirs_benchmark_")
+    try:
+        return run_in(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_in(args, workdir: str) -> dict:
+    storage = os.path.join(workdir, "images", "")
+    folder = os.path.join(workdir, "results", "")
+    os.makedirs(storage)
+    os.makedirs(folder)
+    db_adr = args.db_adr or "file://" + os.path.join(workdir, "store")
+    pipe = PipelineV3(
+        db_adr,
+        "Benchmark",
+        model_path=args.model_path,
+        image_storage_directory=storage,
+        vectorize="client",
+        path_index=os.path.join(workdir, "paths.sqlite"),
+        materialize=args.materialize,
+        descriptor_cache="",
+        model=StandInModel(args.dim) if args.stand_in_model else None,
+    )
+
+    total = args.warmup + args.iterations
+    queries = make_images(
+        os.path.join(workdir, "queries"), args.num_images, args.size, 0
+    )
+    additions = make_images(os.path.join(workdir, "additions"), total, args.size, 1)
+    dim = len(pipe.get_descriptor(decode(queries[0])))
+    fill_store(pipe, queries, args.num_vectors, dim)
+    print(f"Store holds {pipe.client.get_stats()['count']} objects of dim {dim}")
+
+    timer = StageTimer()
+    instrument(pipe, timer)
+    operations = {operation: [] for operation in OPERATIONS}
+    for iteration in range(total):
+        if iteration == args.warmup:
+            timer.reset()
+            operations = {operation: [] for operation in OPERATIONS}
+        query = queries[iteration % len(queries)]
+        start = time.perf_counter()
+        img = decode(query)
+        timer.add("decode", time.perf_counter() - start)
+        response = pipe.query_image(img)
+        queried = time.perf_counter()
+        if "has_error" in response:
+            raise RuntimeError(f"Query of {query} failed")
+        pipe.store_for_ui(folder, response, query)
+        retrieved = time.perf_counter()
+        pipe.add_to_db(additions[iteration])
+        added = time.perf_counter()
+        timer.end_iteration()
+        operations["query"].append(queried - start)
+        operations["retrieve"].append(retrieved - start)
+        operations["add"].append(added - retrieved)
+
+    return {
+        "config": {
+            "db_adr": args.db_adr or "file://",
+            "model_id": pipe.model_id,
+            "stand_in_model": args.stand_in_model,
+            "materialize": args.materialize,
+            "iterations": args.iterations,
+            "num_vectors": args.num_vectors,
+            "size": args.size,
+            "dim": dim,
+            "cpus": os.cpu_count(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+        },
+        "stages": {
+            stage: summarize(timer.samples[stage])
+            for stage in STAGES
+            if stage in timer.samples
+        },
+        "operations": {
+            operation: summarize(samples) for operation, samples in operations.items()
+        },
+    }
+
+
+def compare(old: dict, new: dict, threshold: float = THRESHOLD) -> list:
+    """
+    Prints the change of every percentile per stage and operation, returns the
+    regressions, i.e. percentiles that got slower by more than threshold.
+    """
+    regressions = []
+    for section in ["stages", "operations"]:
+        print(f"{section}:")
+        for name, summary in new[section].items():
+            if name not in old[section]:
+                print(f"  {name:<12} new")
+                continue
+            changes = []
+            for p in PERCENTILES:
+                key = f"p{p}_ms"
+                before, after = old[section][name][key], summary[key]
+                change = (after - before) / before if before else 0.0
+                changes.append(f"{key} {before:9.2f} -> {after:9.2f} ({change:+6.1%})")
+                if change > threshold:
+                    regressions.append(f"{section}.{name}.{key} {change:+.1%}")
+            print(f"  {name:<12} " + "  ".join(changes))
+    return regressions
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per stage latency benchmark of the PipelineV3 query path."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("run", help="Run the benchmark and write json")
+    bench.add_argument(
+        "--db-adr", type=str, default="", help="Defaults to a temporary embedded store"
+    )
+    bench.add_argument("--model-path", type=str, default=None)
+    bench.add_argument(
+        "--stand-in-model",
+        action="store_true",
+        help="Use a random projection instead of the SENet model",
+    )
+    bench.add_argument("--dim", type=int, default=1024, help="Stand-in descriptor size")
+    bench.add_argument("-n", "--iterations", type=int, default=200)
+    bench.add_argument("--warmup", type=int, default=10)
+    bench.add_argument("--num-images", type=int, default=50, help="Query images")
+    bench.add_argument("--num-vectors", type=int, default=10000, help="Store size")
+    bench.add_argument("--size", type=int, default=512, help="Side of the images")
+    bench.add_argument(
+        "--materialize", type=str, default="link", help="Mode of store_for_ui"
+    )
+    bench.add_argument("--output", type=str, default="pipeline_benchmark.json")
+    bench.add_argument("--baseline", type=str, help="Compare against this result json")
+    diff = commands.add_parser("compare", help="Diff two result json files")
+    diff.add_argument("old", type=str)
+    diff.add_argument("new", type=str)
+    for command in [bench, diff]:
+        command.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run(args)
+        for section in ["stages", "operations"]:
+            for name, summary in results[section].items():
+                print(f"{name}: {summary}")
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        old = load_results(args.baseline) if args.baseline else None
+    else:
+        old, results = load_results(args.old), load_results(args.new)
+    if old is not None:
+        regressions = compare(old, results, args.threshold)
+        if regressions:
+            print(f"Regressions: {regressions}")
+            raise SystemExit(1)
@@ -1,16 +1,29 @@
 #!/usr/bin/env python3
 
 import shutil
+import threading
 import numpy as np
-import re, os, glob
-import skimage
-from matplotlib import pyplot as plt
-import numpy as np
+import os
 from pathlib import Path
 
-from weaviate_client import WeaviateClient
-import tensorflow as tf
-from msirs_utils.segmentation.senet_model import SENet
+from weaviate_client import CLIENT_VECTORIZER, WeaviateClient
+from embedded_client import EmbeddedClient
+from query_cache import QueryCache
+from descriptors import DESCRIPTOR_BATCH_SIZE, get_descriptors, model_identifier
+from ingest import IngestPipeline, walk_files
+from ingest_manifest import DEFAULT_MANIFEST, IngestManifest
+from path_index import DEFAULT_PATH_INDEX, PathIndex
+from materialize import ThumbnailCache, materialize_all, roi_of
+from descriptor_cache import DEFAULT_DESCRIPTOR_CACHE, DescriptorCache
+from pyramid import fuse_responses, level_hash, level_objects, pyramid_levels
+from tiling import (
+    STRIDE,
+    TILE_SIZE,
+    iter_windows,
+    merge_hits,
+    open_strip,
+    ranked_response,
+)
 import argparse
 import json
 
@@ -21,24 +34,6 @@ CERT_THRESHOLD = 8
 
 HOME = str(Path.home())
 
-CATEGORIES = {
-    0: "aec",
-    1: "ael",
-    2: "cli",
-    3: "cra",
-    4: "fse",
-    5: "fsf",
-    6: "fsg",
-    7: "fss",
-    8: "mix",
-    9: "rid",
-    10: "rou",
-    11: "sfe",
-    12: "sfx",
-    13: "smo",
-    14: "tex",
-}
-
 
 color_info = {
     "aec": (31, 119, 180),
@@ -72,6 +67,58 @@ interesting_classes = [
 MODEL_PATH = ""
 
 
+def create_client(
+    db_adr: str,
+    schema: str = "Test",
+    compression: str = "none",
+    model_id: str = "",
+    image_encoding: str = "",
+    query_cache: QueryCache = None,
+    rerank: int = 0,
+    ensure_schema: bool = True,
+    **kwargs,
+):
+    """
+    Picks the database backend from the address scheme, file:///some/dir selects the
+    embedded store, everything else is treated as a weaviate url. The embedded store
+    keeps no image payload, so it rejects an image_encoding, rerank sets its number of
+    exact re-ranked candidates of the compressed search. Without ensure_schema the
+    collection is neither created nor migrated.
+    """
+    if db_adr.startswith("file://"):
+        directory = os.path.join(db_adr[len("file://") :], schema or "Test")
+        if not ensure_schema and not os.path.isdir(directory):
+            raise ValueError(f"No embedded store at {directory}")
+        if image_encoding:
+            raise ValueError(
+                f"The embedded store keeps no image payload, got {image_encoding}"
+            )
+        options = {"rerank": rerank} if rerank > 0 else {}
+        return EmbeddedClient(
+            db_adr,
+            schema,
+            compression=compression,
+            model_id=model_id,
+            query_cache=query_cache,
+            **options,
+        )
+    client = WeaviateClient(
+        db_adr,
+        schema,
+        model_id=model_id,
+        image_encoding=image_encoding,
+        query_cache=query_cache,
+        rerank=rerank,
+        ensure_schema=ensure_schema,
+        **kwargs,
+    )
+    if compression == "pq":
+        client.enable_compression()
+    elif compression != "none":
+        raise ValueError(f"Weaviate only supports pq compression, not {compression}")
+    return client
+
+
 class PipelineV3:
     def __init__(
         self,
@@ -79,38 +126,285 @@ class PipelineV3:
         schema: str = "Test",
         model_path=None,
         image_storage_directory: str = "/images/",
+        image_encoding: str = "",
+        cache_size: int = 0,
+        cache_ttl: float = 300.0,
+        compression: str = "none",
+        vectorize: str = "module",
+        store_image: bool = True,
+        path_index: str = DEFAULT_PATH_INDEX,
+        materialize: str = "link",
+        descriptor_cache: str = DEFAULT_DESCRIPTOR_CACHE,
+        rerank: int = 0,
+        scales: list = None,
+        model=None,
     ):
-        self.client = WeaviateClient(db_adr, schema)
-        self.image_storage_directory = image_storage_directory
-        print("Num GPUs Available: ", len(tf.config.list_physical_devices("GPU")))
-
+        """
+        vectorize="module" lets the img2vec module inside weaviate compute the vectors,
+        vectorize="client" computes them here with the same model used for queries and
+        sends them on insert, the collection then has no vectorizer and store_image
+        decides whether the image payload is kept at all. materialize selects how
+        store_for_ui places the hits, see materialize.py. Descriptors are cached in
+        descriptor_cache, an empty string disables the cache. With rerank > 0 weaviate
+        returns rerank candidates that are reordered by their exact distance.
+
+        scales, e.g. pyramid.PYRAMID_SCALES, switches ingest and query to multi-scale
+        descriptors: every image is stored once per scale and a query searches all
+        scales at once, see pyramid.py. It needs client side vectors and scale 1.
+
+        model is an already loaded model wrapper used instead of SENet, e.g. the
+        stand-in of pipeline_benchmark.py.
+        """
         if model_path == None:
             model_path = MODEL_PATH
+        # tensorflow and the model are only loaded once a descriptor is needed
+        self.model_path = model_path
+        self._model = model
+        self._model_lock = threading.Lock()
+        # a checkpoint on disk is hashed without loading it, the default weights SENet
+        # resolves itself are only known from the loaded model
+        if model is None and model_path and os.path.exists(model_path):
+            self.model_id = model_identifier(model_path)
+        else:
+            self.model_id = model_identifier(model_path, self.model)
+
+        query_cache = QueryCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.client = create_client(
+            db_adr,
+            schema,
+            compression=compression,
+            model_id=self.model_id,
+            image_encoding=image_encoding,
+            query_cache=query_cache,
+            vectorizer=CLIENT_VECTORIZER if vectorize == "client" else "img2vec-neural",
+            store_image=store_image,
+            rerank=rerank,
+        )
+        self.scales = None
+        if scales:
+            if 1.0 not in scales:
+                raise ValueError(f"Pyramid scales {scales} have to include scale 1")
+            if not self.client.needs_vectors:
+                raise ValueError('Multi-scale descriptors need vectorize="client"')
+            self.scales = [float(scale) for scale in scales]
+        self.image_storage_directory = image_storage_directory
+        self.path_index = PathIndex(path_index)
+        self.materialize = materialize
+        self.thumbnails = ThumbnailCache() if materialize == "thumbnail" else None
+        self.descriptor_cache = None
+        if descriptor_cache:
+            self.descriptor_cache = DescriptorCache(self.model_id, descriptor_cache)
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                import tensorflow as tf
+                from msirs_utils.segmentation.senet_model import SENet
+
+                gpus = tf.config.list_physical_devices("GPU")
+                print("Num GPUs Available: ", len(gpus))
+                self._model = SENet(model_path=self.model_path)
+        return self._model
+
+    def query_image(self, img: np.ndarray, where: dict = None) -> dict:
+        if self.scales:
+            return self.query_images([img], where)[0]
+        try:
+            vector = self.get_descriptor(img)
+            response = self.client.query_image(vector, where=where)
+            return response
+        except Exception as e:
+            print(f"Error: {e}")
+            return {"has_error": True}
 
-        self.model = SENet(model_path=model_path)
+    def query_images(self, imgs: list, where: dict = None) -> list:
+        """
+        Queries several images at once, their descriptors are computed in batches.
+        With pyramid scales all levels of all images go through the model together and
+        every image gets one multi vector search over its levels.
+        """
+        if self.scales:
+            return self.query_pyramids(imgs, where)
+        try:
+            vectors = self.get_descriptors(imgs)
+        except Exception as e:
+            print(f"Error: {e}")
+            return [{"has_error": True} for _ in imgs]
+        responses = []
+        for vector in vectors:
+            try:
+                responses.append(self.client.query_image(vector, where=where))
+            except Exception as e:
+                print(f"Error: {e}")
+                responses.append({"has_error": True})
+        return responses
 
-    def query_image(self, img: np.ndarray) -> dict:
+    def query_pyramids(
+        self, imgs: list, where: dict = None, num_to_retrieve: int = 10
+    ) -> list:
         try:
-            vector = self.model.get_descriptor(img)
-            response = self.client.query_image(vector)
-            return response
+            level_vectors = self.get_pyramid_descriptors(imgs)
+        except Exception as e:
+            print(f"Error: {e}")
+            return [{"has_error": True} for _ in imgs]
+        # the levels of one image crowd each other out, so every level fetches more
+        per_level = num_to_retrieve * len(self.scales)
+        responses = []
+        for vectors in level_vectors:
+            try:
+                level_responses = self.client.query_images(vectors, per_level, where)
+                responses.append(
+                    fuse_responses(level_responses, self.scales, num_to_retrieve)
+                )
+            except Exception as e:
+                print(f"Error: {e}")
+                responses.append({"has_error": True})
+        return responses
+
+    def query_tiled(
+        self,
+        img,
+        tile_size: int = TILE_SIZE,
+        stride: int = STRIDE,
+        num_to_retrieve: int = 10,
+        per_window: int = 10,
+        where: dict = None,
+        batch_size: int = DESCRIPTOR_BATCH_SIZE,
+        nodata: float = 0,
+    ) -> dict:
+        """
+        Queries a large strip (array or path) window by window. Windows of tile_size
+        pixels are taken every stride pixels, empty and no-data windows are skipped.
+        Every batch of windows gets one forward pass and one multi vector search, the
+        hits of all windows are merged into one ranked list that carries the best
+        matching window of every hit. Memory is bounded by one batch of windows.
+        """
+        if isinstance(img, str):
+            img = open_strip(img)
+        hits = {}
+
+        def search_batch(batch: list) -> None:
+            # tiles are not worth a place in the descriptor cache
+            tiles = [tile for _, _, tile in batch]
+            vectors = get_descriptors(self.model, tiles, batch_size)
+            responses = self.client.query_images(vectors, per_window, where)
+            merge_hits(hits, batch, responses)
+
+        num_windows = 0
+        batch = []
+        try:
+            for window in iter_windows(img, tile_size, stride, nodata):
+                batch.append(window)
+                num_windows += 1
+                if len(batch) == batch_size:
+                    search_batch(batch)
+                    batch = []
+            if batch:
+                search_batch(batch)
         except Exception as e:
             print(f"Error: {e}")
             return {"has_error": True}
+        return ranked_response(hits, num_to_retrieve, num_windows)
 
-    def build_database(self, directory: str, allowed_formats=["jpg", "png"]) -> bool:
+    def build_database(
+        self,
+        directory: str,
+        allowed_formats=["jpg", "png"],
+        batch_size: int = 100,
+        num_workers: int = 4,
+        decode_workers: int = os.cpu_count() or 4,
+        descriptor_workers: int = 1,
+        descriptor_batch_size: int = DESCRIPTOR_BATCH_SIZE,
+        manifest_path: str = DEFAULT_MANIFEST,
+    ) -> bool:
+        """
+        Incrementally ingests all images below directory. The ingest manifest records
+        every file, so unchanged files are skipped, changed files replace their old
+        object, objects of deleted files are removed and an interrupted run continues
+        where it stopped. Decoding runs on decode_workers threads, descriptors are
+        computed in batches of descriptor_batch_size and the results are streamed into
+        the database batch api with num_workers threads, see ingest.py.
+        """
         excep = False
+        manifest = IngestManifest(self.client.schema, manifest_path)
+        files = walk_files(directory, allowed_formats)
+        counts = manifest.sync(files, directory)
+        print(f"Found {len(files)} images: {counts}")
+
+        for path, obj_uuid, img_hash in manifest.stale(directory):
+            if not manifest.uuid_in_use(obj_uuid, path):
+                self.client.delete_entry(obj_uuid, img_hash)
+                if self.scales and img_hash is not None:
+                    self.delete_levels(img_hash)
+            manifest.mark_removed(path)
+            self.path_index.remove(path)
+
         img_files = []
-        if directory[-1] != "/":
-            directory += "/"
-        for format in allowed_formats:
-            img_files.append(glob.glob(f"{directory}+**/*.{format}", recursive=True))
-        for img_file in img_files:
-            try:
-                self.add_to_db(img_file)
-            except Exception as e:
-                print(f"Skipping {img_file}: {e}")
+        for path, img_hash in manifest.to_ingest(directory):
+            # queued by an interrupted run and confirmed by the database since
+            if img_hash is not None and self.client.check_for_duplicate_entries(
+                {"content_hash": img_hash}
+            ):
+                manifest.mark_done([path])
+            else:
+                img_files.append(path)
+        print(f"Ingesting {len(img_files)} images")
+
+        written = []
+        with self.client.batch(batch_size=batch_size, num_workers=num_workers) as batch:
+
+            def write(record: tuple, vector) -> None:
+                img_file, img, new_image_file_name = record
+                data_object = self.client.make_data_object(
+                    img, img_file, new_image_file_name
+                )
+                obj_uuid = self.client.object_uuid(data_object)
+                manifest.mark_queued(img_file, data_object["content_hash"], obj_uuid)
+                self.path_index.add(img_file, new_image_file_name)
+                if self.scales:
+                    # vector holds one descriptor per scale, level 1 is data_object
+                    for level, level_vector in zip(
+                        level_objects(data_object, self.scales), vector
+                    ):
+                        batch.add(
+                            level,
+                            vector=level_vector,
+                            object_uuid=self.client.object_uuid(level),
+                        )
+                else:
+                    batch.add(data_object, vector=vector, object_uuid=obj_uuid)
+                written.append((img_file, obj_uuid))
+
+            pipeline = IngestPipeline(
+                decode=lambda img_file: (img_file, *self.store_image(img_file)),
+                describe=lambda records: self.get_insert_vectors(
+                    [img for _, img, _ in records], batch_size=descriptor_batch_size
+                ),
+                write=write,
+                decode_workers=decode_workers,
+                describe_workers=descriptor_workers,
+                batch_size=descriptor_batch_size,
+            )
+            result = pipeline.run(img_files)
+
+        for error in result["errors"]:
+            manifest.mark_failed(error["item"], error["error"])
+            excep = True
+        for entry in batch.report:
+            if entry["failed"]:
+                print(f"Batch {entry['batch']}: {entry['failed']} failed objects")
                 excep = True
+        failed = set(batch.failed)
+        for img_file, obj_uuid in written:
+            if obj_uuid in failed:
+                manifest.mark_failed(img_file, "database import failed")
+                excep = True
+        manifest.mark_done(
+            [img_file for img_file, obj_uuid in written if obj_uuid not in failed]
+        )
+        print(f"Ingest manifest: {manifest.counts()}")
+        manifest.close()
 
         return excep
 
@@ -140,27 +434,35 @@ class PipelineV3:
         file_format = query.split(".")[-1]
         print(file_format)
         shutil.copy(query, folder + f"query.{file_format}")
-        counter = 1
-        images = results["source"]
+        images = results["images"]
         meta_data = results["meta_data"]
         distances = results["distances"]
-        for result in images:
-            all_imgs = glob.glob(
-                HOME + "/codebase-v1/data/data/" + "/**/**/*.jpg", recursive=True
-            )
-            img_name = result[0].split("/")[-1]
-            img = [i for i in all_imgs if re.findall(img_name, i)][0]
-            cutout = skimage.io.imread(img)
-            skimage.io.imsave(folder + f"retrieval_{counter}.png", cutout)
-            counter += 1
-
-        meta_data_dict = {}
-        for idx in range(len(meta_data)):
-            meta_data_dict["meta_data"] = meta_data[idx]
-            meta_data_dict["distances"] = distances[idx]
-
+        jobs = []
+        hits = []
+        for result, meta, distance in zip(images, meta_data, distances):
+            # originals are found through the path index, see path_index.py to add
+            # datasets that were not ingested with build_database
+            img = self.path_index.lookup(result)
+            if img is None:
+                print(f"No original image found for {result}")
+                excep = True
+                continue
+            jobs.append((img, folder + f"retrieval_{len(jobs) + 1}", roi_of(meta)))
+            if isinstance(distance, dict):
+                distance = distance.get("distance")
+            hits.append({"source": result, "distance": distance, "meta_data": meta})
+        written = materialize_all(jobs, self.materialize, self.thumbnails)
+        if None in written:
+            excep = True
+
+        # one entry per written hit, file is the name of its retrieval_<n> image
+        hits = [
+            dict(hit, file=os.path.basename(path))
+            for hit, path in zip(hits, written)
+            if path is not None
+        ]
         with open(folder + "metadata.json", "w+") as f:
-            json.dump(meta_data_dict, f)
+            json.dump(hits, f)
 
         return excep
 
@@ -168,15 +470,88 @@ class PipelineV3:
         """
         Provided an image path, this function adds the image into the assoicated weaviate database.
         """
+        img, new_image_file_name = self.store_image(img_path)
+        self.path_index.add(img_path, new_image_file_name)
+        if self.scales:
+            data_object = self.client.make_data_object(
+                img, img_path, new_image_file_name
+            )
+            vectors = self.get_pyramid_descriptors([img])[0]
+            levels = level_objects(data_object, self.scales)
+            with self.client.batch() as batch:
+                for level, vector in zip(levels, vectors):
+                    batch.add(level, vector=vector)
+            return
+        self.client.add_to_db(
+            img,
+            original_file_path=img_path,
+            file_path=new_image_file_name,
+            vector=self.get_insert_vector(img),
+        )
+
+    def delete_levels(self, img_hash: str) -> None:
+        for scale in self.scales:
+            if scale != 1.0:
+                level = {"content_hash": level_hash(img_hash, scale)}
+                self.client.delete_entry(
+                    self.client.object_uuid(level), level["content_hash"]
+                )
+
+    def get_insert_vector(self, img: np.ndarray):
+        # only backends without a vectorizer module need the descriptor on insert
+        if self.client.needs_vectors:
+            return self.get_descriptor(img)
+        return None
+
+    def get_insert_vectors(
+        self, imgs: list, batch_size: int = DESCRIPTOR_BATCH_SIZE
+    ) -> list:
+        if self.scales:
+            return self.get_pyramid_descriptors(imgs, batch_size)
+        if self.client.needs_vectors:
+            return self.get_descriptors(imgs, batch_size)
+        return [None] * len(imgs)
+
+    def get_descriptor(self, img: np.ndarray) -> np.ndarray:
+        return self.get_descriptors([img], 1)[0]
+
+    def get_descriptors(
+        self, imgs: list, batch_size: int = DESCRIPTOR_BATCH_SIZE
+    ) -> list:
+        if self.descriptor_cache is not None:
+            return self.descriptor_cache.descriptors(self.model, imgs, batch_size)
+        return get_descriptors(self.model, imgs, batch_size)
+
+    def get_pyramid_descriptors(
+        self, imgs: list, batch_size: int = DESCRIPTOR_BATCH_SIZE
+    ) -> list:
+        """
+        One descriptor per scale and image. The levels of all images are batched into
+        the same forward passes instead of one model run per scale.
+        """
+        levels = [level for img in imgs for level in pyramid_levels(img, self.scales)]
+        vectors = self.get_descriptors(levels, batch_size)
+        num_scales = len(self.scales)
+        return [
+            vectors[idx : idx + num_scales]
+            for idx in range(0, len(vectors), num_scales)
+        ]
+
+    def store_image(self, img_path: str) -> tuple:
+        """
+        Reads the image and stores a copy in the image storage directory.
+        """
+        import skimage.io
+
         img = skimage.io.imread(img_path)
         new_image_file_name = self.image_storage_directory + img_path.split("/")[-1]
         skimage.io.imsave(new_image_file_name, img)
-        self.client.add_to_db(
-            img, original_file_path=img_path, file_path=new_image_file_name
-        )
+        return img, new_image_file_name
 
     def do_retrieval(self, img_path: str):
         # this executes all methods for the retrieval process
+        import skimage.io
+
         img = skimage.io.imread(img_path)
         response = self.query_image(img)
         if "has_error" in list(response.keys()):
@@ -220,34 +595,76 @@ class PipelineV3:
 
 
 if __name__ == "__main__":
-    pipe = PipelineV3("http://localhost:8080")
-
     parser = argparse.ArgumentParser(
         description="Script to allow interaction with MSIRS."
     )
+    parser.add_argument("--db-adr", type=str, default="http://localhost:8080")
+    parser.add_argument("--schema", type=str, default="Test")
     parser.add_argument(
-        "-r",
-        "--retrieve",
-        type=pipe.do_retrieval,
-        action="store",
-        help="Retrieve images for image corresponding to provided path",
+        "--scales",
+        type=float,
+        nargs="+",
+        help="Multi-scale descriptors at these scales, e.g. 1 0.5 0.25",
     )
-    parser.add_argument(
-        "-a",
-        "--add",
-        help="Add image provided per path into the database",
-        type=pipe.add_uploaded_image,
-        action="store",
+    commands = parser.add_subparsers(dest="command", required=True)
+    retrieve = commands.add_parser(
+        "retrieve", help="Retrieve images for image corresponding to provided path"
     )
-    parser.add_argument(
-        "-p",
-        "--populate",
-        type=pipe.build_database,
-        action="store",
-        help="Populate database by adding all provided images",
+    retrieve.add_argument("path", type=str)
+    add = commands.add_parser(
+        "add", help="Add image provided per path into the database"
     )
-    parser.add_argument(
-        "--summary",
-        type=pipe.client.check_db,
-        help="Print summary of the current database state",
+    add.add_argument("path", type=str)
+    tiled = commands.add_parser(
+        "tiled", help="Query a large strip window by window, prints json"
     )
+    tiled.add_argument("path", type=str)
+    tiled.add_argument("--tile-size", type=int, default=TILE_SIZE)
+    tiled.add_argument("--stride", type=int, default=STRIDE)
+    tiled.add_argument("-k", type=int, default=10)
+    populate = commands.add_parser(
+        "populate", help="Populate database by adding all provided images"
+    )
+    populate.add_argument("directory", type=str)
+    populate.add_argument("--formats", type=str, nargs="+", default=["jpg", "png"])
+    summary = commands.add_parser(
+        "summary", help="Print statistics of the current database state as json"
+    )
+    summary.add_argument(
+        "--window",
+        type=float,
+        default=10,
+        help="Window in minutes for the import rate",
+    )
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        # only needs the database, neither the model nor tensorflow. Read only, the
+        # schema is left as it is
+        client = create_client(args.db_adr, args.schema, ensure_schema=False)
+        stats = client.get_stats(args.window)
+        # latencies and counters of this process are empty, the import rate comes from
+        # the creation times of the stored objects
+        stats.pop("client")
+        print(json.dumps(stats, indent=2))
+        if os.path.exists(DEFAULT_DESCRIPTOR_CACHE):
+            # the stats cover the entries of every model, the id of the default
+            # weights would need the model loaded
+            cache = DescriptorCache("")
+            print(json.dumps({"descriptor_cache": cache.stats()}, indent=2))
+    else:
+        pipe = PipelineV3(
+            args.db_adr,
+            args.schema,
+            vectorize="client" if args.scales else "module",
+            scales=args.scales,
+        )
+        if args.command == "retrieve":
+            pipe.do_retrieval(args.path)
+        elif args.command == "add":
+            pipe.add_uploaded_image(args.path)
+        elif args.command == "tiled":
+            response = pipe.query_tiled(args.path, args.tile_size, args.stride, args.k)
+            print(json.dumps(response, indent=2))
+        elif args.command == "populate":
+            pipe.build_database(args.directory, args.formats)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Multi-scale descriptors. CTX and HiRISE show the same landform at very different sizes,
+so every image is also described zoomed in: the level of scale s is the centered crop
+covering s of the height and width, resampled to the full image size so the model sees
+the usual input. A query at scale 1 then meets a coarser image at one of its zoomed
+levels and the other way round.
+
+Levels are stored as separate objects tagged with their scale, scale 1 is the plain
+object of the image, the others carry the content hash suffixed with the scale.
+"""
+import numpy as np
+from PIL import Image
+
+PYRAMID_SCALES = [1.0, 0.5, 0.25]
+
+
+def scale_level(img: np.ndarray, scale: float) -> np.ndarray:
+    if scale == 1.0:
+        return img
+    if not 0 < scale < 1:
+        raise ValueError(f"Pyramid scales have to be in (0, 1], got {scale}")
+    height, width = img.shape[:2]
+    crop_height = max(1, int(round(height * scale)))
+    crop_width = max(1, int(round(width * scale)))
+    row = (height - crop_height) // 2
+    col = (width - crop_width) // 2
+    crop = np.ascontiguousarray(img[row : row + crop_height, col : col + crop_width])
+    # PIL resizes single channel and rgb uint8 images, anything else goes through floats
+    if crop.dtype == np.uint8 and (crop.ndim == 2 or crop.shape[-1] in [3, 4]):
+        resized = Image.fromarray(crop).resize((width, height), Image.BILINEAR)
+        return np.asarray(resized)
+    channels = crop.reshape(crop_height, crop_width, -1).astype(np.float32)
+    resized = np.stack(
+        [
+            np.asarray(
+                Image.fromarray(channels[..., i]).resize(
+                    (width, height), Image.BILINEAR
+                )
+            )
+            for i in range(channels.shape[-1])
+        ],
+        axis=-1,
+    )
+    return resized.reshape(img.shape).astype(img.dtype)
+
+
+def pyramid_levels(img: np.ndarray, scales: list = PYRAMID_SCALES) -> list:
+    return [scale_level(img, scale) for scale in scales]
+
+
+def level_hash(img_hash: str, scale: float) -> str:
+    if scale == 1.0:
+        return img_hash
+    return f"{img_hash}@{scale:g}"
+
+
+def level_objects(data_object: dict, scales: list = PYRAMID_SCALES) -> list:
+    """
+    One data object per scale. Only the scale 1 object keeps the image payload.
+    """
+    objects = []
+    for scale in scales:
+        level = dict(data_object, scale=float(scale))
+        level["content_hash"] = level_hash(data_object["content_hash"], scale)
+        if scale != 1.0:
+            level.pop("image", None)
+        objects.append(level)
+    return objects
+
+
+def fuse_responses(responses: list, scales: list, num_to_retrieve: int) -> dict:
+    """
+    Fuses the responses of all query levels into one ranked response. Every image keeps
+    its best distance over all pairs of query and stored level, the pair is reported in
+    "scales" as {"query": s, "match": s}.
+    """
+    hits = {}
+    for query_scale, response in zip(scales, responses):
+        for source, distance, meta_data in zip(
+            response["images"], response["distances"], response["meta_data"]
+        ):
+            match_scale = meta_data.get("scale")
+            hit = hits.get(source)
+            if hit is None:
+                hits[source] = hit = {"matched_levels": 0}
+            hit["matched_levels"] += 1
+            best = hit.get("distance")
+            if best is not None and best["distance"] <= distance["distance"]:
+                continue
+            hit["distance"] = distance
+            hit["meta_data"] = meta_data
+            hit["scales"] = {
+                "query": query_scale,
+                "match": 1.0 if match_scale is None else match_scale,
+            }
+    ranked = sorted(hits.items(), key=lambda item: item[1]["distance"]["distance"])
+    ranked = ranked[:num_to_retrieve]
+    return {
+        "images": [source for source, _ in ranked],
+        "distances": [hit["distance"] for _, hit in ranked],
+        "meta_data": [hit["meta_data"] for _, hit in ranked],
+        "scales": [hit["scales"] for _, hit in ranked],
+        "matched_levels": [hit["matched_levels"] for _, hit in ranked],
+    }
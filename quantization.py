@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Compressed codes for the descriptor store. Both quantizers work on l2 normalized vectors
+and approximate the cosine similarity to a query, candidates are re-ranked on the full
+precision vectors afterwards.
+"""
+import numpy as np
+
+KMEANS_ITERATIONS = 20
+
+
+class ScalarQuantizer:
+    """
+    int8 scalar quantization with per dimension min and scale, 4x smaller than float32.
+    """
+
+    name = "int8"
+
+    def __init__(self) -> None:
+        self.minimum = None
+        self.scale = None
+
+    @property
+    def trained(self) -> bool:
+        return self.scale is not None
+
+    def code_size(self, dim: int) -> int:
+        return dim
+
+    def train(self, sample: np.ndarray) -> None:
+        self.minimum = sample.min(axis=0).astype(np.float32)
+        self.scale = np.maximum(sample.max(axis=0) - self.minimum, 1e-12) / 255.0
+        self.scale = self.scale.astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.round((vectors - self.minimum) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def similarities(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # q . (min + scale * code) = q . min + (q * scale) . code
+        return (queries * self.scale) @ codes.T.astype(np.float32) + (
+            queries @ self.minimum
+        )[:, None]
+
+    def state(self) -> dict:
+        return {"minimum": self.minimum, "scale": self.scale}
+
+    def load_state(self, state: dict) -> None:
+        self.minimum = state["minimum"]
+        self.scale = state["scale"]
+
+
+class ProductQuantizer:
+    """
+    Product quantization: the vector is split into `num_subvectors` parts, each is replaced
+    by the index of its nearest of 256 centroids, so a vector costs num_subvectors bytes.
+    """
+
+    name = "pq"
+
+    def __init__(self, num_subvectors: int = 64, num_centroids: int = 256) -> None:
+        self.num_subvectors = num_subvectors
+        self.num_centroids = num_centroids
+        self.centroids = None
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def code_size(self, dim: int) -> int:
+        return self.num_subvectors
+
+    def _split(self, vectors: np.ndarray) -> list:
+        return np.array_split(vectors, self.num_subvectors, axis=1)
+
+    def train(self, sample: np.ndarray) -> None:
+        rng = np.random.default_rng(0)
+        self.num_subvectors = min(self.num_subvectors, sample.shape[1])
+        self.centroids = []
+        for part in self._split(sample.astype(np.float32)):
+            num_centroids = min(self.num_centroids, len(part))
+            centroids = part[rng.choice(len(part), num_centroids, replace=False)]
+            for _ in range(KMEANS_ITERATIONS):
+                assignment = self._assign(part, centroids)
+                for c in range(num_centroids):
+                    members = part[assignment == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+            self.centroids.append(centroids)
+
+    @staticmethod
+    def _assign(part: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        dist = (
+            (part**2).sum(axis=1)[:, None]
+            - 2 * part @ centroids.T
+            + (centroids**2).sum(axis=1)[None, :]
+        )
+        return dist.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self._split(vectors.astype(np.float32))
+        codes = np.empty((len(vectors), self.num_subvectors), np.uint8)
+        for m, (part, centroids) in enumerate(zip(parts, self.centroids)):
+            codes[:, m] = self._assign(part, centroids)
+        return codes
+
+    def similarities(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # asymmetric distance: one lookup table of query/centroid products per subvector
+        scores = np.zeros((len(queries), len(codes)), np.float32)
+        for m, (part, centroids) in enumerate(zip(self._split(queries), self.centroids)):
+            table = part @ centroids.T
+            scores += table[:, codes[:, m]]
+        return scores
+
+    def state(self) -> dict:
+        state = {f"centroids_{m}": c for m, c in enumerate(self.centroids)}
+        state["num_subvectors"] = np.array(self.num_subvectors)
+        return state
+
+    def load_state(self, state: dict) -> None:
+        self.num_subvectors = int(state["num_subvectors"])
+        self.centroids = [state[f"centroids_{m}"] for m in range(self.num_subvectors)]
+
+
+def make_quantizer(compression: str, num_subvectors: int = 64):
+    if compression == "int8":
+        return ScalarQuantizer()
+    elif compression == "pq":
+        return ProductQuantizer(num_subvectors)
+    else:
+        raise ValueError(f"Unknown compression {compression}, use none, int8 or pq")
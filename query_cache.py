@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import time
+import copy
+import json
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional
+
+
+class QueryCache:
+    """
+    Bounded LRU cache for query results with a time to live. Keys are built from the
+    (optionally quantized) query vector, the number of results and the collection, so all
+    entries of a collection can be dropped once something is inserted into it.
+    """
+
+    def __init__(
+        self, max_size: int = 1024, ttl: float = 300.0, quantization: Optional[float] = None
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        # step size the vector is rounded to before hashing, None hashes the exact bytes
+        self.quantization = quantization
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(
+        self,
+        vector: np.ndarray,
+        num_to_retrieve: int,
+        schema: str,
+        where: Optional[dict] = None,
+    ) -> tuple:
+        vector = np.asarray(vector, np.float32).ravel()
+        if self.quantization:
+            vector = np.round(vector / self.quantization).astype(np.int32)
+        digest = hashlib.sha256(vector.tobytes())
+        if where is not None:
+            digest.update(json.dumps(where, sort_keys=True).encode())
+        return (schema, num_to_retrieve, digest.hexdigest())
+
+    def get(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key: tuple, result: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, schema: Optional[str] = None) -> None:
+        """
+        Drops all entries of the given collection, or everything if no collection is given.
+        """
+        with self._lock:
+            if schema is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == schema]:
+                    del self._entries[key]
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Long running retrieval service. The model and the database client are loaded once and
+requests are served over local http or a unix socket by a bounded pool of workers:
+
+    GET  /health                              liveness
+    GET  /stats                               database and client statistics
+    POST /query     {"path", "where"}         query response of PipelineV3.query_image
+    POST /retrieve  {"path", "folder"}        query and store the results for the ui in
+                                              folder, one request per folder at a time
+    POST /add       {"path"}                  add the image to the database
+    POST /jobs      {"path", "where"}         queue a retrieval job, see jobs.py
+    GET  /jobs/<id>                           status record of the job
+
+The client half only needs the standard library, so `retrieval_daemon.py retrieve` starts
+in milliseconds and is what the web server runs on the retrieval host.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import socketserver
+import http.client
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from jobs import NUM_WORKERS as NUM_JOB_WORKERS, JobManager
+
+HOME = str(Path.home())
+DEFAULT_ADDRESS = "unix://" + HOME + "/.msirs/retrieval.sock"
+NUM_WORKERS = 4
+QUEUE_SIZE = 16
+TIMEOUT = 120
+
+
+def _to_json(obj):
+    # numpy scalars and arrays in responses of the embedded store
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    return str(obj)
+
+
+class PoolMixIn:
+    """
+    Serves every connection on a fixed thread pool, connections beyond the pool and a
+    queue of queue_size are answered with 503 right away instead of piling up.
+    """
+
+    def init_pool(self, num_workers: int, queue_size: int) -> None:
+        self.executor = ThreadPoolExecutor(num_workers)
+        self.slots = threading.BoundedSemaphore(num_workers + queue_size)
+
+    def process_request(self, request, client_address) -> None:
+        if not self.slots.acquire(blocking=False):
+            try:
+                request.sendall(
+                    b"HTTP/1.1 503 Service Unavailable\r\n"
+                    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+            finally:
+                self.shutdown_request(request)
+            return
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+class PooledHTTPServer(PoolMixIn, HTTPServer):
+    pass
+
+
+class PooledUnixHTTPServer(PoolMixIn, socketserver.UnixStreamServer):
+    def server_bind(self) -> None:
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        os.makedirs(os.path.dirname(self.server_address), exist_ok=True)
+        super().server_bind()
+
+
+class RetrievalHandler(BaseHTTPRequestHandler):
+    def address_string(self) -> str:
+        # unix sockets have no peer address
+        return str(self.client_address or "local")
+
+    def reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body, default=_to_json).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self.reply(200, {"status": "ok"})
+        elif self.path.startswith("/jobs/"):
+            status = self.server.jobs.status(self.path[len("/jobs/") :])
+            if status is None:
+                self.reply(404, {"error": f"Unknown job {self.path}"})
+            else:
+                self.reply(200, status)
+        elif self.path == "/stats":
+            stats = self.server.pipe.client.get_stats()
+            if self.server.pipe.descriptor_cache is not None:
+                stats["descriptor_cache"] = self.server.pipe.descriptor_cache.stats()
+            self.reply(200, stats)
+        else:
+            self.reply(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+            handler = {
+                "/query": self.server.query,
+                "/retrieve": self.server.retrieve,
+                "/add": self.server.add,
+                "/jobs": self.server.submit,
+            }.get(self.path)
+            if handler is None:
+                self.reply(404, {"error": f"Unknown endpoint {self.path}"})
+                return
+            start = time.perf_counter()
+            response = handler(request)
+            response["seconds"] = time.perf_counter() - start
+            self.reply(200, response)
+        except Exception as e:
+            print(f"Error: {e}")
+            self.reply(500, {"error": str(e)})
+
+
+class RetrievalDaemon:
+    def __init__(self, pipe, address: str = DEFAULT_ADDRESS, jobs=None) -> None:
+        self.pipe = pipe
+        self.address = address
+        self.jobs = jobs
+        # store_for_ui wipes its folder, so a folder only serves one retrieval at a time
+        self._folders = set()
+        self._folders_lock = threading.Lock()
+
+    def query(self, request: dict) -> dict:
+        import skimage.io
+
+        img = skimage.io.imread(request["path"])
+        return self.pipe.query_image(img, where=request.get("where"))
+
+    def retrieve(self, request: dict) -> dict:
+        import skimage.io
+
+        if not request.get("folder"):
+            raise ValueError("retrieve needs a result folder per request")
+        folder = os.path.join(os.path.abspath(request["folder"]), "")
+        with self._folders_lock:
+            if folder in self._folders:
+                raise RuntimeError(f"Folder {folder} is in use by another retrieval")
+            self._folders.add(folder)
+        try:
+            img = skimage.io.imread(request["path"])
+            response = self.pipe.query_image(img, where=request.get("where"))
+            if "has_error" not in response:
+                os.makedirs(folder, exist_ok=True)
+                self.pipe.store_for_ui(folder, response, request["path"])
+                # uploads are consumed, only this one so concurrent uploads survive
+                if os.path.dirname(request["path"]) == HOME + "/query":
+                    os.unlink(request["path"])
+        finally:
+            with self._folders_lock:
+                self._folders.discard(folder)
+        return response
+
+    def add(self, request: dict) -> dict:
+        self.pipe.add_to_db(request["path"])
+        return {"added": request["path"]}
+
+    def submit(self, request: dict) -> dict:
+        job_id = self.jobs.submit(request["path"], request.get("where"))
+        return self.jobs.status(job_id)
+
+    def serve(
+        self, num_workers: int = NUM_WORKERS, queue_size: int = QUEUE_SIZE
+    ) -> None:
+        if self.address.startswith("unix://"):
+            server = PooledUnixHTTPServer(
+                self.address[len("unix://") :], RetrievalHandler
+            )
+        else:
+            host, port = self.address.split("://")[-1].rsplit(":", 1)
+            server = PooledHTTPServer((host, int(port)), RetrievalHandler)
+        server.init_pool(num_workers, queue_size)
+        server.pipe = self.pipe
+        server.query = self.query
+        server.retrieve = self.retrieve
+        server.add = self.add
+        server.submit = self.submit
+        server.jobs = self.jobs
+        print(f"Serving retrievals on {self.address} with {num_workers} workers")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = TIMEOUT) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RetrievalClient:
+    def __init__(
+        self, address: str = DEFAULT_ADDRESS, timeout: float = TIMEOUT
+    ) -> None:
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.address.startswith("unix://"):
+            return UnixHTTPConnection(self.address[len("unix://") :], self.timeout)
+        host, port = self.address.split("://")[-1].rsplit(":", 1)
+        return http.client.HTTPConnection(host, int(port), timeout=self.timeout)
+
+    def request(self, method: str, endpoint: str, body: dict = None) -> dict:
+        conn = self._connection()
+        try:
+            data = json.dumps(body).encode() if body is not None else None
+            headers = {"Content-Type": "application/json"} if data else {}
+            conn.request(method, endpoint, body=data, headers=headers)
+            response = conn.getresponse()
+            payload = response.read()
+        except (BrokenPipeError, ConnectionResetError):
+            # a full daemon closes the connection right after its 503
+            return {"has_error": True, "error": "Retrieval daemon is busy", "code": 503}
+        except OSError as e:
+            # missing socket, refused connection or timeout, the daemon is not running
+            return {
+                "has_error": True,
+                "error": f"Retrieval daemon is not reachable: {e}",
+                "code": 503,
+            }
+        finally:
+            conn.close()
+        if response.status == 503:
+            return {"has_error": True, "error": "Retrieval daemon is busy", "code": 503}
+        result = json.loads(payload) if payload else {}
+        if response.status != 200:
+            # code is the http status, the web server answers with it
+            result["has_error"] = True
+            result["code"] = response.status
+        return result
+
+    def health(self) -> dict:
+        return self.request("GET", "/health")
+
+    def stats(self) -> dict:
+        return self.request("GET", "/stats")
+
+    def query(self, path: str, where: dict = None) -> dict:
+        body = {"path": os.path.abspath(path), "where": where}
+        return self.request("POST", "/query", body)
+
+    def retrieve(self, path: str, folder: str, where: dict = None) -> dict:
+        body = {"path": os.path.abspath(path), "folder": folder, "where": where}
+        return self.request("POST", "/retrieve", body)
+
+    def add(self, path: str) -> dict:
+        return self.request("POST", "/add", {"path": os.path.abspath(path)})
+
+    def submit(self, path: str, where: dict = None) -> dict:
+        body = {"path": os.path.abspath(path), "where": where}
+        return self.request("POST", "/jobs", body)
+
+    def job_status(self, job_id: str) -> dict:
+        return self.request("GET", f"/jobs/{job_id}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="MSIRS retrieval daemon and its client."
+    )
+    parser.add_argument(
+        "--address",
+        type=str,
+        default=DEFAULT_ADDRESS,
+        help="unix:///path/to/socket or http://host:port",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Load the model once and serve requests")
+    serve.add_argument("--db-adr", type=str, default="http://localhost:8080")
+    serve.add_argument("--schema", type=str, default="Test")
+    serve.add_argument("--workers", type=int, default=NUM_WORKERS)
+    serve.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    serve.add_argument("--cache-size", type=int, default=1024)
+    serve.add_argument("--job-workers", type=int, default=NUM_JOB_WORKERS)
+    retrieve = commands.add_parser(
+        "retrieve", help="Query and store results for the ui"
+    )
+    retrieve.add_argument("path", type=str)
+    retrieve.add_argument("--folder", type=str, default=HOME + "/server-test/")
+    query = commands.add_parser("query", help="Print the query response as json")
+    query.add_argument("path", type=str)
+    add = commands.add_parser("add", help="Add an image to the database")
+    add.add_argument("path", type=str)
+    submit = commands.add_parser("submit", help="Queue a retrieval job")
+    submit.add_argument("path", type=str)
+    job_status = commands.add_parser("status", help="Print the status of a job")
+    job_status.add_argument("job_id", type=str)
+    commands.add_parser("health")
+    commands.add_parser("stats")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        from pipeline_v3 import PipelineV3
+
+        pipe = PipelineV3(args.db_adr, args.schema, cache_size=args.cache_size)
+        jobs = JobManager(pipe, num_workers=args.job_workers)
+        jobs.cleanup()
+        RetrievalDaemon(pipe, args.address, jobs).serve(args.workers, args.queue_size)
+    else:
+        client = RetrievalClient(args.address)
+        if args.command == "retrieve":
+            response = client.retrieve(args.path, args.folder)
+            # the web server reads the distances from this line
+            distances = [hit["distance"] for hit in response.get("distances", [])]
+            print(f"Distances: {json.dumps(distances)}")
+        elif args.command == "query":
+            response = client.query(args.path)
+            print(json.dumps(response, indent=2))
+        elif args.command == "add":
+            response = client.add(args.path)
+        elif args.command in ["submit", "status"]:
+            if args.command == "submit":
+                response = client.submit(args.path)
+            else:
+                response = client.job_status(args.job_id)
+            print(json.dumps(response))
+        else:
+            response = client.request("GET", f"/{args.command}")
+            print(json.dumps(response, indent=2))
+        if response.get("has_error"):
+            # stdout only carries the response, submit and status are parsed as json
+            print(f"Error: {response.get('error')}", file=sys.stderr)
+            raise SystemExit(1)
@@ -7,6 +7,19 @@ from senet_model import SENet
 import os
 import numpy as np
 from pydantic import BaseModel
+import time
+
+# copied into the image by the Dockerfile, collections may use any payload encoding
+from image_payload import decode_image, encode_image
+
+# the descriptor cache modules are copied into the image by the Dockerfile
+try:
+    from descriptors import model_identifier
+    from descriptor_cache import DEFAULT_DESCRIPTOR_CACHE, DescriptorCache
+    from hash_store import content_hash
+except ImportError as e:
+    print(f"Descriptor cache disabled. Reason: {e}")
+    DescriptorCache = None
 
 
 class VectorInput(BaseModel):
@@ -17,6 +30,31 @@ app = FastAPI()
 
 model_path = "fullAdaptedSENetNetmodel.keras"
 vec = SENet(model_path)
+cache = None
+if DescriptorCache is not None:
+    # docker-compose.yml mounts a volume here, the cache survives restarts
+    cache_path = os.environ.get("DESCRIPTOR_CACHE", DEFAULT_DESCRIPTOR_CACHE)
+    cache = DescriptorCache(model_identifier(model_path), cache_path)
+
+
+def payload_image(payload: str) -> np.ndarray:
+    """
+    Image of a payload in any encoding of image_payload.py. The legacy list payload has
+    no dtype, its integers are taken as the smallest unsigned type that holds them, i.e.
+    uint8 for the usual images, so its content hash matches the one of PipelineV3.
+    """
+    img = decode_image(payload)
+    if payload.startswith("[") and img.size and img.min() >= 0:
+        for dtype in [np.uint8, np.uint16]:
+            if img.max() <= np.iinfo(dtype).max:
+                img = img.astype(dtype)
+                break
+    return img
+
+
+def legacy_payload(payload: str, img: np.ndarray) -> str:
+    # SENet.vectorize only reads the legacy list encoding
+    return payload if payload.startswith("[") else encode_image(img, "list")
 
 
 @app.get("/.well-known/live", response_class=Response)
@@ -30,11 +68,27 @@ def meta():
     return {"Wow": "wow"}
 
 
+@app.get("/cache")
+def cache_stats():
+    return cache.stats() if cache is not None else {}
+
+
 @app.post("/vectors")
 async def read_item(item: VectorInput, response: Response):
     try:
-        vector = await vec.vectorize(item.image)
-        return {"text": "success??", "vector": vector}
+        img = payload_image(item.image)
+        if cache is None:
+            vector = await vec.vectorize(legacy_payload(item.image, img))
+            return {"text": "success??", "vector": vector}
+        # keyed on the decoded image, so entries are shared with PipelineV3
+        img_hash = content_hash(img)
+        vector = cache.get(img_hash)
+        if vector is None:
+            start = time.perf_counter()
+            vector = await vec.vectorize(legacy_payload(item.image, img))
+            cache.inference_seconds += time.perf_counter() - start
+            cache.put(img_hash, vector)
+        return {"text": "success??", "vector": np.asarray(vector).tolist()}
     except Exception as e:
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         return {"error": str(e)}
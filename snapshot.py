@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Chunked on disk snapshots of a collection. Every chunk holds up to `chunk_size` objects:
+
+    vectors_00000.npy          float32 (n, dim)
+    properties_00000.parquet   ids and properties, properties_00000.npz without pyarrow
+    manifest.json              collection config, chunk list, object count
+
+Only one chunk is held in memory while writing or reading.
+"""
+import os
+import json
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+CHUNK_SIZE = 10000
+
+
+class SnapshotWriter:
+    def __init__(
+        self,
+        directory: str,
+        schema_config: dict,
+        chunk_size: int = CHUNK_SIZE,
+        use_parquet: bool = True,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.use_parquet = use_parquet and pa is not None
+        self.manifest = {
+            "schema": schema_config,
+            "format": "parquet" if self.use_parquet else "npz",
+            "chunks": [],
+            "count": 0,
+            "dim": None,
+        }
+        self._ids = []
+        self._vectors = []
+        self._properties = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def add(self, object_id: str, vector: list, properties: dict) -> None:
+        self._ids.append(object_id)
+        self._vectors.append(vector)
+        self._properties.append(properties)
+        if len(self._ids) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._ids:
+            return
+        number = len(self.manifest["chunks"])
+        vectors = np.asarray(self._vectors, np.float32)
+        vector_file = f"vectors_{number:05d}.npy"
+        np.save(os.path.join(self.directory, vector_file), vectors)
+
+        fields = sorted({key for properties in self._properties for key in properties})
+        columns = {"id": self._ids}
+        for field in fields:
+            columns[field] = [
+                _serialize(properties.get(field)) for properties in self._properties
+            ]
+        if self.use_parquet:
+            property_file = f"properties_{number:05d}.parquet"
+            pq.write_table(
+                pa.table(columns), os.path.join(self.directory, property_file)
+            )
+        else:
+            property_file = f"properties_{number:05d}.npz"
+            np.savez(
+                os.path.join(self.directory, property_file),
+                **{key: np.array(values, dtype=object) for key, values in columns.items()},
+            )
+
+        self.manifest["chunks"].append(
+            {"vectors": vector_file, "properties": property_file, "count": len(self._ids)}
+        )
+        self.manifest["count"] += len(self._ids)
+        if vectors.size:
+            self.manifest["dim"] = int(vectors.shape[1])
+        self._ids, self._vectors, self._properties = [], [], []
+
+    def close(self) -> None:
+        self.flush()
+        with open(os.path.join(self.directory, "manifest.json"), "w") as f:
+            json.dump(self.manifest, f, indent=2)
+
+
+def read_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, "manifest.json")) as f:
+        return json.load(f)
+
+
+def read_snapshot(directory: str):
+    """
+    Yields (object_id, vector, properties) for every object, one chunk in memory at a time.
+    """
+    manifest = read_manifest(directory)
+    for chunk in manifest["chunks"]:
+        vectors = np.load(os.path.join(directory, chunk["vectors"]), mmap_mode="r")
+        path = os.path.join(directory, chunk["properties"])
+        if manifest["format"] == "parquet":
+            columns = pq.read_table(path).to_pydict()
+        else:
+            with np.load(path, allow_pickle=True) as data:
+                columns = {key: data[key].tolist() for key in data.files}
+        ids = columns.pop("id")
+        for idx, object_id in enumerate(ids):
+            properties = {
+                key: values[idx]
+                for key, values in columns.items()
+                if values[idx] is not None
+            }
+            yield object_id, np.asarray(vectors[idx]), properties
+
+
+def _serialize(value):
+    # nested values are stored as json so every column has a flat type
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# Tracks the startup latency of the pipeline_v3.py cli: the import time of the module and
+# the wall time of every subcommand in a fresh interpreter, as a cold start would see it.
+# Also records which heavy libraries each run ended up importing. help and summary
+# always run, the other subcommands only when their input is given.
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+
+HEAVY_MODULES = ["tensorflow", "matplotlib", "skimage", "msirs_utils"]
+
+IMPORT_SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+import pipeline_v3
+seconds = time.perf_counter() - start
+heavy = [m for m in {heavy} if m in sys.modules]
+print(json.dumps({{"seconds": seconds, "heavy_modules": heavy}}))
+"""
+
+# runs the cli in process so the loaded modules can be inspected afterwards
+COMMAND_SNIPPET = """
+import sys, runpy, json, atexit
+heavy = {heavy}
+def report():
+    loaded = [m for m in heavy if m in sys.modules]
+    sys.stderr.write("STARTUP " + json.dumps(loaded) + "\\n")
+atexit.register(report)
+sys.argv = ["pipeline_v3.py"] + {argv}
+runpy.run_path("pipeline_v3.py", run_name="__main__")
+"""
+
+
+def run_snippet(code: str) -> tuple:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    return time.perf_counter() - start, result
+
+
+def measure_import(repeats: int) -> dict:
+    seconds = []
+    heavy = []
+    for _ in range(repeats):
+        _, result = run_snippet(IMPORT_SNIPPET.format(heavy=HEAVY_MODULES))
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1]}
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        seconds.append(report["seconds"])
+        heavy = report["heavy_modules"]
+    return {"import_s_p50": float(np.median(seconds)), "heavy_modules": heavy}
+
+
+def measure_command(argv: list, repeats: int) -> dict:
+    seconds = []
+    heavy = []
+    returncode = 0
+    for _ in range(repeats):
+        elapsed, result = run_snippet(
+            COMMAND_SNIPPET.format(heavy=HEAVY_MODULES, argv=argv)
+        )
+        seconds.append(elapsed)
+        returncode = result.returncode
+        for line in result.stderr.splitlines():
+            if line.startswith("STARTUP "):
+                heavy = json.loads(line[len("STARTUP ") :])
+    return {
+        "wall_s_p50": float(np.median(seconds)),
+        "wall_s_max": float(np.max(seconds)),
+        "returncode": returncode,
+        "heavy_modules": heavy,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cli startup latency.")
+    parser.add_argument("--db-adr", type=str, default="http://localhost:8080")
+    parser.add_argument("--image", type=str, help="Query image for the retrieve command")
+    parser.add_argument("--strip", type=str, help="Strip for the tiled command")
+    # add and populate write to the database, only run them against a scratch one
+    parser.add_argument("--add-image", type=str, help="Image for the add command")
+    parser.add_argument(
+        "--populate-dir", type=str, help="Image directory for the populate command"
+    )
+    parser.add_argument("-n", "--repeats", type=int, default=5)
+    parser.add_argument("--output", type=str, default="startup_benchmark.json")
+    args = parser.parse_args()
+
+    commands = {
+        "help": ["--help"],
+        "summary": ["--db-adr", args.db_adr, "summary"],
+    }
+    if args.image:
+        commands["retrieve"] = ["--db-adr", args.db_adr, "retrieve", args.image]
+    if args.strip:
+        commands["tiled"] = ["--db-adr", args.db_adr, "tiled", args.strip]
+    if args.add_image:
+        commands["add"] = ["--db-adr", args.db_adr, "add", args.add_image]
+    if args.populate_dir:
+        commands["populate"] = ["--db-adr", args.db_adr, "populate", args.populate_dir]
+
+    results = {"import": measure_import(args.repeats)}
+    print(f"import: {results['import']}")
+    for name, argv in commands.items():
+        results[name] = measure_command(argv, args.repeats)
+        print(f"{name}: {results[name]}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Overlapping windows over large strip images for tiled queries. Strips stored as .npy or
+as uncompressed tiff (with tifffile installed) are memory mapped, so only the windows of
+the current batch are ever read, other formats are decoded completely first.
+"""
+import os
+import numpy as np
+from typing import Iterable
+from PIL import Image
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+TILE_SIZE = 512
+STRIDE = 384
+# windows with more no-data pixels than this fraction are skipped
+MAX_NODATA_FRACTION = 0.5
+# windows flatter than this standard deviation carry no texture and are skipped
+MIN_STD = 2.0
+
+
+def open_strip(path: str) -> np.ndarray:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        return np.load(path, mmap_mode="r")
+    if ext in [".tif", ".tiff"] and tifffile is not None:
+        try:
+            return tifffile.memmap(path, mode="r")
+        except ValueError:
+            # compressed or tiled tiffs cannot be mapped
+            return tifffile.imread(path)
+    Image.MAX_IMAGE_PIXELS = None
+    with Image.open(path) as img:
+        return np.asarray(img)
+
+
+def _starts(length: int, tile_size: int, stride: int) -> list:
+    # the last window is aligned to the border so the whole strip is covered
+    starts = list(range(0, max(length - tile_size, 0) + 1, stride))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+    return starts
+
+
+def iter_windows(
+    img: np.ndarray,
+    tile_size: int = TILE_SIZE,
+    stride: int = STRIDE,
+    nodata: float = 0,
+    max_nodata_fraction: float = MAX_NODATA_FRACTION,
+    min_std: float = MIN_STD,
+) -> Iterable[tuple]:
+    """
+    Yields (row, col, window) for every window worth querying, windows are copied out
+    of the strip one at a time.
+    """
+    height, width = img.shape[:2]
+    for row in _starts(height, tile_size, stride):
+        for col in _starts(width, tile_size, stride):
+            window = np.array(img[row : row + tile_size, col : col + tile_size])
+            pixels = window if window.ndim == 2 else window.max(axis=-1)
+            if np.mean(pixels == nodata) > max_nodata_fraction:
+                continue
+            if window.std() < min_std:
+                continue
+            yield row, col, window
+
+
+def merge_hits(hits: dict, windows: list, responses: list) -> None:
+    """
+    Adds the responses of a batch of windows to hits, which keeps the best distance per
+    matched image together with the window it came from.
+    """
+    for (row, col, window), response in zip(windows, responses):
+        for source, distance, meta_data in zip(
+            response["images"], response["distances"], response["meta_data"]
+        ):
+            location = {
+                "row": row,
+                "col": col,
+                "height": window.shape[0],
+                "width": window.shape[1],
+                "distance": distance["distance"],
+            }
+            hit = hits.get(source)
+            if hit is None:
+                hits[source] = {
+                    "distance": distance,
+                    "meta_data": meta_data,
+                    "window": location,
+                    "num_windows": 1,
+                }
+                continue
+            hit["num_windows"] += 1
+            if distance["distance"] < hit["distance"]["distance"]:
+                hit["distance"] = distance
+                hit["window"] = location
+
+
+def ranked_response(hits: dict, num_to_retrieve: int, num_windows: int) -> dict:
+    ranked = sorted(hits.items(), key=lambda item: item[1]["distance"]["distance"])
+    ranked = ranked[:num_to_retrieve]
+    return {
+        "images": [source for source, _ in ranked],
+        "distances": [hit["distance"] for _, hit in ranked],
+        "meta_data": [hit["meta_data"] for _, hit in ranked],
+        "windows": [hit["window"] for _, hit in ranked],
+        "matched_windows": [hit["num_windows"] for _, hit in ranked],
+        "num_windows": num_windows,
+    }
@@ -2,8 +2,22 @@
 import weaviate
 import numpy as np
 import json
+import copy
+import time
+import hashlib
+import threading
+from typing import Iterable, Optional
+from image_payload import ENCODINGS, encode_image
+from hash_store import DEFAULT_HASH_STORE, HashStore, content_hash
+from hash_store import object_uuid as make_object_uuid
+from query_cache import QueryCache
+from metadata import METADATA_FIELDS, METADATA_PROPERTIES
+from metadata import extract_properties, load_metadata
+from snapshot import CHUNK_SIZE, SnapshotWriter, read_manifest, read_snapshot
+from db_stats import DEFAULT_MAX_CONNECTIONS, ClientStats, estimate_index_memory
+from descriptors import ModelMismatchError
 
-# TODO: add uuid or smth
+# object ids are uuid5 of the image content hash, see hash_store.py
 SCHEMA = {
     "classes": [
         {
@@ -11,18 +25,413 @@ SCHEMA = {
             "vectorizer": "img2vec-neural",
             "vectorIndexType": "hnsw",
             "moduleConfig": {"img2vec-neural": {"imageFields": ["image"]}},
+            # creation times are filterable, the stored import rate is counted on them
+            "invertedIndexConfig": {"indexTimestamps": True},
             "properties": [
                 {"name": "image", "dataType": ["string"]},
                 {"name": "source", "dataType": ["string"]},
                 {"name": "meta_data", "dataType": ["string"]},
-            ],
+                {"name": "content_hash", "dataType": ["string"]},
+            ]
+            + METADATA_PROPERTIES,
         }
     ],
 }
 
 
-class WeaviateClient:
-    def __init__(self, db_adr: str, schema: str = "") -> None:
+def created_since(window_minutes: float) -> dict:
+    # where filter on the creation time of objects, in ms since the epoch
+    since = int((time.time() - window_minutes * 60) * 1000)
+    return {
+        "path": ["_creationTimeUnix"],
+        "operator": "GreaterThan",
+        "valueString": str(since),
+    }
+
+
+# vectorizer of collections whose descriptors are computed by PipelineV3 and sent on insert
+CLIENT_VECTORIZER = "none"
+
+
+def make_class_config(
+    class_name: str, vectorizer: str = "img2vec-neural", model_id: str = ""
+) -> dict:
+    """
+    Class config of a collection. With the client vectorizer the image field is not
+    needed by weaviate and the model the vectors come from is recorded in the description.
+    """
+    class_config = copy.deepcopy(SCHEMA["classes"][0])
+    class_config["class"] = class_name
+    if vectorizer == CLIENT_VECTORIZER:
+        class_config["vectorizer"] = CLIENT_VECTORIZER
+        class_config.pop("moduleConfig")
+        class_config["description"] = json.dumps({"model_id": model_id})
+    return class_config
+
+
+def class_model_id(class_config: dict) -> str:
+    try:
+        return json.loads(class_config.get("description") or "{}").get("model_id", "")
+    except ValueError:
+        return ""
+
+
+# image payload encoding per collection, collections not listed here use the legacy format
+COLLECTION_IMAGE_ENCODING = {"Test": "list"}
+
+# defaults for the batch import path
+BATCH_SIZE = 100
+BATCH_NUM_WORKERS = 4
+BATCH_MAX_RETRIES = 3
+BATCH_BACKOFF = 1.0
+# near vector queries per graphql request in query_images
+MULTI_QUERY_SIZE = 32
+RERANK_METRICS = ["cosine", "l2-squared"]
+
+
+def exact_distances(query: np.ndarray, vectors: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Distances in the convention of weaviate, cosine is 1 - cosine similarity.
+    """
+    query = np.asarray(query, np.float32).ravel()
+    vectors = np.asarray(vectors, np.float32)
+    if metric == "l2-squared":
+        diff = vectors - query
+        return np.einsum("ij,ij->i", diff, diff)
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    return 1.0 - (vectors @ query) / np.maximum(norms, 1e-12)
+
+
+def object_hash(data_object: dict) -> Optional[str]:
+    # objects created outside of make_data_object fall back to hashing the payload
+    if "content_hash" in data_object:
+        return data_object["content_hash"]
+    if "image" not in data_object:
+        return None
+    return hashlib.sha256(str(data_object["image"]).encode()).hexdigest()
+
+
+class ImportBatch:
+    """
+    Context manager around the weaviate batch endpoint. Objects are buffered and sent in
+    batches of `batch_size` by `num_workers` threads, failed objects are retried with
+    exponential backoff once the context is left. `report` holds one entry per sent batch.
+    """
+
+    def __init__(
+        self,
+        client,
+        batch_size: int = BATCH_SIZE,
+        num_workers: int = BATCH_NUM_WORKERS,
+        max_retries: int = BATCH_MAX_RETRIES,
+        backoff: float = BATCH_BACKOFF,
+    ) -> None:
+        self.client = client
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.report = []
+        self.num_added = 0
+        self._pending = {}
+        self._failed = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._close()
+        if exc_type is None:
+            self._retry_failed()
+
+    def _open(self) -> None:
+        self.client.client.batch.configure(
+            batch_size=self.batch_size,
+            num_workers=self.num_workers,
+            dynamic=False,
+            timeout_retries=self.max_retries,
+            connection_error_retries=self.max_retries,
+            callback=self._handle_results,
+        )
+        self.client.client.batch.__enter__()
+
+    def _close(self) -> None:
+        self.client.client.batch.__exit__(None, None, None)
+
+    def add(
+        self,
+        data_object: dict,
+        vector: Optional[list] = None,
+        object_uuid: Optional[str] = None,
+        check_duplicates: bool = True,
+    ) -> bool:
+        if check_duplicates and self.client.check_for_duplicate_entries(data_object):
+            print("Object already exists, skipping addition")
+            return False
+        if object_uuid is None:
+            object_uuid = self.client.object_uuid(data_object)
+        if vector is not None and not isinstance(vector, list):
+            vector = np.asarray(vector).ravel().tolist()
+        with self._lock:
+            self._pending[object_uuid] = (data_object, vector)
+        self.client.client.batch.add_data_object(
+            data_object, self.client.schema, uuid=object_uuid, vector=vector
+        )
+        self.num_added += 1
+        return True
+
+    def add_image(
+        self,
+        img: np.ndarray,
+        original_file_path: str,
+        file_path: str,
+        vector: Optional[np.ndarray] = None,
+    ) -> bool:
+        data_object = self.client.make_data_object(img, original_file_path, file_path)
+        return self.add(data_object, vector=vector)
+
+    def _handle_results(self, results: list) -> None:
+        # called by the weaviate batch workers, once per sent batch
+        errors = []
+        inserted = []
+        with self._lock:
+            for result in results or []:
+                object_uuid = result.get("id")
+                result_errors = result.get("result", {}).get("errors")
+                entry = self._pending.pop(object_uuid, None)
+                if result_errors:
+                    errors.append({"id": object_uuid, "errors": result_errors})
+                    if entry is not None:
+                        self._failed[object_uuid] = entry
+                elif entry is not None and object_hash(entry[0]) is not None:
+                    inserted.append((object_hash(entry[0]), object_uuid))
+            self.report.append(
+                {
+                    "batch": len(self.report),
+                    "objects": len(results or []),
+                    "failed": len(errors),
+                    "errors": errors,
+                }
+            )
+        self.client.hash_store.add_many(self.client.hash_key, inserted)
+        self.client.stats.record_import(len(results or []) - len(errors))
+        if inserted:
+            self.client.invalidate_cache()
+
+    def _retry_failed(self) -> None:
+        for attempt in range(self.max_retries):
+            if not self._failed:
+                return
+            time.sleep(self.backoff * 2**attempt)
+            to_retry = self._failed
+            self._failed = {}
+            print(f"Retrying {len(to_retry)} failed objects (attempt {attempt + 1})")
+            self._open()
+            for object_uuid, (data_object, vector) in to_retry.items():
+                with self._lock:
+                    self._pending[object_uuid] = (data_object, vector)
+                self.client.client.batch.add_data_object(
+                    data_object, self.client.schema, uuid=object_uuid, vector=vector
+                )
+            self._close()
+        if self._failed:
+            print(f"Giving up on {len(self._failed)} objects after {self.max_retries} retries")
+
+    @property
+    def failed(self) -> list:
+        return list(self._failed.keys())
+
+
+class BaseWeaviateClient:
+    """
+    Configuration and request independent helpers shared by the sync and async clients.
+    """
+
+    def __init__(
+        self,
+        schema: str = "",
+        image_encoding: str = "",
+        hash_store_path: str = DEFAULT_HASH_STORE,
+        query_cache: Optional[QueryCache] = None,
+        vectorizer: str = "img2vec-neural",
+        store_image: bool = True,
+        model_id: str = "",
+        rerank: int = 0,
+        rerank_metric: str = "cosine",
+        db_adr: str = "",
+    ) -> None:
+        # add schema, allow for passing of custom schema for better development and testing
+        if schema == "":
+            self.schema = "Test"
+        else:
+            self.schema = schema
+
+        # encoding of the image property, see image_payload.py
+        if image_encoding == "":
+            image_encoding = COLLECTION_IMAGE_ENCODING.get(self.schema, "list")
+        if image_encoding not in ENCODINGS:
+            raise ValueError(f"Unknown image encoding {image_encoding}")
+        self.image_encoding = image_encoding
+
+        # local record of inserted content hashes, makes duplicate checks free. Kept per
+        # database and collection, so a new database does not inherit the hashes
+        self.hash_store = HashStore(hash_store_path)
+        self.hash_key = self.schema
+        if db_adr:
+            self.hash_key = f"{db_adr.rstrip('/')}/{self.schema}"
+
+        # opt in query result cache, can be shared between clients
+        self.query_cache = query_cache
+
+        # latencies and import counts recorded while the client runs
+        self.stats = ClientStats()
+
+        # with the client vectorizer descriptors are computed by the caller and sent on
+        # insert, the image is then only stored if asked for
+        self.vectorizer = vectorizer
+        self.needs_vectors = vectorizer == CLIENT_VECTORIZER
+        self.store_image = store_image or not self.needs_vectors
+        self.model_id = model_id
+
+        # two stage search: rerank candidates are fetched from hnsw with their vectors
+        # and reordered by the exact distance, 0 returns the hnsw order as is
+        if rerank_metric not in RERANK_METRICS:
+            raise ValueError(f"Unknown rerank metric {rerank_metric}")
+        self.rerank = rerank
+        self.rerank_metric = rerank_metric
+
+    def check_model_id(self, class_config: dict) -> None:
+        # query and ingest have to use the same model, otherwise distances are meaningless
+        stored = class_model_id(class_config)
+        if self.needs_vectors and stored != self.model_id:
+            raise ModelMismatchError(
+                f"Collection {self.schema} holds vectors of model {stored!r}, "
+                f"this client uses {self.model_id!r}"
+            )
+
+    def make_data_object(
+        self, img: np.ndarray, original_file_path: str, file_path: str
+    ) -> dict:
+        metadata = load_metadata(original_file_path)
+        # TODO: make sure image is in correct format!!
+        data_object = {
+            "source": file_path,
+            "meta_data": json.dumps(metadata),
+            "content_hash": content_hash(img),
+        }
+        if self.store_image:
+            data_object["image"] = encode_image(img, self.image_encoding)
+        data_object.update(extract_properties(metadata, original_file_path))
+        return data_object
+
+    def check_for_duplicate_entries(self, object_to_check: dict) -> bool:
+        return self.hash_store.contains(self.hash_key, object_hash(object_to_check))
+
+    def object_uuid(self, data_object: dict) -> str:
+        return make_object_uuid(self.schema, object_hash(data_object))
+
+    def invalidate_cache(self) -> None:
+        if self.query_cache is not None:
+            self.query_cache.invalidate(self.schema)
+
+    def cache_stats(self) -> dict:
+        if self.query_cache is None:
+            return {}
+        return self.query_cache.stats()
+
+    def collect_stats(
+        self,
+        count: int,
+        group_counts: dict,
+        dim: int,
+        class_config: dict,
+        window_minutes: float,
+        imported_in_window: Optional[int] = None,
+    ) -> dict:
+        """
+        imported_in_window is the number of stored objects created in the window, None
+        if the collection does not index creation times. Unlike the client section it
+        covers imports of every process.
+        """
+        max_connections = class_config.get("vectorIndexConfig", {}).get(
+            "maxConnections", DEFAULT_MAX_CONNECTIONS
+        )
+        return {
+            "collection": self.schema,
+            "count": count,
+            "counts_by_source_stripe": group_counts.get("source_stripe", {}),
+            "counts_by_landform_class": group_counts.get("landform_class", {}),
+            "vector_dim": dim,
+            "estimated_index_memory_bytes": estimate_index_memory(
+                count, dim, max_connections
+            ),
+            "import_window_minutes": window_minutes,
+            "imported_in_window": imported_in_window,
+            "import_rate_per_s": (
+                None
+                if imported_in_window is None
+                else imported_in_window / (window_minutes * 60)
+            ),
+            "client": self.stats.summary(window_minutes),
+            "query_cache": self.cache_stats(),
+        }
+
+    def candidate_limit(self, num_to_retrieve: int) -> int:
+        return max(num_to_retrieve, self.rerank)
+
+    def reranking(self, num_to_retrieve: int) -> bool:
+        return self.rerank > num_to_retrieve
+
+    def rerank_result(
+        self, result: dict, query: np.ndarray, num_to_retrieve: int, key: str = ""
+    ) -> dict:
+        """
+        Keeps the num_to_retrieve candidates closest to query by exact distance, the
+        candidates need their vector in _additional.
+        """
+        key = key or self.schema
+        candidates = result["data"]["Get"][key]
+        if not candidates:
+            return result
+        vectors = np.array([i["_additional"]["vector"] for i in candidates], np.float32)
+        distances = exact_distances(query, vectors, self.rerank_metric)
+        order = np.argsort(distances)[:num_to_retrieve]
+        reranked = []
+        for idx in order:
+            candidate = dict(candidates[idx])
+            candidate["_additional"] = {"distance": float(distances[idx])}
+            reranked.append(candidate)
+        result["data"]["Get"][key] = reranked
+        return result
+
+    def parse_query_result(self, result: dict) -> dict:
+        images = [i["source"] for i in result["data"]["Get"][self.schema]]
+        distances = [i["_additional"] for i in result["data"]["Get"][self.schema]]
+        meta_data = [
+            {field: i.get(field) for field in METADATA_FIELDS}
+            for i in result["data"]["Get"][self.schema]
+        ]
+        response = {"images": images, "distances": distances, "meta_data": meta_data}
+        return response
+
+
+class WeaviateClient(BaseWeaviateClient):
+    def __init__(
+        self,
+        db_adr: str,
+        schema: str = "",
+        image_encoding: str = "",
+        hash_store_path: str = DEFAULT_HASH_STORE,
+        query_cache: Optional[QueryCache] = None,
+        vectorizer: str = "img2vec-neural",
+        store_image: bool = True,
+        model_id: str = "",
+        rerank: int = 0,
+        rerank_metric: str = "cosine",
+        ensure_schema: bool = True,
+    ) -> None:
         SCHEMA = {
             "classes": [
                 {
@@ -34,67 +443,337 @@ class WeaviateClient:
                         {"name": "image", "dataType": ["string"]},
                         {"name": "source", "dataType": ["string"]},
                         {"name": "meta_data", "dataType": ["string"]},
-                    ],
+                        {"name": "content_hash", "dataType": ["string"]},
+                    ]
+                    + METADATA_PROPERTIES,
                 }
             ],
         }
 
         self.client = weaviate.Client(db_adr)
+        super().__init__(
+            schema,
+            image_encoding,
+            hash_store_path,
+            query_cache,
+            vectorizer=vectorizer,
+            store_image=store_image,
+            model_id=model_id,
+            rerank=rerank,
+            rerank_metric=rerank_metric,
+            db_adr=db_adr,
+        )
+        # read only users (stats) leave the schema as it is
+        if ensure_schema:
+            self.ensure_schema()
 
-        # add schema, allow for passing of custom schema for better development and testing
-        if schema == "":
-            self.schema = "Test"
+    def ensure_schema(self) -> None:
+        """
+        Creates a client vectorized collection if it does not exist yet, module
+        vectorized collections are set up with their module as before. An existing
+        collection is checked against the model and gets the metadata properties it
+        misses, queries ask for every one of them.
+
+        A missing collection holds no objects, hashes stored for it are from a dropped
+        collection or a wiped database and are cleared.
+        """
+        if not self.client.schema.exists(self.schema):
+            self.hash_store.clear(self.hash_key)
+            if self.needs_vectors:
+                self.client.schema.create_class(
+                    make_class_config(self.schema, self.vectorizer, self.model_id)
+                )
         else:
-            self.schema = schema
+            class_config = self.client.schema.get(self.schema)
+            self.check_model_id(class_config)
+            existing = [prop["name"] for prop in class_config.get("properties", [])]
+            for prop in METADATA_PROPERTIES:
+                if prop["name"] not in existing:
+                    self.client.schema.property.create(self.schema, prop)
 
     def add_to_db(
-        self, img: np.ndarray, original_file_path: str, file_path: str
+        self,
+        img: np.ndarray,
+        original_file_path: str,
+        file_path: str,
+        vector: Optional[np.ndarray] = None,
     ) -> None:
-        # TODO: handle case in which no metadata json file is found
-        with open(original_file_path) as f:
-            metadata = json.load(f)
-        # TODO: make sure image is in correct format!!
-        data = {"image": str(img.tolist()), "source": file_path, "meta_data": metadata}
-        self.create_entry(data)
+        data = self.make_data_object(img, original_file_path, file_path)
+        if vector is not None:
+            vector = np.asarray(vector).ravel().tolist()
+        self.create_entry(data, vector=vector)
+
+    def batch(self, **kwargs) -> ImportBatch:
+        """
+        Returns a context manager for batched imports, e.g.
 
-    def create_entry(self, data_object: dict) -> None:
+            with client.batch(batch_size=200) as batch:
+                batch.add_image(img, original_file_path, file_path)
+            print(batch.report)
+        """
+        return ImportBatch(self, **kwargs)
+
+    def add_many(self, data_objects: Iterable[dict], **kwargs) -> list:
+        """
+        Adds all provided data objects through the batch endpoint, returns the per batch report.
+        """
+        with self.batch(**kwargs) as batch:
+            for data_object in data_objects:
+                batch.add(data_object)
+        return batch.report
+
+    def create_entry(self, data_object: dict, vector: Optional[list] = None) -> None:
         does_exist = self.check_for_duplicate_entries(data_object)
         if not does_exist:
-            self.client.data_object.create(data_object, self.schema)
+            obj_uuid = self.object_uuid(data_object)
+            try:
+                self.client.data_object.create(
+                    data_object, self.schema, uuid=obj_uuid, vector=vector
+                )
+            except weaviate.exceptions.ObjectAlreadyExistsException:
+                # known to weaviate but not to the local hash store, overwrite it
+                self.client.data_object.replace(
+                    data_object, self.schema, obj_uuid, vector=vector
+                )
+            self.hash_store.add(self.hash_key, object_hash(data_object), obj_uuid)
+            self.stats.record_import(1)
+            self.invalidate_cache()
         else:
             print("Object already exists, skipping addition")
 
-    def check_for_duplicate_entries(self, object_to_check: dict) -> bool:
-        # TODO: rewrite this using UUIDs, or something similar
-        does_exist = True
-        return does_exist
+    def delete_entry(self, obj_uuid: str, img_hash: Optional[str] = None) -> bool:
+        try:
+            self.client.data_object.delete(obj_uuid, class_name=self.schema)
+            deleted = True
+        except weaviate.exceptions.UnexpectedStatusCodeException as e:
+            print(f"Failed to delete {obj_uuid}. Reason: {e}")
+            deleted = False
+        if img_hash is not None:
+            self.hash_store.remove(self.hash_key, img_hash)
+        self.invalidate_cache()
+        return deleted
 
-    def query_image(self, img_data: np.ndarray, num_to_retrieve=10) -> dict:
+    def query_image(
+        self, img_data: np.ndarray, num_to_retrieve=10, where: Optional[dict] = None
+    ) -> dict:
+        """
+        where is a weaviate where filter on the typed metadata properties, see
+        metadata.where_filter, it is applied inside the vector search.
+        """
+        if self.query_cache is not None:
+            key = self.query_cache.make_key(
+                img_data, num_to_retrieve, self.schema, where
+            )
+            response = self.query_cache.get(key)
+            if response is None:
+                response = self._query_image(img_data, num_to_retrieve, where)
+                self.query_cache.put(key, response)
+            return response
+        return self._query_image(img_data, num_to_retrieve, where)
+
+    def _query_image(
+        self, img_data: np.ndarray, num_to_retrieve=10, where: Optional[dict] = None
+    ) -> dict:
         # TODO: make sure this works
         vector = img_data.tolist()
 
-        result = (
-            self.client.query.get(self.schema, ["source", "meta_data"])
+        start = time.perf_counter()
+        rerank = self.reranking(num_to_retrieve)
+        query = (
+            self.client.query.get(self.schema, ["source"] + METADATA_FIELDS)
             .with_near_vector(
                 {
                     "vector": vector,
                 }
             )
-            .with_additional(["distance"])
-            .with_limit(num_to_retrieve)
-            .do()
+            .with_additional(["distance", "vector"] if rerank else ["distance"])
+            .with_limit(self.candidate_limit(num_to_retrieve))
         )
+        if where is not None:
+            query = query.with_where(where)
+        result = query.do()
+        if rerank:
+            result = self.rerank_result(result, img_data, num_to_retrieve)
+        self.stats.record_latency("search", time.perf_counter() - start)
 
-        images = [i["source"] for i in result["data"]["Get"][self.schema]]
-        distances = [i["_additional"] for i in result["data"]["Get"][self.schema]]
-        meta_data = [
-            json.loads(i["meta_data"]) for i in result["data"]["Get"][self.schema]
+        return self.parse_query_result(result)
+
+    def query_images(
+        self, vectors: list, num_to_retrieve=10, where: Optional[dict] = None
+    ) -> list:
+        """
+        One response per query vector, the vectors are sent as aliased near vector
+        queries in one graphql request per MULTI_QUERY_SIZE vectors.
+        """
+        responses = []
+        rerank = self.reranking(num_to_retrieve)
+        for chunk_start in range(0, len(vectors), MULTI_QUERY_SIZE):
+            chunk = vectors[chunk_start : chunk_start + MULTI_QUERY_SIZE]
+            queries = []
+            for idx, vector in enumerate(chunk):
+                query = (
+                    self.client.query.get(self.schema, ["source"] + METADATA_FIELDS)
+                    .with_near_vector({"vector": np.asarray(vector).ravel().tolist()})
+                    .with_additional(["distance", "vector"] if rerank else ["distance"])
+                    .with_limit(self.candidate_limit(num_to_retrieve))
+                    .with_alias(f"q{idx}")
+                )
+                if where is not None:
+                    query = query.with_where(where)
+                queries.append(query)
+            start = time.perf_counter()
+            result = self.client.query.multi_get(queries).do()
+            if rerank:
+                for idx, vector in enumerate(chunk):
+                    result = self.rerank_result(
+                        result, vector, num_to_retrieve, f"q{idx}"
+                    )
+            self.stats.record_latency("multi_search", time.perf_counter() - start)
+            for idx in range(len(chunk)):
+                responses.append(
+                    self.parse_query_result(
+                        {"data": {"Get": {self.schema: result["data"]["Get"][f"q{idx}"]}}}
+                    )
+                )
+        return responses
+
+    def enable_compression(self, segments: int = 0, centroids: int = 256) -> None:
+        """
+        Switches the hnsw index of the collection to product quantized vectors, weaviate
+        fits the codebook on the stored vectors and rescores candidates with the full
+        vectors from disk. segments=0 lets weaviate pick the number of subvectors.
+        """
+        pq_config = {"enabled": True, "centroids": centroids}
+        if segments:
+            pq_config["segments"] = segments
+        self.client.schema.update_config(
+            self.schema, {"vectorIndexConfig": {"pq": pq_config}}
+        )
+
+    def iterate_objects(
+        self, page_size: int = 500, include_image: bool = False
+    ) -> Iterable[tuple]:
+        """
+        Walks the whole collection with the cursor api, yields (id, vector, properties).
+        """
+        properties = [
+            prop["name"] for prop in self.client.schema.get(self.schema)["properties"]
         ]
-        response = {"images": images, "distances": distances, "meta_data": meta_data}
-        return response
+        if not include_image:
+            properties = [prop for prop in properties if prop != "image"]
+        after = None
+        while True:
+            query = (
+                self.client.query.get(self.schema, properties)
+                .with_additional(["id", "vector"])
+                .with_limit(page_size)
+            )
+            if after is not None:
+                query = query.with_after(after)
+            page = query.do()["data"]["Get"][self.schema]
+            if not page:
+                return
+            for obj in page:
+                additional = obj.pop("_additional")
+                yield additional["id"], additional["vector"], obj
+            after = additional["id"]
+
+    def export_snapshot(
+        self,
+        directory: str,
+        page_size: int = 500,
+        chunk_size: int = CHUNK_SIZE,
+        include_image: bool = False,
+    ) -> dict:
+        """
+        Streams the collection with vectors and properties into a chunked snapshot, see
+        snapshot.py. Memory is bounded by one page plus one chunk.
+        """
+        with SnapshotWriter(
+            directory, self.client.schema.get(self.schema), chunk_size
+        ) as writer:
+            for object_id, vector, properties in self.iterate_objects(
+                page_size, include_image
+            ):
+                writer.add(object_id, vector, properties)
+        print(f"Exported {writer.manifest['count']} objects to {directory}")
+        return writer.manifest
 
-    def check_db(self) -> None:
+    def import_snapshot(self, directory: str, **kwargs) -> list:
+        """
+        Restores a snapshot into this client's collection through the batch api, the
+        collection is created from the snapshot config if it does not exist yet.
+        Objects keep their ids and vectors, so nothing is vectorized again.
+        """
+        manifest = read_manifest(directory)
+        if not self.client.schema.exists(self.schema):
+            config = dict(manifest["schema"])
+            config["class"] = self.schema
+            self.client.schema.create_class(config)
+        with self.batch(**kwargs) as batch:
+            for object_id, vector, properties in read_snapshot(directory):
+                batch.add(
+                    properties,
+                    vector=vector.tolist(),
+                    object_uuid=object_id,
+                    check_duplicates=False,
+                )
+        print(f"Imported {batch.num_added} objects from {directory}")
+        return batch.report
+
+    def group_counts(self, field: str) -> dict:
+        result = (
+            self.client.query.aggregate(self.schema)
+            .with_group_by_filter([field])
+            .with_fields("groupedBy { value } meta { count }")
+            .do()
+        )
+        return {
+            str(group["groupedBy"]["value"]): group["meta"]["count"]
+            for group in result["data"]["Aggregate"][self.schema]
+        }
+
+    def get_stats(self, window_minutes: float = 10) -> dict:
+        """
+        Machine readable statistics of the collection and of this client.
+        """
         result = (
             self.client.query.aggregate(self.schema).with_fields("meta {count}").do()
         )
-        print(result)
+        count = result["data"]["Aggregate"][self.schema][0]["meta"]["count"]
+        sample = (
+            self.client.query.get(self.schema, ["source"])
+            .with_additional(["vector"])
+            .with_limit(1)
+            .do()
+        )["data"]["Get"][self.schema]
+        dim = len(sample[0]["_additional"]["vector"]) if sample else 0
+        group_counts = {
+            field: self.group_counts(field)
+            for field in ["source_stripe", "landform_class"]
+        }
+        return self.collect_stats(
+            count,
+            group_counts,
+            dim,
+            self.client.schema.get(self.schema),
+            window_minutes,
+            self.imported_in_window(window_minutes),
+        )
+
+    def imported_in_window(self, window_minutes: float) -> Optional[int]:
+        result = (
+            self.client.query.aggregate(self.schema)
+            .with_where(created_since(window_minutes))
+            .with_fields("meta {count}")
+            .do()
+        )
+        # collections created without indexTimestamps cannot filter on creation time
+        if "errors" in result:
+            return None
+        return result["data"]["Aggregate"][self.schema][0]["meta"]["count"]
+
+    def check_db(self, window_minutes: float = 10) -> dict:
+        stats = self.get_stats(window_minutes)
+        print(json.dumps(stats, indent=2))
+        return stats
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
-import time, os, re, io, shutil, paramiko, pysftp
+import time, os, re, io, shutil, uuid, shlex, tempfile, paramiko, pysftp
 from flask import Flask, render_template, request, redirect, url_for, jsonify, session
+from werkzeug.utils import secure_filename
 from base64 import encodebytes
 from PIL import Image
 from pathlib import Path
@@ -18,6 +19,11 @@ def get_response_image(image_path):
 home_dir = str(Path.home())
 app = Flask(__name__, template_folder="template")
 app.secret_key = "BAD_SECRET_KEY"
+# queries go to the retrieval daemon on the server (retrieval_daemon.py serve), which
+# keeps the model loaded, instead of starting the query pipeline for every request
+USE_RETRIEVAL_DAEMON = True
+# extensions accepted for queued jobs, the remote file name is built from these only
+ALLOWED_EXTENSIONS = [".png", ".jpg", ".jpeg", ".tif", ".tiff"]
 # app.config['UPLOAD_FOLDER'] = "/Users/dusc/segmentation//"
 
 
@@ -32,6 +38,9 @@ def upload_file():
 
     folder = home_dir + "/msirs/static/"
     for filename in os.listdir(folder):
+        # results of queued jobs belong to other users, see job_status
+        if filename == "jobs":
+            continue
         file_path = os.path.join(folder, filename)
         try:
             if (
@@ -46,16 +55,16 @@ def upload_file():
             print(f"Failed to delete {file_path}. Reason: {e}")
 
     uploaded_file = request.files["file"]
-    if uploaded_file.filename != "":
-        path = f"static/query{str(uploaded_file.filename)[-4:]}"
-        uploaded_file.save(uploaded_file.filename)
-        shutil.move(str(uploaded_file.filename), path)
+    # the name ends up in a shell command on the retrieval host
+    filename = secure_filename(uploaded_file.filename)
+    if filename != "":
+        path = f"static/query{filename[-4:]}"
+        uploaded_file.save(path)
         server = Server()
-        server.connection.put(
-            path, f"/home/{server.username}/query/" + str(uploaded_file.filename)
-        )
+        remote_path = f"/home/{server.username}/query/{filename}"
+        server.connection.put(path, remote_path)
         # server.connection.put(path, f"/home/{server.username}/server-test/query{str(uploaded_file.filename)[-4:]}")
-        print(uploaded_file.filename)
+        print(filename)
 
         # execute pipeline and retrieve results
         # activate venv
@@ -82,16 +91,23 @@ def upload_file():
         # print(errdata)
 
         # TODO: dddddddd
-        stdin, stdout, stderr = server.ssh.exec_command(
-            "source ~/codebase-v1/venv/bin/activate && python3 ~/msirs/pipeline_v2_2_query.py"
-        )
+        # the daemon serves several uploads at once, each gets its own result folder
+        results_dir = f"/home/{server.username}/server-test/"
+        if USE_RETRIEVAL_DAEMON:
+            results_dir += uuid.uuid4().hex + "/"
+            command = (
+                "python3 ~/msirs/retrieval_daemon.py retrieve "
+                f"{shlex.quote(remote_path)} --folder {shlex.quote(results_dir)}"
+            )
+        else:
+            command = "source ~/codebase-v1/venv/bin/activate && python3 ~/msirs/pipeline_v2_2_query.py"
+        stdin, stdout, stderr = server.ssh.exec_command(command)
         stdout.channel.recv_exit_status()
         lines = stdout.readlines()
         distances = []
         for line in lines:
             if re.findall("Distances", line):
-                print(line.split(":")[-1][1:])
-                session["distances"] = json.loads(line.split(":")[-1][1:])
+                session["distances"] = json.loads(line.split(":", 1)[1])
                 # print(line)
 
         print(f"{distances = }")
@@ -103,29 +119,14 @@ def upload_file():
         #     item = item[:-1]
         #     print(item)
         # print("Pipeline finished..")
-        stdin, stdout, stderr = server.ssh.exec_command(
-            "ls ~/server-test | grep retrieval"
-        )
-        output = stdout.readlines()
-        for item in output:
-            item = item[:-1]
-            print(item)
-            server.connection.get(
-                f"/home/{server.username}/server-test/{item}",
-                home_dir + f"/msirs/static/{item}",
-            )
-
-        stdin, stdout, stderr = server.ssh.exec_command(
-            "ls ~/server-test | grep metadata"
-        )
-        output = stdout.readlines()
-        for item in output:
-            item = item[:-1]
-            print(item)
-            server.connection.get(
-                f"/home/{server.username}/server-test/{item}",
-                home_dir + f"/msirs/static/{item}",
-            )
+        for item in server.connection.listdir(results_dir):
+            if re.findall("retrieval|metadata", item):
+                print(item)
+                server.connection.get(
+                    results_dir + item, home_dir + f"/msirs/static/{item}"
+                )
+        if USE_RETRIEVAL_DAEMON:
+            server.ssh.exec_command(f"rm -rf {shlex.quote(results_dir)}")
 
         # close connections
         server.connection.close()
@@ -139,31 +140,120 @@ def upload_file():
 
 @app.route("/results")
 def results():
-    res_path = home_dir + "/msirs/static/"
-    files = os.listdir(res_path)
-    # results = [res_path+i for i in files if re.findall("result", i) or re.findall("query", i)]
-    results = [i for i in files if re.findall("retrieval", i)]
-    results = [f"retrieval_{i+1}.png" for i in range(len(results))]
+    return render_results(home_dir + "/msirs/static/", "")
+
+
+def render_results(res_path: str, prefix: str):
+    # metadata.json holds one entry per written hit, see PipelineV3.store_for_ui
     with open(res_path + "metadata.json") as f:
-        meta_data = json.load(f)
+        hits = json.load(f)
+    # hits keep the extension of their original, order them by number
+    hits = sorted(
+        hits, key=lambda hit: int(re.findall(r"retrieval_(\d+)", hit["file"])[0])
+    )
+    results = [prefix + hit["file"] for hit in hits]
     # format this here, such that the jinja loop only needs to display the string
-    meta_data_spelled_out = []
-    distances_spelled_out = [f"Distance: {i}" for i in meta_data["distances"]]
-    for idx in range(len(meta_data["distances"])):
-        for entry in meta_data["meta_data"].keys():
-            meta_data_spelled_out.append(
-                f"{entry}: {meta_data['meta_data'][entry][idx]}\n"
-            )
-
-    meta_data = [
-        [meta_data_spelled_out[i], distances_spelled_out[i]]
-        for i in range(len(meta_data["distances"]))
-    ]
+    meta_data = []
+    for hit in hits:
+        fields = (hit.get("meta_data") or {}).items()
+        spelled_out = "".join(
+            f"{field}: {value}\n" for field, value in fields if value is not None
+        )
+        meta_data.append([spelled_out, f"Distance: {hit.get('distance')}"])
     print(results)
     print(meta_data)
     return render_template("results.html", binderList=results, meta_data=meta_data)
 
 
+def daemon_request(server, command: str) -> tuple:
+    """
+    Runs a retrieval_daemon.py client command on the server, returns its json response
+    and the http status to answer with, the code of the daemon for its errors.
+    """
+    stdin, stdout, stderr = server.ssh.exec_command(command)
+    try:
+        response = json.loads(stdout.read())
+    except ValueError:
+        error = stderr.read().decode(errors="replace").strip()
+        return {"has_error": True, "error": error or "No response from the daemon"}, 502
+    if response.get("has_error"):
+        return response, response.get("code", 503)
+    return response, 200
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Uploads the query and queues a retrieval job in the daemon, the returned id is
+    polled at /jobs/<id>. Jobs run concurrently in their own workspaces.
+    """
+    uploaded_file = request.files["file"]
+    if uploaded_file.filename == "":
+        return jsonify({"error": "No file"}), 400
+    extension = os.path.splitext(uploaded_file.filename)[1].lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        return jsonify({"error": f"Unsupported file type {extension}"}), 400
+    server = Server()
+    # the client file name never reaches the remote shell, only a fresh unique name
+    name = uuid.uuid4().hex + extension
+    remote_path = f"/home/{server.username}/query/{name}"
+    local_path = f"static/upload_{name}"
+    uploaded_file.save(local_path)
+    server.connection.put(local_path, remote_path)
+    os.unlink(local_path)
+    status, code = daemon_request(
+        server, f"python3 ~/msirs/retrieval_daemon.py submit {shlex.quote(remote_path)}"
+    )
+    server.connection.close()
+    server.ssh.close()
+    return jsonify(status), code
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id: str):
+    """
+    Status record of the job, once it is done its results are copied into
+    static/jobs/<id>/ and can be viewed at /jobs/<id>/results.
+    """
+    if not re.fullmatch("[0-9a-f]{32}", job_id):
+        return jsonify({"error": "Unknown job"}), 404
+    server = Server()
+    status, code = daemon_request(
+        server, f"python3 ~/msirs/retrieval_daemon.py status {job_id}"
+    )
+    jobs_dir = home_dir + "/msirs/static/jobs"
+    local_dir = f"{jobs_dir}/{job_id}"
+    if status.get("status") == "done" and not os.path.exists(local_dir):
+        # fetched into a temporary folder per request first so a half copied job is
+        # never shown, concurrent polls each fetch and the first rename wins
+        os.makedirs(jobs_dir, exist_ok=True)
+        partial_dir = tempfile.mkdtemp(prefix=f"{job_id}.partial.", dir=jobs_dir)
+        try:
+            for item in server.connection.listdir(status["results"]):
+                server.connection.get(
+                    status["results"] + item, f"{partial_dir}/{item}"
+                )
+            os.rename(partial_dir, local_dir)
+        except OSError:
+            if not os.path.exists(local_dir):
+                raise
+        finally:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+    server.connection.close()
+    server.ssh.close()
+    return jsonify(status), code
+
+
+@app.route("/jobs/<job_id>/results")
+def job_results(job_id: str):
+    if not re.fullmatch("[0-9a-f]{32}", job_id):
+        return redirect(url_for("home"))
+    local_dir = home_dir + f"/msirs/static/jobs/{job_id}/"
+    if not os.path.exists(local_dir):
+        return redirect(url_for("home"))
+    return render_results(local_dir, f"jobs/{job_id}/")
+
+
 @app.route("/upload_success")
 def upload_suc():
     return render_template("success.html")
@@ -182,13 +272,14 @@ def upload_page():
 @app.route("/upload", methods=["POST"])
 def upload():
     uploaded_file = request.files["file"]
-    if uploaded_file.filename != "":
+    filename = secure_filename(uploaded_file.filename)
+    if filename != "":
         print("Received file")
         server = Server()
         # path = f"static/query{str(uploaded_file.filename)[-4:]}"
         # uploaded_file.save(uploaded_file.filename)
         stdin, stdout, stderr = server.ssh.exec_command(
-            f"source ~/codebase-v1/venv/bin/activate && python3 ~/msirs/pipeline_v2_2_import.py {uploaded_file.filename}"
+            f"source ~/codebase-v1/venv/bin/activate && python3 ~/msirs/pipeline_v2_2_import.py {shlex.quote(filename)}"
         )
 
     if 0 == 1: